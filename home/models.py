@@ -1,5 +1,6 @@
 import uuid
 import datetime
+from decimal import Decimal
 
 from django.db import models
 from django.contrib.auth.models import AbstractUser
@@ -42,10 +43,18 @@ class Client(models.Model):
         return self.user.username
 
     def get_portfolios_values(self):
-        ''''''
-        portfolios = self.portfolios.all()
+        '''
+        Returns the client's portfolios with their book_value and returns annotated (see 
+        Portfolio.with_values and Portfolio.with_returns) and their current_value at market 
+        prices, in a fixed number of queries however many portfolios there are.
+        '''
+        from table.models import Portfolio
+        from table.valuation import value_portfolios
+
+        portfolios = list(Portfolio.with_returns(Portfolio.with_values(self.user.portfolios.order_by('open_date', 'pk'))))
+        valuations = value_portfolios(portfolios)
         for portfolio in portfolios:
-            portfolio.current_value = portfolio.get_value_at_datetime()
+            portfolio.current_value = Decimal(str(valuations[portfolio.pk]['total_value']))
         return portfolios
 
 class Broker(models.Model):
@@ -15,6 +15,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import tempfile
 
 from django.contrib.messages import constants as messages
 
@@ -167,4 +168,49 @@ MESSAGE_TAGS = {
 
 # Third party apps configuration
 
-CRISPY_TEMPLATE_PACK = 'bootstrap4'
\ No newline at end of file
+CRISPY_TEMPLATE_PACK = 'bootstrap4'
+
+# Caches
+
+# a per-process LocMemCache by default. The cached market data and ticker index notice rows
+# inserted by other processes from the database (see Stock.get_cached_stocks_data and
+# Security.get_ticker_index); deployments that run several server processes may still set
+# CACHE_BACKEND to a shared backend, e.g. django.core.cache.backends.filebased.FileBasedCache
+# with a CACHE_LOCATION of their own, to compute them once for all processes
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Market data
+
+# the market chart on the client and guest overviews
+MARKET_OVERVIEW_DATA = {
+    'tickers': ['^DJI', '^GSPC', '^IXIC', 'IBM'],
+    'dates': ['2000-01-01', '2020-01-01'],
+    'points': 500,
+}
+
+# compute the overview market data into the cache at startup
+MARKET_DATA_WARMUP = os.getenv('MARKET_DATA_WARMUP') == 'True'
+
+# directory of the memory-mapped copy of the Stock table read by Stock.get_stocks_data and
+# Stock.get_quote (see table/price_store.py); build it with 'manage.py build_price_store'.
+# Unset disables the store.
+PRICE_STORE_DIR = os.getenv('PRICE_STORE_DIR')
+
+# Decision tables
+
+# count condition calls and time, case matches and evaluations per record from startup,
+# see utils.decision_table.decision_table.enable_profiling
+DECISION_TABLE_PROFILING = os.getenv('DECISION_TABLE_PROFILING') == 'True'
+
+# while profiling, each process dumps its profiles to a file in this directory every
+# DECISION_TABLE_PROFILE_INTERVAL seconds and at exit; read them with
+# 'manage.py decision_table_profile'
+DECISION_TABLE_PROFILE_DIR = os.getenv(
+    'DECISION_TABLE_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'invested_profiles')
+)
+DECISION_TABLE_PROFILE_INTERVAL = int(os.getenv('DECISION_TABLE_PROFILE_INTERVAL', '60'))
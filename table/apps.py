@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class TableConfig(AppConfig):
@@ -6,7 +7,7 @@ class TableConfig(AppConfig):
 
     def ready(self):
 
-        from table.models import StockTransactRecord, CashTransactionRecord, site_settings
+        from table.models import StockTransactRecord, CashTransactionRecord, Stock, site_settings
         from home.models import Company
         from settings.models import SiteSettings, StockManagementSettings , CashManagementSettings
         from .decision_tables.decision_tables import StockTransactRecordDecisionTable, CashTransactionRecordDecisionTable
@@ -31,5 +32,16 @@ class TableConfig(AppConfig):
         CashTransactionRecordDecisionTable.cash_management_settings = cash_management_settings
         CashTransactionRecord.decision_table = CashTransactionRecordDecisionTable()
         CashTransactionRecord.decision_table.setup_decision_table()
-        
-        
\ No newline at end of file
+
+        from .decision_tables.profiling import is_management_command
+
+        if settings.DECISION_TABLE_PROFILING and not is_management_command():
+            from .decision_tables.profiling import start_profile_dumps
+
+            tables = [StockTransactRecord.decision_table.decision_table, CashTransactionRecord.decision_table.decision_table]
+            for table in tables:
+                table.enable_profiling()
+            start_profile_dumps(settings.DECISION_TABLE_PROFILE_DIR, tables, settings.DECISION_TABLE_PROFILE_INTERVAL)
+
+        if settings.MARKET_DATA_WARMUP:
+            Stock.get_cached_stocks_data(**settings.MARKET_OVERVIEW_DATA)
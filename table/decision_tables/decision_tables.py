@@ -1,10 +1,207 @@
-from table.models import StockTransactRecord, StockInventory, CashTransactionRecord
+from table.models import StockTransactRecord, StockInventory, CashTransactionRecord, Portfolio
 from home.models import Company
 
 
 from utils.decision_table import decision_table
+from .inventory_cache import InventoryCache
 
 import json
+import threading
+import numpy as np
+
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import F, prefetch_related_objects
+from django.utils import timezone
+
+
+class InventoryShortfall(ValueError):
+    """
+    Raised by PendingWrites.flush when a portfolio no longer holds the shares to be taken from 
+    it, e.g. because a cached quantity was stale.
+    """
+
+
+class PendingWrites:
+    """
+    Portfolio cash and StockInventory changes collected while records run through a decision 
+    table. Actions only change records in memory and add their side effects here; flush() then 
+    writes each affected portfolio and inventory row once, however many states the records 
+    passed through. Changes are applied as F() increments so concurrent writers don't lose 
+    updates, and a decrease only applies if enough shares are still held.
+    """
+
+    def __init__(self, inventory_cache= None):
+        self.cash = {} # portfolio pk: change in cash
+        self.inventory = {} # (portfolio pk, ticker): [exchange_abbr, change in quantity]
+        # an InventoryCache to update once the inventory changes are committed
+        self.inventory_cache = inventory_cache
+
+    def add_cash(self, portfolio, amount):
+        self.cash[portfolio.pk] = self.cash.get(portfolio.pk, 0) + amount
+
+    def add_inventory(self, portfolio, exchange_abbr, ticker, quantity):
+        key = (portfolio.pk, ticker)
+        if key in self.inventory:
+            self.inventory[key][1] += quantity
+        else:
+            self.inventory[key] = [exchange_abbr, quantity]
+
+    def flush(self):
+        """Writes the collected changes inside one transaction and clears them."""
+        with db_transaction.atomic():
+            for portfolio_id, amount in self.cash.items():
+                if amount:
+                    Portfolio.objects.filter(pk= portfolio_id).update(cash= F('cash') + amount)
+
+            for (portfolio_id, ticker), (exchange_abbr, quantity) in self.inventory.items():
+                if not quantity:
+                    continue
+                rows = StockInventory.objects.filter(portfolio_id= portfolio_id, ticker= ticker)
+                if quantity < 0:
+                    # shares are taken from the row the routing checked, whatever its exchange
+                    rows = rows.filter(quantity__gte= -quantity)
+                else:
+                    rows = rows.filter(exchange_abbr= exchange_abbr)
+                updated = rows.update(quantity= F('quantity') + quantity)
+                if not updated:
+                    if quantity < 0:
+                        # a cached quantity was stale, e.g. another process sold the shares first
+                        if self.inventory_cache is not None:
+                            self.inventory_cache.invalidate()
+                        raise InventoryShortfall(
+                            'portfolio ' + str(portfolio_id) + ' does not hold ' + str(-quantity) + ' shares of ' + ticker
+                        )
+                    try:
+                        with db_transaction.atomic():
+                            StockInventory.objects.create(
+                                portfolio_id= portfolio_id,
+                                exchange_abbr= exchange_abbr,
+                                ticker= ticker,
+                                quantity= quantity
+                            )
+                    except IntegrityError:
+                        # another request created the row since the update; add to it instead
+                        if not rows.update(quantity= F('quantity') + quantity):
+                            raise
+                elif self.inventory_cache is not None:
+                    db_transaction.on_commit(
+                        lambda args= (portfolio_id, ticker, quantity): self.inventory_cache.adjust(*args)
+                    )
+
+        self.cash = {}
+        self.inventory = {}
+
+
+class CompanyHoldings:
+    """
+    The company master portfolio's holdings as seen by the orders of one processing run. A 
+    ticker is read from the InventoryCache the first time it is needed and is then lowered by 
+    every order routed to the company, so that orders later in a batch are checked against 
+    the shares still left, as they would be if they were processed one at a time. An order's 
+    shares are taken when it is classed internal, or when it completes if it was classed 
+    internal before the run, and given back if it is rejected instead.
+    """
+
+    def __init__(self, inventory_cache, portfolio):
+        self.inventory_cache = inventory_cache
+        self.portfolio = portfolio
+        self.quantities = {} # ticker: quantity left, or None if the company has no inventory row
+        self.taken = set() # ids of the orders whose shares were taken during this run
+
+    def get(self, ticker):
+        if ticker not in self.quantities:
+            self.quantities[ticker] = self.inventory_cache.get(self.portfolio, ticker)
+        return self.quantities[ticker]
+
+    def get_many(self, tickers):
+        missing = list({ticker for ticker in tickers if ticker not in self.quantities})
+        if missing:
+            self.quantities.update(zip(missing, self.inventory_cache.get_many(self.portfolio, missing)))
+        return [self.quantities[ticker] for ticker in tickers]
+
+    def has_taken(self, order):
+        return id(order) in self.taken
+
+    def take(self, order):
+        """Lowers the quantity left of the order's ticker by the order's quantity, once per order."""
+        if id(order) not in self.taken:
+            self.taken.add(id(order))
+            self.quantities[order.ticker] = (self.get(order.ticker) or 0) - order.quantity
+
+    def give_back(self, order):
+        """Undoes take() for an order that will not complete."""
+        if id(order) in self.taken:
+            self.taken.discard(id(order))
+            self.quantities[order.ticker] += order.quantity
+
+
+def undo_cash(records, writes):
+    """
+    Takes the cash changes collected in writes back out of the records' in-memory portfolios, 
+    once per portfolio, after writing them failed.
+
+    :param records: records with a 'portfolio' foreign key
+    :type records: list
+
+    :param writes: the writes that were not made
+    :type writes: PendingWrites
+    """
+    undone = set()
+    for record in records:
+        if record.portfolio_id in writes.cash and record.portfolio_id not in undone:
+            undone.add(record.portfolio_id)
+            record.portfolio.cash -= writes.cash[record.portfolio_id]
+
+
+def save_records(model, records, fields):
+    """
+    Saves records without sending pre_save, which would run them through the decision table 
+    again: new records with one bulk_create, existing ones with one bulk_update.
+
+    :param model: the records' model
+    :type model: django.db.models.Model
+
+    :param records: the records to save
+    :type records: list
+
+    :param fields: the fields the decision table may have changed
+    :type fields: list of str
+    """
+    new_records = [record for record in records if record._state.adding]
+    old_records = [record for record in records if not record._state.adding]
+    if new_records:
+        model.objects.bulk_create(new_records)
+        for record in new_records:
+            record._state.adding = False
+    if old_records:
+        model.objects.bulk_update(old_records, fields)
+
+
+def split_by_portfolio(records):
+    """
+    Splits records into groups in which each portfolio appears at most once, keeping the 
+    order of the records of each portfolio. Records of the same portfolio are made to share 
+    one Portfolio instance so that cash changes made while processing one record are seen by 
+    the next. Used by the batch processing methods so that checks against portfolio cash 
+    behave as if the records were processed one at a time.
+
+    :param records: records with a 'portfolio' foreign key
+    :type records: list
+
+    :rtype: list of lists
+    """
+    portfolios = {}
+    groups = []
+    counts = {}
+    for record in records:
+        portfolio = portfolios.setdefault(record.portfolio_id, record.portfolio)
+        record.portfolio = portfolio
+        index = counts.get(record.portfolio_id, 0)
+        counts[record.portfolio_id] = index + 1
+        if index == len(groups):
+            groups.append([])
+        groups[index].append(record)
+    return groups
 
 class StockTransactRecordDecisionTable:
 
@@ -16,6 +213,10 @@ class StockTransactRecordDecisionTable:
 
     def __init__(self):
         self.decision_table = decision_table('StockTransactRecordDecisionTable')
+        # holds the PendingWrites of the orders being processed by the current thread
+        self.local = threading.local()
+        # ticker: quantity of company_master_portfolio's inventory, see load_company_inventory
+        self.company_inventory = InventoryCache()
 
     def __str__(self):
         return str(self.decision_table)
@@ -72,83 +273,150 @@ class StockTransactRecordDecisionTable:
             order.order_class == order.__class__.TRANSACTION_CLASS.undetermined.name
         )
 
-    def are_ticker_and_quantity_in_inventory(self, order):
+    # the conditions below declare the data they need with 'requires' in setup_decision_table
+    # and get it from the order's context (see the loaders)
+
+    def are_ticker_and_quantity_in_inventory(self, order, context):
+        held = context['company_inventory']
+        return (
+            (held is not None) and 
+            (order.quantity <= held)
+        )
+
+    def does_order_pass_internal_checks(self, order, context):
+        held = context['company_inventory']
+        settings = context['settings']
         return (
-            (order.ticker in [x[0] for x in self.company_master_portfolio.stockinventory.all().values_list('ticker').distinct()]) and 
-            (order.quantity <= self.company_master_portfolio.stockinventory.get(ticker= order.ticker).quantity)
+            (held is not None) and (held > 0) and
+            ((order.quantity / held) < settings.internal_share_proportion_threshold) and        
+            ((order.price * order.quantity) < settings.internal_value_threshold)
         )
 
-    def does_order_pass_internal_checks(self, order):
+    def does_order_pass_external_checks(self, order, context):
+        settings = context['settings']
         return (
-            ((order.quantity / self.company_master_portfolio.stockinventory.get(ticker= order.ticker).quantity) < self.stock_management_settings.internal_share_proportion_threshold) and        
-            ((order.price * order.quantity) < self.stock_management_settings.internal_value_threshold)
+            ((order.quantity/ 10000000) < settings.external_share_proportion_threshold) and
+            ((order.price * order.quantity) < settings.external_value_threshold)
         )
 
-    def does_order_pass_external_checks(self, order):
+    def is_value_of_order_leq_than_portfolio_cash(self, order, context):
         return (
-            ((order.quantity/ 10000000) < self.stock_management_settings.external_share_proportion_threshold) and
-            ((order.price * order.quantity) < self.stock_management_settings.external_value_threshold)
+            (order.price * order.quantity) <= context['portfolio'].cash
         )
 
-    def is_value_of_order_leq_than_portfolio_cash(self, order):
+    #---batch conditions---#
+
+    def batch_are_ticker_and_quantity_in_inventory(self, orders, contexts):
+        held = [context['company_inventory'] for context in contexts]
+        in_inventory = np.array([quantity is not None for quantity in held], dtype= bool)
+        held = np.array([quantity or 0 for quantity in held], dtype= np.int64)
+        quantities = np.array([order.quantity for order in orders], dtype= np.int64)
+        return in_inventory & (quantities <= held)
+
+    def batch_does_order_pass_internal_checks(self, orders, contexts):
+        held = np.array([context['company_inventory'] or 0 for context in contexts], dtype= np.float64)
+        quantities = np.array([order.quantity for order in orders], dtype= np.float64)
+        values = np.array([order.price * order.quantity for order in orders], dtype= np.float64)
+        with np.errstate(divide= 'ignore', invalid= 'ignore'):
+            proportions = quantities / held
         return (
-            (order.price * order.quantity) <= order.portfolio.cash
+            (held > 0) & 
+            (proportions < float(self.stock_management_settings.internal_share_proportion_threshold)) &
+            (values < float(self.stock_management_settings.internal_value_threshold))
         )
 
+    #---decision table loaders---#
+
+    def load_portfolio(self, order):
+        return order.portfolio
+
+    def batch_load_portfolio(self, orders):
+        prefetch_related_objects(orders, 'portfolio')
+        return [order.portfolio for order in orders]
+
+    def company_holdings(self):
+        '''The CompanyHoldings of the run in progress on this thread, or fresh ones read from self.company_inventory.'''
+        holdings = getattr(self.local, 'holdings', None)
+        if holdings is None:
+            holdings = CompanyHoldings(self.company_inventory, self.company_master_portfolio)
+        return holdings
+
+    def load_company_inventory(self, order):
+        '''The quantity of the order's ticker left to the company master portfolio, or None.'''
+        return self.company_holdings().get(order.ticker)
+
+    def batch_load_company_inventory(self, orders):
+        return self.company_holdings().get_many([order.ticker for order in orders])
+
+    def load_settings(self, order):
+        return self.stock_management_settings
+
     #---decision table actions---#
 
+    # actions only change the order in memory; the order row is written by the save() that 
+    # triggered processing and the other writes are collected in self.local.writes. Shares 
+    # routed to the company are tracked in self.local.holdings
+
     def save_order_class_as_internal(self, order):
         order.order_class = StockTransactRecord.TRANSACTION_CLASS.internal.name
-        order.save()
+        self.local.holdings.take(order)
 
     def save_order_class_as_external(self, order):
         order.order_class = StockTransactRecord.TRANSACTION_CLASS.external.name
-        order.save()
 
     def save_order_status_as_approved(self, order):
         order.order_status = StockTransactRecord.STATUS.approved.name
-        order.save()
 
     def save_order_status_as_rejected(self, order):
         order.order_status = StockTransactRecord.STATUS.rejected.name
-        order.save()
+        self.local.holdings.give_back(order)
 
     def remove_value_of_order_from_portfolio_cash(self, order):
         '''Removes value of order from client's portfolio and adds stock quantity to the StockInventory of this order's portfolio.'''
-        order.portfolio.cash -= (order.price * order.quantity)
+        value = order.price * order.quantity
+        order.portfolio.cash -= value
         order.order_status = StockTransactRecord.STATUS.completed.name
-        order.portfolio.save()
 
-        sti, created = StockInventory.objects.get_or_create(
-            portfolio= order.portfolio,
-            exchange_abbr= order.exchange_abbr,
-            ticker= order.ticker,
-        )
-        sti.quantity += order.quantity
-        sti.save()
+        writes = self.local.writes
+        writes.add_cash(order.portfolio, -value)
+        writes.add_inventory(order.portfolio, order.exchange_abbr, order.ticker, order.quantity)
 
         if order.order_class == StockTransactRecord.TRANSACTION_CLASS.internal.name:
-            stock = self.company_master_portfolio.stockinventory.all().get(ticker= order.ticker)
-            stock.quantity -= order.quantity
-            stock.save()
+            self.local.holdings.take(order)
+            writes.add_inventory(self.company_master_portfolio, order.exchange_abbr, order.ticker, -order.quantity)
             print(str(order.quantity) + " shares of " + order.ticker + " removed from company portfolio.")
 
 
     #---decision table setup---#
     def setup_decision_table(self):
+        self.decision_table.add_loader('portfolio', self.load_portfolio, self.batch_load_portfolio)
+        self.decision_table.add_loader('company_inventory', self.load_company_inventory, self.batch_load_company_inventory)
+        self.decision_table.add_loader('settings', self.load_settings)
+
+        # costs: 1 for a field compare (default), 2 for a possibly unloaded portfolio or the cached company inventory
         self.decision_table.add_condition(self.is_order_status_processing)
         self.decision_table.add_condition(self.is_order_status_approved)
         self.decision_table.add_condition(self.is_order_status_rejected)
         self.decision_table.add_condition(self.is_order_type_buy)
         self.decision_table.add_condition(self.is_order_type_sell)
-        self.decision_table.add_condition(self.is_broker_review_requested)
+        self.decision_table.add_condition(self.is_broker_review_requested, selectivity= 0.05)
         self.decision_table.add_condition(self.is_order_class_internal)
         self.decision_table.add_condition(self.is_order_class_external)
         self.decision_table.add_condition(self.is_order_class_undetermined)
-        self.decision_table.add_condition(self.are_ticker_and_quantity_in_inventory)
-        self.decision_table.add_condition(self.does_order_pass_internal_checks)
-        self.decision_table.add_condition(self.does_order_pass_external_checks)
-        self.decision_table.add_condition(self.is_value_of_order_leq_than_portfolio_cash)
+        self.decision_table.add_condition(
+            self.are_ticker_and_quantity_in_inventory, 
+            cost= 2, 
+            batch_function= self.batch_are_ticker_and_quantity_in_inventory,
+            requires= ('company_inventory',)
+        )
+        self.decision_table.add_condition(
+            self.does_order_pass_internal_checks, 
+            cost= 2, 
+            batch_function= self.batch_does_order_pass_internal_checks,
+            requires= ('company_inventory', 'settings')
+        )
+        self.decision_table.add_condition(self.does_order_pass_external_checks, requires= ('settings',))
+        self.decision_table.add_condition(self.is_value_of_order_leq_than_portfolio_cash, cost= 2, requires= ('portfolio',))
 
         self.decision_table.add_action(self.save_order_class_as_internal)
         self.decision_table.add_action(self.save_order_status_as_approved)
@@ -233,24 +501,127 @@ class StockTransactRecordDecisionTable:
             actions = [self.save_order_status_as_rejected]
         )
 
-    def process_order(self, order):
-        conditions = self.decision_table.conditions
+        self.decision_table.compile()
 
+    def process_order(self, order):
+        """
+        Runs an order through the decision table until it is rejected or completed, or no case 
+        applies, then writes the portfolio cash and StockInventory changes once each. Called 
+        from the order's pre_save, so the order row itself is written by that save(); see 
+        StockTransactRecord.save for the enclosing transaction.
+
+        If the company no longer holds the shares the order was routed internal for, because 
+        the cached company inventory was stale, nothing is written; the order is put back in 
+        the state it arrived in and evaluated again against the inventory read from the 
+        database.
+
+        :param order: the order to process
+        :type order: StockTransactRecord
+        """
+        state = (order.order_status, order.order_class)
+        for attempt in range(2):
+            self.local.writes = writes = PendingWrites(self.company_inventory)
+            self.local.holdings = CompanyHoldings(self.company_inventory, self.company_master_portfolio)
+            try:
+                self.run_order(order)
+                writes.flush()
+                return
+            except InventoryShortfall:
+                if attempt:
+                    raise
+                order.order_status, order.order_class = state
+                undo_cash([order], writes)
+            finally:
+                self.local.writes = None
+                self.local.holdings = None
+
+    def run_order(self, order):
+        """Applies the actions of the cases the order matches until it is rejected or completed."""
         terminal_conditions = [
             StockTransactRecord.STATUS.rejected.name,
             StockTransactRecord.STATUS.completed.name
         ]
+        context = self.decision_table.new_context(order)
         while order.order_status not in terminal_conditions:
-            condition_args = dict(
-                zip(
-                    list(conditions.keys()), len(conditions) * [(order,)]
-                )
-            )
-            actions = self.decision_table.get_actions(condition_args)
+            actions = self.decision_table.evaluate(order, context= context)
+            if not actions:
+                break
             for action in actions:
                 print(action.__name__)
                 action(order)
 
+    def process_orders(self, orders):
+        """
+        Runs many orders through the decision table together, e.g. for end-of-day processing 
+        or bulk imports. Each round evaluates the conditions for all unfinished orders at once 
+        with decision_table.evaluate_batch and applies the resulting action plans. Orders of the 
+        same portfolio are processed in successive groups (see split_by_portfolio). Orders for 
+        which no case applies are left in their current state. At the end the orders, portfolio 
+        cash and StockInventory rows are written in one transaction without sending pre_save.
+
+        The company's holdings are shared by the whole batch (see CompanyHoldings): the actions 
+        of each round are applied in order, and an order whose plan was computed from shares 
+        an earlier order has since taken is evaluated again against the shares left. As with 
+        process_order, a batch that finds the cached company inventory stale is put back and 
+        run again against the inventory read from the database.
+
+        :param orders: the orders to process
+        :type orders: list of StockTransactRecord
+        """
+        orders = list(orders)
+        prefetch_related_objects(orders, 'portfolio')
+        states = [(order.order_status, order.order_class) for order in orders]
+        for attempt in range(2):
+            self.local.writes = writes = PendingWrites(self.company_inventory)
+            self.local.holdings = CompanyHoldings(self.company_inventory, self.company_master_portfolio)
+            try:
+                self.run_orders(orders)
+                with db_transaction.atomic():
+                    # inventory first, so a shortfall fails before any order is saved
+                    writes.flush()
+                    save_records(StockTransactRecord, orders, ['order_status', 'order_class'])
+                return
+            except InventoryShortfall:
+                if attempt:
+                    raise
+                for order, (order_status, order_class) in zip(orders, states):
+                    order.order_status = order_status
+                    order.order_class = order_class
+                undo_cash(orders, writes)
+            finally:
+                self.local.writes = None
+                self.local.holdings = None
+
+    def run_orders(self, orders):
+        """The rounds of process_orders, see there."""
+        terminal_conditions = [
+            StockTransactRecord.STATUS.rejected.name,
+            StockTransactRecord.STATUS.completed.name
+        ]
+        holdings = self.local.holdings
+        for group in split_by_portfolio(orders):
+            active = [order for order in group if order.order_status not in terminal_conditions]
+            contexts = [self.decision_table.new_context(order) for order in active]
+            while active:
+                plan = self.decision_table.evaluate_batch(active, contexts)
+                still_active = []
+                still_active_contexts = []
+                for order, context, actions in zip(active, contexts, plan):
+                    if 'company_inventory' in context and not holdings.has_taken(order):
+                        held = holdings.get(order.ticker)
+                        if context['company_inventory'] != held:
+                            context['company_inventory'] = held
+                            actions = self.decision_table.evaluate(order, context= context)
+                    if not actions:
+                        continue
+                    for action in actions:
+                        action(order)
+                    if order.order_status not in terminal_conditions:
+                        still_active.append(order)
+                        still_active_contexts.append(context)
+                active = still_active
+                contexts = still_active_contexts
+
 
 class CashTransactionRecordDecisionTable:
 
@@ -260,6 +631,8 @@ class CashTransactionRecordDecisionTable:
 
     def __init__(self):
         self.decision_table = decision_table('CashTransactionRecordDecisionTable')
+        # holds the PendingWrites of the transactions being processed by the current thread
+        self.local = threading.local()
 
     def __str__(self):
         return str(self.decision_table)
@@ -282,48 +655,51 @@ class CashTransactionRecordDecisionTable:
     def is_type_stock_sell_proceeds(self, transaction):
         return transaction.transaction_type == CashTransactionRecord.TRANSACTION_TYPE.stock_sell_proceeds.name
 
-    def is_client(self, transaction):
-        return transaction.portfolio.owner.is_client
+    # conditions taking a context declare the data they need with 'requires' in 
+    # setup_decision_table and get it from the transaction's context (see the loaders)
+
+    def is_client(self, transaction, context):
+        return context['owner'].is_client
 
-    def is_broker(self, transaction):
-        return transaction.portfolio.owner.is_broker
+    def is_broker(self, transaction, context):
+        return context['owner'].is_broker
 
-    def is_company(self, transaction):
-        return transaction.portfolio.owner.is_company
+    def is_company(self, transaction, context):
+        return context['owner'].is_company
 
-    def is_under_client_one_external_deposit_max(self, transaction):
+    def is_under_client_one_external_deposit_max(self, transaction, context):
         return (
-            transaction.amount_in_USD <= self.cash_management_settings.client_one_external_deposit_max
+            transaction.amount_in_USD <= context['settings'].client_one_external_deposit_max
         )
 
-    def is_over_client_one_external_deposit_min(self, transaction):
+    def is_over_client_one_external_deposit_min(self, transaction, context):
         return (
-            transaction.amount_in_USD >= self.cash_management_settings.client_one_external_deposit_min
+            transaction.amount_in_USD >= context['settings'].client_one_external_deposit_min
         )
 
-    def is_already_at_client_total_deposit_max(self, transaction):
+    def is_already_at_client_total_deposit_max(self, transaction, context):
         return (
-            transaction.portfolio.cash == self.cash_management_settings.client_total_deposit_max
+            context['portfolio'].cash == context['settings'].client_total_deposit_max
         )
 
-    def would_deposit_be_over_client_total_deposit_max(self, transaction):
+    def would_deposit_be_over_client_total_deposit_max(self, transaction, context):
         return (
-            (transaction.amount_in_USD + transaction.portfolio.cash) > self.cash_management_settings.client_total_deposit_max
+            (transaction.amount_in_USD + context['portfolio'].cash) > context['settings'].client_total_deposit_max
         )
 
-    def is_already_at_client_total_deposit_min(self, transaction):
+    def is_already_at_client_total_deposit_min(self, transaction, context):
         return (
-            transaction.portfolio.cash == self.cash_management_settings.client_total_deposit_min
+            context['portfolio'].cash == context['settings'].client_total_deposit_min
         )
 
-    def would_withdrawal_be_under_client_total_deposit_min(self, transaction):
+    def would_withdrawal_be_under_client_total_deposit_min(self, transaction, context):
         return (
-            (transaction.portfolio.cash - transaction.amount_in_USD) < self.cash_management_settings.client_total_deposit_min
+            (context['portfolio'].cash - transaction.amount_in_USD) < context['settings'].client_total_deposit_min
         )
 
-    def is_over_client_external_withdrawal_max(self, transaction):
+    def is_over_client_external_withdrawal_max(self, transaction, context):
         return (
-            transaction.amount_in_USD > self.cash_management_settings.client_external_withdrawal_max
+            transaction.amount_in_USD > context['settings'].client_external_withdrawal_max
         )
 
     def is_status_approved(self, transaction):
@@ -342,32 +718,56 @@ class CashTransactionRecordDecisionTable:
         return transaction.status == CashTransactionRecord.STATUS.completed.name
 
 
+    #---decision table loaders---#
+
+    def load_portfolio(self, transaction):
+        return transaction.portfolio
+
+    def batch_load_portfolio(self, transactions):
+        prefetch_related_objects(transactions, 'portfolio')
+        return [transaction.portfolio for transaction in transactions]
+
+    def load_owner(self, transaction):
+        return transaction.portfolio.owner
+
+    def batch_load_owner(self, transactions):
+        prefetch_related_objects(transactions, 'portfolio__owner')
+        return [transaction.portfolio.owner for transaction in transactions]
+
+    def load_settings(self, transaction):
+        return self.cash_management_settings
+
     #---action functions---#
 
+    # actions only change the transaction in memory; the transaction row is written by the 
+    # save() that triggered processing and the cash change is collected in self.local.writes
+
+    # the time a transaction is completed is when its cash moved, which valuations at past
+    # dates rely on
+
     def withdraw_cash_from_portfolio(self, transaction):
         transaction.portfolio.cash -= transaction.amount_in_USD
         transaction.status = CashTransactionRecord.STATUS.completed.name
-        transaction.portfolio.save()
+        transaction.transaction_datetime = timezone.now()
+        self.local.writes.add_cash(transaction.portfolio, -transaction.amount_in_USD)
 
     def deposit_cash_into_portfolio(self, transaction):
         transaction.portfolio.cash += transaction.amount_in_USD
         transaction.status = CashTransactionRecord.STATUS.completed.name
-        transaction.portfolio.save()
+        transaction.transaction_datetime = timezone.now()
+        self.local.writes.add_cash(transaction.portfolio, transaction.amount_in_USD)
 
     def save_transaction_as_approved(self, transaction):
         transaction.status = CashTransactionRecord.STATUS.approved.name
-        transaction.save()
 
     def save_transaction_as_rejected(self, transaction):
         transaction.status = CashTransactionRecord.STATUS.rejected.name
-        transaction.save()
 
     def get_transaction_conditions(self, transaction):
-        json_message = dict()
+        json_message = self.decision_table.condition_values(transaction)
 
-        for condition, condition_function in self.decision_table.conditions.items():
-            print(condition_function.__name__ + ': ', condition_function(transaction))
-            json_message[condition_function.__name__] = condition_function(transaction)
+        for name, value in json_message.items():
+            print(name + ': ', value)
 
         print('')
 
@@ -375,18 +775,23 @@ class CashTransactionRecordDecisionTable:
 
     #---decision table setup---#
     def setup_decision_table(self):
+        self.decision_table.add_loader('portfolio', self.load_portfolio, self.batch_load_portfolio)
+        self.decision_table.add_loader('owner', self.load_owner, self.batch_load_owner)
+        self.decision_table.add_loader('settings', self.load_settings)
+
+        # costs: 1 for a field compare (default), 2 for a possibly unloaded portfolio, 5 for the portfolio owner
         self.decision_table.add_condition(self.is_type_external_deposit) # 0
         self.decision_table.add_condition(self.is_type_external_withdrawal) # 1
-        self.decision_table.add_condition(self.is_client) # 2
-        self.decision_table.add_condition(self.is_broker) # 3
-        self.decision_table.add_condition(self.is_company) # 4
-        self.decision_table.add_condition(self.is_under_client_one_external_deposit_max) # 5
-        self.decision_table.add_condition(self.is_over_client_one_external_deposit_min) # 6
-        self.decision_table.add_condition(self.is_already_at_client_total_deposit_max) # 7
-        self.decision_table.add_condition(self.would_deposit_be_over_client_total_deposit_max) # 8
-        self.decision_table.add_condition(self.is_already_at_client_total_deposit_min) # 9
-        self.decision_table.add_condition(self.would_withdrawal_be_under_client_total_deposit_min) # 10
-        self.decision_table.add_condition(self.is_over_client_external_withdrawal_max) # 11
+        self.decision_table.add_condition(self.is_client, cost= 5, requires= ('owner',)) # 2
+        self.decision_table.add_condition(self.is_broker, cost= 5, requires= ('owner',)) # 3
+        self.decision_table.add_condition(self.is_company, cost= 5, requires= ('owner',)) # 4
+        self.decision_table.add_condition(self.is_under_client_one_external_deposit_max, requires= ('settings',)) # 5
+        self.decision_table.add_condition(self.is_over_client_one_external_deposit_min, requires= ('settings',)) # 6
+        self.decision_table.add_condition(self.is_already_at_client_total_deposit_max, cost= 2, requires= ('portfolio', 'settings')) # 7
+        self.decision_table.add_condition(self.would_deposit_be_over_client_total_deposit_max, cost= 2, requires= ('portfolio', 'settings')) # 8
+        self.decision_table.add_condition(self.is_already_at_client_total_deposit_min, cost= 2, requires= ('portfolio', 'settings')) # 9
+        self.decision_table.add_condition(self.would_withdrawal_be_under_client_total_deposit_min, cost= 2, requires= ('portfolio', 'settings')) # 10
+        self.decision_table.add_condition(self.is_over_client_external_withdrawal_max, requires= ('settings',)) # 11
         self.decision_table.add_condition(self.is_status_approved) # 12
         self.decision_table.add_condition(self.is_status_rejected) # 13
         self.decision_table.add_condition(self.is_status_processing) # 14
@@ -475,29 +880,82 @@ class CashTransactionRecordDecisionTable:
             actions= [self.withdraw_cash_from_portfolio],
             name= "withdraw_cash_from_client_portfolio_cover_stock_buy_order"
         )
+
+        self.decision_table.compile()
     
     def process_transaction(self, transaction):
-        conditions = self.decision_table.conditions
-
+        """
+        Runs a cash transaction through the decision table until it is rejected or completed, 
+        then writes the portfolio cash change once. Called from the transaction's pre_save, so 
+        the transaction row itself is written by that save(); see CashTransactionRecord.save 
+        for the enclosing transaction.
+
+        :param transaction: the transaction to process
+        :type transaction: CashTransactionRecord
+        """
         terminal_conditions = [
             CashTransactionRecord.STATUS.rejected.name,
             CashTransactionRecord.STATUS.completed.name
         ]
 
-        while (transaction.status not in terminal_conditions):
-            condition_args = dict(
-                zip(
-                    list(conditions.keys()), len(conditions) * [(transaction,)]
-                )
-            )
-            #self.get_transaction_conditions(transaction)
-            actions = self.decision_table.get_actions(condition_args)
-            if actions:
-                for action in actions:
-                    print(action.__name__)
-                    action(transaction)
-            else: # catch all for conditions that yield no action
-                #transaction.transaction_conditions = self.get_transaction_conditions(transaction)
-                self.save_transaction_as_rejected(transaction)
-
-        
\ No newline at end of file
+        context = self.decision_table.new_context(transaction)
+        self.local.writes = PendingWrites()
+        try:
+            while (transaction.status not in terminal_conditions):
+                #self.get_transaction_conditions(transaction)
+                actions = self.decision_table.evaluate(transaction, context= context)
+                if actions:
+                    for action in actions:
+                        print(action.__name__)
+                        action(transaction)
+                else: # catch all for conditions that yield no action
+                    #transaction.transaction_conditions = self.get_transaction_conditions(transaction)
+                    self.save_transaction_as_rejected(transaction)
+
+            self.local.writes.flush()
+        finally:
+            self.local.writes = None
+
+    def process_transactions(self, transactions):
+        """
+        Runs many cash transactions through the decision table together, e.g. for bulk 
+        imports. Each round evaluates the conditions for all unfinished transactions at once 
+        with decision_table.evaluate_batch and applies the resulting action plans. Transactions 
+        of the same portfolio are processed in successive groups (see split_by_portfolio). As 
+        with process_transaction, a transaction for which no case applies is rejected. At the 
+        end the transactions and portfolio cash are written in one transaction without sending 
+        pre_save.
+
+        :param transactions: the transactions to process
+        :type transactions: list of CashTransactionRecord
+        """
+        terminal_conditions = [
+            CashTransactionRecord.STATUS.rejected.name,
+            CashTransactionRecord.STATUS.completed.name
+        ]
+        transactions = list(transactions)
+        prefetch_related_objects(transactions, 'portfolio__owner')
+        self.local.writes = PendingWrites()
+        try:
+            for group in split_by_portfolio(transactions):
+                active = [transaction for transaction in group if transaction.status not in terminal_conditions]
+                contexts = [self.decision_table.new_context(transaction) for transaction in active]
+                while active:
+                    plan = self.decision_table.evaluate_batch(active, contexts)
+                    for transaction, actions in zip(active, plan):
+                        if actions:
+                            for action in actions:
+                                action(transaction)
+                        else:
+                            self.save_transaction_as_rejected(transaction)
+                    contexts = [
+                        context for transaction, context in zip(active, contexts) 
+                        if transaction.status not in terminal_conditions
+                    ]
+                    active = [transaction for transaction in active if transaction.status not in terminal_conditions]
+
+            with db_transaction.atomic():
+                save_records(CashTransactionRecord, transactions, ['status', 'transaction_datetime'])
+                self.local.writes.flush()
+        finally:
+            self.local.writes = None
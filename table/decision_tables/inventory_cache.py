@@ -0,0 +1,88 @@
+import threading
+import time
+
+
+class InventoryCache:
+    """
+    An in-memory ticker: quantity map of one portfolio's StockInventory, used by
+    StockTransactRecordDecisionTable to route orders between the company master portfolio and
+    the market without a database round trip.
+
+    The map is loaded with one query the first time it is read for a portfolio and reloaded
+    after max_age seconds, which bounds how stale it can get when other processes write to
+    the inventory. A stale quantity never fails an order: PendingWrites.flush only takes
+    shares that are still held and otherwise invalidates the map, and the order is evaluated
+    again against the reloaded inventory. Writes in this process keep it current:
+    PendingWrites.flush calls adjust() and the StockInventory post_save/post_delete receivers
+    call set()/discard(). All access goes through a lock so concurrent requests see a
+    consistent map.
+    """
+
+    def __init__(self, max_age= 60):
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.portfolio_id = None
+        self.quantities = None
+        self.loaded_at = 0
+
+    def load(self, portfolio):
+        """Reads the portfolio's whole inventory with one query."""
+        quantities = dict(portfolio.stockinventory.all().values_list('ticker', 'quantity'))
+        with self.lock:
+            self.portfolio_id = portfolio.pk
+            self.quantities = quantities
+            self.loaded_at = time.monotonic()
+
+    def is_current(self, portfolio):
+        return (
+            self.quantities is not None and
+            self.portfolio_id == portfolio.pk and
+            time.monotonic() - self.loaded_at < self.max_age
+        )
+
+    def get(self, portfolio, ticker):
+        """
+        Returns the quantity of ticker held in portfolio.
+
+        :param portfolio: the portfolio whose inventory is cached
+        :type portfolio: table.models.Portfolio
+
+        :param ticker: the stock ticker
+        :type ticker: str
+
+        :return: the quantity held, or None if the portfolio has no inventory row for ticker
+        :rtype: int
+        """
+        with self.lock:
+            if not self.is_current(portfolio):
+                self.load(portfolio)
+            return self.quantities.get(ticker)
+
+    def get_many(self, portfolio, tickers):
+        """Returns the quantities held for each of tickers, see get()."""
+        with self.lock:
+            if not self.is_current(portfolio):
+                self.load(portfolio)
+            return [self.quantities.get(ticker) for ticker in tickers]
+
+    def adjust(self, portfolio_id, ticker, quantity):
+        """Adds quantity to the cached quantity of ticker if portfolio_id is the cached portfolio."""
+        with self.lock:
+            if self.quantities is not None and self.portfolio_id == portfolio_id:
+                self.quantities[ticker] = self.quantities.get(ticker, 0) + quantity
+
+    def set(self, portfolio_id, ticker, quantity):
+        with self.lock:
+            if self.quantities is not None and self.portfolio_id == portfolio_id:
+                self.quantities[ticker] = quantity
+
+    def discard(self, portfolio_id, ticker):
+        with self.lock:
+            if self.quantities is not None and self.portfolio_id == portfolio_id:
+                self.quantities.pop(ticker, None)
+
+    def invalidate(self):
+        """Forgets the cached map; the next read reloads it."""
+        with self.lock:
+            self.portfolio_id = None
+            self.quantities = None
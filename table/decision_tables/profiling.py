@@ -0,0 +1,123 @@
+import atexit
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+
+def dump_profiles(directory, tables):
+    """
+    Writes the profile snapshots of tables to a file of this process in directory, replacing
+    the file in one step so readers never see a partial dump.
+
+    :param directory: where the server processes dump their profiles
+    :type directory: str
+
+    :param tables: the profiled decision tables
+    :type tables: list of utils.decision_table.decision_table
+    """
+    os.makedirs(directory, exist_ok= True)
+    dump = {
+        'pid': os.getpid(),
+        'written_at': time.time(),
+        'tables': [table.profile_snapshot() for table in tables if table.profile is not None],
+    }
+    path = os.path.join(directory, 'profile-' + str(os.getpid()) + '.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dump, f)
+    os.replace(path + '.tmp', path)
+
+def start_profile_dumps(directory, tables, interval):
+    """
+    Dumps the profiles of tables every interval seconds from a daemon thread and once more
+    when the process exits, see dump_profiles().
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            dump_profiles(directory, tables)
+
+    threading.Thread(target= run, name= 'decision-table-profile-dumps', daemon= True).start()
+    atexit.register(dump_profiles, directory, tables)
+
+def is_management_command(argv= None):
+    """
+    Whether this process runs a manage.py command other than runserver, e.g. migrate, shell or
+    test. Those processes must not dump profiles next to the server's.
+    """
+    argv = sys.argv if argv is None else argv
+    if not argv or os.path.basename(argv[0]) not in ('manage.py', 'django-admin', 'django-admin.py'):
+        return False
+    return len(argv) < 2 or argv[1] != 'runserver'
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists but belongs to another user
+        return True
+    return True
+
+def read_profiles(directory, max_age= None):
+    """
+    Reads the profiles dumped by every process into directory.
+
+    :param max_age: seconds after which a dump is stale and skipped; stale dumps of processes
+        that are no longer running are deleted. None reads every dump.
+    :type max_age: float
+
+    :rtype: list of dict, one per process
+    """
+    dumps = []
+    now = time.time()
+    for path in sorted(glob.glob(os.path.join(directory, 'profile-*.json'))):
+        with open(path) as f:
+            dump = json.load(f)
+        if max_age is not None and now - dump['written_at'] > max_age:
+            if not is_running(dump['pid']):
+                os.remove(path)
+            continue
+        dumps.append(dump)
+    return dumps
+
+def merge_snapshots(snapshots):
+    """
+    Adds up the profile snapshots of one decision table taken in different processes.
+
+    :param snapshots: decision_table.profile_snapshot() results for the same table
+    :type snapshots: list of dict
+
+    :return: a snapshot of the same shape; 'seconds' is the longest a process profiled
+    :rtype: dict
+    """
+    merged = {
+        'name': snapshots[0]['name'],
+        'processes': len(snapshots),
+        'seconds': max(snapshot['seconds'] for snapshot in snapshots),
+        'records': sum(snapshot['records'] for snapshot in snapshots),
+        'evaluations': sum(snapshot['evaluations'] for snapshot in snapshots),
+        'unmatched': sum(snapshot['unmatched'] for snapshot in snapshots),
+    }
+    merged['evaluations_per_record'] = merged['evaluations'] / merged['records'] if merged['records'] else 0.0
+
+    conditions = {}
+    for snapshot in snapshots:
+        for row in snapshot['conditions']:
+            total = conditions.setdefault(row['code'], {'code': row['code'], 'name': row['name'], 'calls': 0, 'total_seconds': 0.0})
+            total['calls'] += row['calls']
+            total['total_seconds'] += row['total_seconds']
+    for row in conditions.values():
+        row['mean_seconds'] = row['total_seconds'] / row['calls'] if row['calls'] else 0.0
+    merged['conditions'] = [conditions[code] for code in sorted(conditions)]
+
+    cases = {}
+    for snapshot in snapshots:
+        for row in snapshot['cases']:
+            total = cases.setdefault(row['code'], {'code': row['code'], 'name': row['name'], 'matches': 0})
+            total['matches'] += row['matches']
+    merged['cases'] = [cases[code] for code in sorted(cases)]
+    return merged
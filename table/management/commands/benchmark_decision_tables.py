@@ -0,0 +1,302 @@
+import contextlib
+import json
+import os
+import platform
+import random
+import time
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DEFAULT_DB_ALIAS
+from django.test.utils import setup_databases, teardown_databases
+
+from home.models import User, Client
+from table.models import Portfolio, StockTransactRecord, StockInventory, CashTransactionRecord
+
+
+# kinds of record the benchmark can push through the decision tables
+KINDS = ['internal_buy', 'external_buy', 'deposit', 'withdrawal']
+
+USERNAME_PREFIX = 'benchmark-client-'
+INTERNAL_TICKERS = ['BENCHA', 'BENCHB', 'BENCHC', 'BENCHD']
+EXTERNAL_TICKERS = ['BENCHX', 'BENCHY', 'BENCHZ']
+COMPANY_SHARES = 10000000
+SAVEPOINT_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryCounter:
+    """
+    Counts the queries run on a connection, see connection.execute_wrapper. Savepoint
+    statements are left out; they come with every atomic block nested in a transaction.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(SAVEPOINT_STATEMENTS):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures how many stock orders and cash transactions per second the decision tables "
+        "process. Seeds benchmark clients and portfolios and the company master portfolio's "
+        "inventory, saves a random mix of records one by one (or with the batch methods) and "
+        "reports throughput, p50/p99 latency and queries per record as JSON. The run uses a "
+        "throwaway test database, created and migrated first and destroyed at the end, so "
+        "every record commits as it would in production without touching the real data. "
+        "Refuses to run with DEBUG off unless given --yes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type= int, default= 10, help= 'number of clients to seed (default 10)')
+        parser.add_argument('--portfolios', type= int, default= 20, help= 'number of portfolios to seed, spread over the clients (default 20)')
+        parser.add_argument('--records', type= int, default= 1000, help= 'number of records to process (default 1000)')
+        parser.add_argument(
+            '--mix', default= 'internal_buy=3,external_buy=1,deposit=3,withdrawal=1',
+            help= 'relative weights of the kinds of record, from ' + ', '.join(KINDS)
+        )
+        parser.add_argument('--batch', type= int, default= 0, help= 'process records in batches of this size with process_orders/process_transactions instead of save()')
+        parser.add_argument('--seed', type= int, default= 0, help= 'random seed for the record mix (default 0)')
+        parser.add_argument('--profile', action= 'store_true', help= 'include the decision table profiles in the output')
+        parser.add_argument('--output', default= None, help= 'file to write the JSON results to instead of stdout')
+        parser.add_argument('--yes', action= 'store_true', help= 'run even though DEBUG is off, e.g. against a staging database')
+
+    def parse_mix(self, mix):
+        weights = {}
+        for item in mix.split(','):
+            kind, _, weight = item.partition('=')
+            kind = kind.strip()
+            if kind not in KINDS:
+                raise CommandError('unknown kind of record ' + kind + ' in --mix')
+            try:
+                weights[kind] = float(weight)
+            except ValueError:
+                raise CommandError('weight of ' + kind + ' in --mix is not a number')
+        if not any(weights.values()):
+            raise CommandError('--mix gives no weight to any kind of record')
+        return weights
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['portfolios'] < 1 or options['records'] < 1:
+            raise CommandError('--clients, --portfolios and --records must be positive')
+        weights = self.parse_mix(options['mix'])
+        if not (settings.DEBUG or options['yes']):
+            raise CommandError(
+                'DEBUG is off; the benchmark creates a test database next to the ' + connection.vendor + ' database ' +
+                str(connection.settings_dict['NAME']) + '. Pass --yes to run it anyway.'
+            )
+
+        stock_table = StockTransactRecord.decision_table
+        cash_table = CashTransactionRecord.decision_table
+        company_master_portfolio = stock_table.company_master_portfolio
+
+        if options['profile']:
+            for table in (stock_table.decision_table, cash_table.decision_table):
+                table.enable_profiling()
+                table.reset_profiling()
+
+        old_config = setup_databases(verbosity= 0, interactive= False, aliases= {DEFAULT_DB_ALIAS})
+        try:
+            stock_table.company_master_portfolio = self.seed_company()
+            portfolios = self.seed(options['clients'], options['portfolios'], stock_table.company_master_portfolio)
+            rng = random.Random(options['seed'])
+            kinds = rng.choices(list(weights.keys()), weights= list(weights.values()), k= options['records'])
+            records = [(kind, self.make_record(kind, rng.choice(portfolios), rng)) for kind in kinds]
+
+            # the decision tables print every action they take
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                if options['batch']:
+                    results = self.run_batches(records, options['batch'])
+                else:
+                    results = self.run_saves(records)
+        finally:
+            stock_table.company_master_portfolio = company_master_portfolio
+            stock_table.company_inventory.invalidate()
+            teardown_databases(old_config, verbosity= 0)
+
+        report = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'options': {
+                key: options[key] for key in ('clients', 'portfolios', 'records', 'mix', 'batch', 'seed')
+            },
+            'results': results,
+        }
+        if options['profile']:
+            report['profiles'] = [
+                stock_table.decision_table.profile_snapshot(),
+                cash_table.decision_table.profile_snapshot(),
+            ]
+
+        output = json.dumps(report, indent= 2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write('wrote benchmark results to ' + options['output'])
+        else:
+            self.stdout.write(output)
+
+    #---setup---#
+
+    def seed_company(self):
+        """Creates the company master portfolio in the benchmark database."""
+        company_user = User.objects.create(
+            is_company= True, username= USERNAME_PREFIX + 'company', email= USERNAME_PREFIX + 'company@example.com'
+        )
+        return Portfolio.objects.create(owner= company_user, name= 'company_master_portfolio')
+
+    def seed(self, clients, portfolios, company_master_portfolio):
+        """Creates the benchmark clients and portfolios and the company's inventory of the internal tickers."""
+        users = []
+        for number in range(clients):
+            user = User.objects.create(
+                is_client= True,
+                username= USERNAME_PREFIX + str(number),
+                email= USERNAME_PREFIX + str(number) + '@example.com',
+            )
+            Client.objects.create(user= user)
+            users.append(user)
+
+        # halfway between the cash limits so that deposits and withdrawals are both accepted
+        cash_settings = CashTransactionRecord.decision_table.cash_management_settings
+        cash = (cash_settings.client_total_deposit_min + cash_settings.client_total_deposit_max) / 2
+        seeded = [
+            Portfolio.objects.create(owner= users[number % clients], cash= cash, name= 'benchmark ' + str(number))
+            for number in range(portfolios)
+        ]
+
+        for ticker in INTERNAL_TICKERS:
+            StockInventory.objects.create(
+                portfolio= company_master_portfolio, exchange_abbr= 'BENCH', ticker= ticker, quantity= COMPANY_SHARES
+            )
+        StockTransactRecord.decision_table.company_inventory.invalidate()
+        return seeded
+
+    def make_record(self, kind, portfolio, rng):
+        """Returns an unsaved record of the given kind that the decision tables will accept."""
+        if kind in ('internal_buy', 'external_buy'):
+            tickers = INTERNAL_TICKERS if kind == 'internal_buy' else EXTERNAL_TICKERS
+            return StockTransactRecord(
+                portfolio= portfolio,
+                ticker= rng.choice(tickers),
+                exchange_abbr= 'BENCH',
+                order_type= 'buy',
+                order_class= 'undetermined',
+                price= rng.randint(10, 100),
+                quantity= rng.randint(1, 100),
+            )
+
+        cash_settings = CashTransactionRecord.decision_table.cash_management_settings
+        low = int(cash_settings.client_one_external_deposit_min)
+        amount = rng.randint(low, max(low, min(int(cash_settings.client_one_external_deposit_max), 10 * low)))
+        return CashTransactionRecord(
+            portfolio= portfolio,
+            status= 'processing',
+            currency_type= 'USD',
+            amount= amount,
+            amount_in_USD= amount,
+            transaction_type= 'external_deposit' if kind == 'deposit' else 'external_withdrawal',
+            transaction_to= 'self' if kind == 'deposit' else 'somewhere',
+            transaction_from= 'somewhere' if kind == 'deposit' else 'self',
+            transaction_conditions= '0',
+        )
+
+    #---measurement---#
+
+    def run_saves(self, records):
+        """Saves each record, which runs it through its decision table from pre_save."""
+        latencies = {kind: [] for kind in KINDS}
+        queries = {kind: 0 for kind in KINDS}
+        outcomes = {kind: {} for kind in KINDS}
+        counter = QueryCounter()
+
+        with connection.execute_wrapper(counter):
+            for kind, record in records:
+                before = counter.count
+                start = time.perf_counter()
+                record.save()
+                latencies[kind].append(time.perf_counter() - start)
+                queries[kind] += counter.count - before
+                status = self.status(record)
+                outcomes[kind][status] = outcomes[kind].get(status, 0) + 1
+
+        return self.summarize(latencies, queries, outcomes, per= 'record')
+
+    def run_batches(self, records, size):
+        """Processes the records in batches with process_orders/process_transactions; latencies are per batch."""
+        latencies = {kind: [] for kind in KINDS}
+        queries = {kind: 0 for kind in KINDS}
+        outcomes = {kind: {} for kind in KINDS}
+        counter = QueryCounter()
+
+        with connection.execute_wrapper(counter):
+            for start_index in range(0, len(records), size):
+                chunk = records[start_index:start_index + size]
+                orders = [(kind, record) for kind, record in chunk if isinstance(record, StockTransactRecord)]
+                transactions = [(kind, record) for kind, record in chunk if isinstance(record, CashTransactionRecord)]
+                for items, process in (
+                    (orders, StockTransactRecord.decision_table.process_orders),
+                    (transactions, CashTransactionRecord.decision_table.process_transactions),
+                ):
+                    if not items:
+                        continue
+                    before = counter.count
+                    start = time.perf_counter()
+                    process([record for kind, record in items])
+                    elapsed = time.perf_counter() - start
+                    used = counter.count - before
+                    # the batch's time and queries are shared out over its kinds by record count
+                    for kind in KINDS:
+                        share = sum(1 for item_kind, record in items if item_kind == kind)
+                        if share:
+                            latencies[kind].append(elapsed * share / len(items))
+                            queries[kind] += used * share / len(items)
+                    for kind, record in items:
+                        status = self.status(record)
+                        outcomes[kind][status] = outcomes[kind].get(status, 0) + 1
+
+        return self.summarize(latencies, queries, outcomes, per= 'batch')
+
+    def status(self, record):
+        if isinstance(record, StockTransactRecord):
+            return record.order_status
+        return record.status
+
+    def summarize(self, latencies, queries, outcomes, per):
+        results = {}
+        all_latencies = []
+        total_records = 0
+        total_queries = 0
+        for kind in KINDS:
+            count = sum(outcomes[kind].values())
+            if not count:
+                continue
+            results[kind] = self.stats(latencies[kind], count, queries[kind], per)
+            results[kind]['outcomes'] = outcomes[kind]
+            all_latencies += latencies[kind]
+            total_records += count
+            total_queries += queries[kind]
+        results['total'] = self.stats(all_latencies, total_records, total_queries, per)
+        return results
+
+    def stats(self, latencies, count, queries, per):
+        seconds = float(sum(latencies))
+        latencies_ms = np.array(latencies) * 1000
+        return {
+            'records': count,
+            'seconds': seconds,
+            'records_per_second': count / seconds if seconds else None,
+            'latency_per': per,
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p99_ms': float(np.percentile(latencies_ms, 99)),
+            'queries_per_record': queries / count,
+        }
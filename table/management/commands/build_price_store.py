@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from table.price_store import get_price_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the memory-mapped price store in settings.PRICE_STORE_DIR from the Stock "
+        "table, for every ticker or the given ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tickers', nargs= '*', help= 'tickers to rebuild (default: all)')
+
+    def handle(self, *args, **options):
+        store = get_price_store()
+        if store is None:
+            raise CommandError('the price store is disabled; set PRICE_STORE_DIR')
+
+        start = time.perf_counter()
+        count = store.rebuild(options['tickers'] or None)
+        self.stdout.write(
+            'wrote ' + str(count) + ' tickers to ' + store.directory + 
+            ' in ' + '{:.2f}'.format(time.perf_counter() - start) + 's'
+        )
@@ -0,0 +1,75 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from table.decision_tables.profiling import read_profiles, merge_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Dumps the decision table profiles of the running server processes as JSON. Start the "
+        "server with DECISION_TABLE_PROFILING=True; each process then writes its counters to "
+        "DECISION_TABLE_PROFILE_DIR every DECISION_TABLE_PROFILE_INTERVAL seconds and at exit. "
+        "The counters of all processes are added up per decision table; dumps older than "
+        "--max-age are left out, and deleted once their process has exited."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory', default= settings.DECISION_TABLE_PROFILE_DIR,
+            help= 'directory the processes dump their profiles to (default DECISION_TABLE_PROFILE_DIR)'
+        )
+        parser.add_argument(
+            '--table', choices= ['stock', 'cash', 'all'], default= 'all',
+            help= 'which decision table to report'
+        )
+        parser.add_argument(
+            '--per-process', action= 'store_true',
+            help= 'report each process separately instead of adding them up'
+        )
+        parser.add_argument(
+            '--max-age', type= float, default= 3 * settings.DECISION_TABLE_PROFILE_INTERVAL,
+            help= 'seconds after which a dump is stale (default three DECISION_TABLE_PROFILE_INTERVALs)'
+        )
+        parser.add_argument(
+            '--output', default= None,
+            help= 'file to write the JSON to instead of stdout'
+        )
+
+    def handle(self, *args, **options):
+        names = []
+        if options['table'] in ('stock', 'all'):
+            names.append('StockTransactRecordDecisionTable')
+        if options['table'] in ('cash', 'all'):
+            names.append('CashTransactionRecordDecisionTable')
+
+        dumps = read_profiles(options['directory'], max_age= options['max_age'])
+        if not dumps:
+            raise CommandError(
+                'no profiles in ' + options['directory'] + '; is the server running with DECISION_TABLE_PROFILING=True?'
+            )
+
+        if options['per_process']:
+            report = [
+                {
+                    'pid': dump['pid'],
+                    'written_at': dump['written_at'],
+                    'tables': [snapshot for snapshot in dump['tables'] if snapshot['name'] in names],
+                }
+                for dump in dumps
+            ]
+        else:
+            report = []
+            for name in names:
+                snapshots = [snapshot for dump in dumps for snapshot in dump['tables'] if snapshot['name'] == name]
+                if snapshots:
+                    report.append(merge_snapshots(snapshots))
+
+        output = json.dumps(report, indent= 2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write('wrote ' + str(len(report)) + ' profiles to ' + options['output'])
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,65 @@
+import glob
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from table.stock_test_data.pullstockdata import ingest_files
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads many price CSVs into the Stock table, parsing them in a pool of worker processes "
+        "while a single writer inserts the prices in batches. Files are either wide (a Date "
+        "column and one column per ticker) or per ticker (Date, Open, High, Low, Close, named "
+        "after the ticker). Directories are searched for *.csv files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs= '+', help= 'price CSVs or directories of them')
+        parser.add_argument('--workers', type= int, default= None, help= 'parsing processes (default: number of CPUs, 0 parses in this process)')
+        parser.add_argument('--batch-rows', type= int, default= 100000, help= 'prices to collect per write transaction (default 100000)')
+        parser.add_argument('--batch-size', type= int, default= 5000, help= 'rows per INSERT (default 5000)')
+        parser.add_argument('--incremental', action= 'store_true', help= "skip prices up to each ticker's latest stored date")
+        parser.add_argument('--backfill-days', type= int, default= 0, help= 'with --incremental, re-check this many days before the latest stored dates')
+
+    def handle(self, *args, **options):
+        csv_paths = []
+        for path in options['paths']:
+            if os.path.isdir(path):
+                csv_paths += sorted(glob.glob(os.path.join(path, '*.csv')))
+            elif os.path.exists(path):
+                csv_paths.append(path)
+            else:
+                raise CommandError(path + ' does not exist')
+        if not csv_paths:
+            raise CommandError('no price files found')
+
+        try:
+            stats = ingest_files(
+                csv_paths,
+                workers= options['workers'],
+                batch_rows= options['batch_rows'],
+                batch_size= options['batch_size'],
+                incremental= options['incremental'],
+                backfill_days= options['backfill_days'],
+                progress= self.report_progress if options['verbosity'] > 1 else None
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.summary(stats))
+
+    def report_progress(self, stats):
+        self.stdout.write('file ' + str(stats['files']) + ': ' + self.summary(stats))
+
+    def summary(self, stats):
+        seconds = stats['seconds']
+        return (
+            'read ' + str(stats['cells']) + ' prices from ' + str(stats['files']) + ' files: ' + 
+            str(stats['inserted']) + ' inserted, ' + 
+            str(stats['old']) + ' older than the stored prices, ' + 
+            str(stats['existing']) + ' already stored, ' + 
+            str(stats['missing']) + ' missing, in ' + 
+            '{:.2f}'.format(seconds) + 's (' + 
+            '{:.0f}'.format(stats['price_rows'] / seconds if seconds else 0) + ' rows/s)'
+        )
@@ -0,0 +1,83 @@
+import os
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from table.stock_test_data.pullstockdata import ingest_frame, ingest_csv, incremental_cutoffs
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk loads a wide price CSV (a Date column and one column of prices per ticker) into "
+        "the Stock table and reports rows per second. Prices already stored for a ticker and "
+        "date are skipped. With --chunksize the file is streamed in chunks that are committed "
+        "one by one, and an interrupted load resumes from its checkpoint. With --incremental "
+        "only prices newer than each ticker's latest stored date are loaded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help= 'the price CSV to load')
+        parser.add_argument('--batch-size', type= int, default= 5000, help= 'rows per INSERT (default 5000)')
+        parser.add_argument(
+            '--chunksize', type= int, default= None,
+            help= 'stream the file this many CSV rows at a time instead of reading it whole'
+        )
+        parser.add_argument(
+            '--checkpoint', default= None,
+            help= 'checkpoint file for a streamed load (default <csv_path>.checkpoint)'
+        )
+        parser.add_argument(
+            '--incremental', action= 'store_true',
+            help= "skip prices up to each ticker's latest stored date"
+        )
+        parser.add_argument(
+            '--backfill-days', type= int, default= 0,
+            help= 'with --incremental, re-check this many days before the latest stored dates'
+        )
+
+    def handle(self, *args, **options):
+        csv_path = options['csv_path']
+        if not os.path.exists(csv_path):
+            raise CommandError(csv_path + ' does not exist')
+
+        if options['chunksize']:
+            checkpoint_path = options['checkpoint'] or csv_path + '.checkpoint'
+            stats = ingest_csv(
+                csv_path, 
+                chunksize= options['chunksize'], 
+                checkpoint_path= checkpoint_path, 
+                batch_size= options['batch_size'],
+                progress= self.report_progress if options['verbosity'] > 1 else None,
+                incremental= options['incremental'],
+                backfill_days= options['backfill_days']
+            )
+            if stats['resumed_from']:
+                self.stdout.write('resumed after row ' + str(stats['resumed_from']))
+        else:
+            try:
+                df = pd.read_csv(csv_path)
+            except (OSError, pd.errors.ParserError) as e:
+                raise CommandError('could not read ' + csv_path + ': ' + str(e))
+            if 'Date' not in df.columns:
+                raise CommandError(csv_path + ' has no Date column')
+            cutoffs = None
+            if options['incremental']:
+                cutoffs = incremental_cutoffs(df.columns[1:], options['backfill_days'])
+            stats = ingest_frame(df, batch_size= options['batch_size'], cutoffs= cutoffs)
+
+        self.stdout.write(self.summary(stats))
+
+    def report_progress(self, stats):
+        self.stdout.write('chunk ' + str(stats['chunks']) + ': ' + self.summary(stats))
+
+    def summary(self, stats):
+        seconds = stats['seconds']
+        return (
+            'read ' + str(stats['cells']) + ' prices: ' + 
+            str(stats['inserted']) + ' inserted, ' + 
+            str(stats['old']) + ' older than the stored prices, ' + 
+            str(stats['existing']) + ' already stored, ' + 
+            str(stats['missing']) + ' missing, in ' + 
+            '{:.2f}'.format(seconds) + 's (' + 
+            '{:.0f}'.format(stats['price_rows'] / seconds if seconds else 0) + ' rows/s)'
+        )
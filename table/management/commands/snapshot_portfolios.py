@@ -0,0 +1,45 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from table.models import Portfolio, PortfolioSnapshot
+from table.valuation import snapshot_portfolios
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the daily value snapshots of every portfolio up to yesterday (or --end), "
+        "catching up on any days missed since the last run. Meant to run nightly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--end', default= None, help= 'the last day to snapshot, YYYY-MM-DD (default yesterday)')
+        parser.add_argument('--batch-size', type= int, default= 500, help= 'number of portfolios valued at once (default 500)')
+        parser.add_argument(
+            '--rebuild', action= 'store_true', 
+            help= 'replace the existing snapshots, e.g. after prices were corrected; all or nothing'
+        )
+
+    def handle(self, *args, **options):
+        end_date = None
+        if options['end']:
+            try:
+                end_date = datetime.datetime.strptime(options['end'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--end must be a date in the format YYYY-MM-DD')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        start = time.perf_counter()
+        if options['rebuild']:
+            # in one transaction, so a run that fails partway keeps the old snapshots
+            with transaction.atomic():
+                PortfolioSnapshot.objects.all().delete()
+                written = snapshot_portfolios(Portfolio.objects.all(), end_date= end_date, batch_size= options['batch_size'])
+        else:
+            written = snapshot_portfolios(Portfolio.objects.all(), end_date= end_date, batch_size= options['batch_size'])
+        self.stdout.write(
+            'wrote ' + str(written) + ' snapshots in ' + '{:.2f}'.format(time.perf_counter() - start) + 's'
+        )
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.4 on 2026-10-18 18:25
+
+import datetime
+from django.db import migrations, models
+from django.utils.timezone import utc
+
+
+def fill_latest_quotes(apps, schema_editor):
+    Stock = apps.get_model('table', 'Stock')
+    LatestQuote = apps.get_model('table', 'LatestQuote')
+    latest_date = Stock.objects.filter(ticker= models.OuterRef('ticker')).order_by('-date').values('date')[:1]
+    latest = Stock.objects.filter(date= models.Subquery(latest_date)) \
+        .values_list('ticker', 'exchange_abbr', 'date', 'price')
+    LatestQuote.objects.bulk_create([
+        LatestQuote(ticker= ticker, exchange_abbr= exchange_abbr, date= date, price= price)
+        for ticker, exchange_abbr, date, price in latest.iterator()
+    ], batch_size= 1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('table', '0003_auto_20210121_1953'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestQuote',
+            fields=[
+                ('ticker', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('exchange_abbr', models.CharField(default='', max_length=100)),
+                ('price', models.DecimalField(decimal_places=6, default=0, max_digits=50)),
+                ('date', models.DateTimeField(default=datetime.datetime(1, 1, 1, 0, 0, tzinfo=utc))),
+            ],
+        ),
+        migrations.RunPython(fill_latest_quotes, migrations.RunPython.noop),
+    ]
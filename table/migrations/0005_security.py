@@ -0,0 +1,75 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# the information of a stock that moves from its Stock rows to its Security
+SECURITY_FIELDS = ['exchange_abbr', 'exchange_long', 'name', 'summary', 'logo']
+
+
+def move_to_securities(apps, schema_editor):
+    Stock = apps.get_model('table', 'Stock')
+    Security = apps.get_model('table', 'Security')
+    # each security takes the information of its latest price
+    latest_date = Stock.objects.filter(ticker= models.OuterRef('ticker')).order_by('-date').values('date')[:1]
+    latest = Stock.objects.filter(date= models.Subquery(latest_date)).values('ticker', *SECURITY_FIELDS)
+    Security.objects.bulk_create([Security(**row) for row in latest.iterator()], batch_size= 1000)
+    Stock.objects.update(
+        security= models.Subquery(Security.objects.filter(ticker= models.OuterRef('ticker')).values('id')[:1])
+    )
+
+def move_to_stocks(apps, schema_editor):
+    Stock = apps.get_model('table', 'Stock')
+    Security = apps.get_model('table', 'Security')
+    Stock.objects.update(**{
+        field: models.Subquery(Security.objects.filter(id= models.OuterRef('security')).values(field)[:1])
+        for field in SECURITY_FIELDS if field != 'exchange_abbr'
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('table', '0004_latestquote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Security',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=100, unique=True)),
+                ('exchange_abbr', models.CharField(default='', max_length=100)),
+                ('exchange_long', models.CharField(default='', max_length=100)),
+                ('name', models.CharField(default='', max_length=200)),
+                ('summary', models.CharField(default='', max_length=1000)),
+                ('logo', models.CharField(default='', max_length=1000)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='security',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='table.security'),
+        ),
+        migrations.RunPython(move_to_securities, move_to_stocks),
+        migrations.AlterField(
+            model_name='stock',
+            name='security',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='table.security'),
+        ),
+        migrations.RemoveField(
+            model_name='stock',
+            name='exchange_long',
+        ),
+        migrations.RemoveField(
+            model_name='stock',
+            name='logo',
+        ),
+        migrations.RemoveField(
+            model_name='stock',
+            name='name',
+        ),
+        migrations.RemoveField(
+            model_name='stock',
+            name='summary',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.4 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('table', '0005_security'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stocktransactrecord',
+            index=models.Index(fields=['portfolio', 'timestamp', 'id'], name='stock_transaction_history'),
+        ),
+    ]
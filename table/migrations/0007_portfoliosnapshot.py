@@ -0,0 +1,28 @@
+# Generated by Django 3.1.4 on 2026-10-18 18:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('table', '0006_stock_transaction_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('cash', models.DecimalField(decimal_places=6, default=0, max_digits=20)),
+                ('market_value', models.DecimalField(decimal_places=6, default=0, max_digits=20)),
+                ('total_value', models.DecimalField(decimal_places=6, default=0, max_digits=20)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='table.portfolio')),
+            ],
+            options={
+                'unique_together': {('portfolio', 'date')},
+            },
+        ),
+    ]
@@ -1,16 +1,27 @@
 import datetime
+from decimal import Decimal
+import hashlib
+import numpy as np
 import pandas as pd
+import time
 import uuid
 import pytz
 from enum import Enum
 
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models import *
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
-from django.db.models.signals import post_save, post_init, pre_save
+from django.db.models.signals import post_save, post_init, pre_save, post_delete
 from django.dispatch import receiver
 
 from home.models import Client, Broker, User, Company
+from utils.downsample import resample_last, downsample_frame
+from utils.ticker_index import TickerIndex
+from .price_store import get_price_store, lookup_prices, to_datetime64, to_records
 from settings.models import SiteSettings, StockManagementSettings
 
 site_settings = SiteSettings.objects.all()[0]
@@ -59,75 +70,467 @@ class Portfolio(Model):
     def get_field_names(cls):
         return [f.name for f in cls._meta.fields]
 
+    # the columns of get_transaction_rows read from the table, in order
+    TRANSACTION_ROW_FIELDS = [
+        'exchange_abbr', 'ticker', 'price', 'order_type', 'quantity', 
+        'order_placement_datetime', 'order_execution_datetime'
+    ]
+
+    # signs the cursors of get_transaction_page, which carry the running total to the client
+    TRANSACTION_CURSOR_SALT = 'table.portfolio.transaction_page'
+
+    def get_transaction_rows(self):
+        """
+        Get the stock transactions of this portfolio ready for display, read with one query.
+        Order values and the running total of the stock value (buys add, sells subtract) are
+        computed over all transactions at once.
+
+        :return: for each transaction in the order they were recorded, its 
+            TRANSACTION_ROW_FIELDS and its value and total_value, with prices and values as floats
+        :rtype: list of dict
+        """
+        rows = list(self.stocktransactions.order_by('timestamp', 'pk').values_list(*self.TRANSACTION_ROW_FIELDS))
+        return transaction_rows(self.TRANSACTION_ROW_FIELDS, rows)
+
+    def get_transaction_page(self, cursor= None, page_size= 50):
+        """
+        Get one page of the rows of get_transaction_rows with keyset pagination over 
+        (timestamp, id), which the (portfolio, timestamp, id) index serves directly however
+        deep the page is. The cursor of the next page records where this page ended and the
+        running total there, so later pages continue the total without reading earlier rows.
+
+        :param cursor: the cursor returned with the previous page, or None for the first page
+        :type cursor: str
+
+        :param page_size: the number of rows per page
+        :type page_size: int
+
+        :raises django.core.signing.BadSignature: if the cursor was not made for this portfolio
+
+        :return: the rows of the page and the cursor of the next page, None on the last page
+        :rtype: (list of dict, str)
+        """
+        transactions = self.stocktransactions.all()
+        total = 0.0
+        if cursor is not None:
+            position = signing.loads(cursor, salt= self.TRANSACTION_CURSOR_SALT)
+            if position['portfolio'] != self.pk:
+                raise signing.BadSignature('cursor is for another portfolio')
+            timestamp = datetime.datetime.fromisoformat(position['timestamp'])
+            transactions = transactions.filter(
+                Q(timestamp__gt= timestamp) | Q(timestamp= timestamp, pk__gt= position['id'])
+            )
+            total = position['total']
+
+        fields = self.TRANSACTION_ROW_FIELDS + ['timestamp', 'pk']
+        # one row more than the page to know whether there is a next page
+        rows = list(transactions.order_by('timestamp', 'pk').values_list(*fields)[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = transaction_rows(fields, rows[:page_size], total)
+
+        next_cursor = None
+        if has_next:
+            last = rows[-1]
+            next_cursor = signing.dumps({
+                'portfolio': self.pk,
+                'timestamp': last['timestamp'].isoformat(),
+                'id': last['pk'],
+                'total': last['total_value'],
+            }, salt= self.TRANSACTION_CURSOR_SALT)
+        for row in rows:
+            del row['timestamp'], row['pk']
+        return rows, next_cursor
+
     def get_stocks_info(self):
-        values = []
-        for transaction in self.stocktransactions.all():
-            values.append(float(transaction.get_value()))
-        '''list(self.stocktransactions.annotate(value= ExpressionWrapper(F('price') * F('quantity'), output_field=FloatField())).values('value', 'price'))'''
-        #values_list = [value['value'] for value in values]
-        prices_list = list(self.stocktransactions.all().values('price'))
-        prices = [float(value['price']) for value in prices_list]
-        
-        quantities_list = list(self.stocktransactions.all().values('quantity'))
-        quantities = [value['quantity'] for value in quantities_list]
+        """The prices, quantities, values and types of this portfolio's transactions, see get_transaction_rows."""
+        rows = self.get_transaction_rows()
+        return [
+            [row['price'] for row in rows],
+            [row['quantity'] for row in rows],
+            [row['value'] for row in rows],
+            [row['order_type'] for row in rows],
+        ]
+
+    def get_valuation(self, date= None):
+        """
+        Get the market valuation of this portfolio, see table.valuation.value_portfolios.
 
-        types_list = list(self.stocktransactions.all().values('order_type'))
-        types = [value['order_type'] for value in types_list]
-        
-        return [prices, quantities, values, types]
+        :param date: the date to value the portfolio at, defaults to now
+        :type date: datetime.datetime, with tzinfo= datetime.timezone.utc
 
-    def get_value_at_datetime(self, date= datetime.datetime.now()):
+        :return: the cash, market_value, cost_basis, unrealized_pnl, total_value and missing_prices
+        :rtype: dict
         """
-        Get the value of this portfolio at a given datetime.
+        from .valuation import value_portfolios
+        return value_portfolios([self], date)[self.pk]
+
+    def get_value_at_datetime(self, date= None):
+        """
+        Get the value of this portfolio at a given datetime: its cash and its stocks at the 
+        market prices of the time.
         
-        :param date: the date to calculate the value for, defaults to dateime.datetime.now()
-        :type date: datetim.datetime, with tzinfo= datetime.timezone.utc
+        :param date: the date to calculate the value for, defaults to now
+        :type date: datetime.datetime, with tzinfo= datetime.timezone.utc
 
         :return: monetary value of this portfolio on the given date in USD
         :rtype: Decimal
         """
+        return Decimal(str(self.get_valuation(date)['total_value']))
+
+    @classmethod
+    def with_values(cls, queryset):
+        """
+        Annotates portfolios, in the same grouped query, with their book_value: the cash plus
+        what was paid for the stocks held, i.e. the completed buy orders less the completed 
+        sell orders, summed conditionally over the orders of each portfolio.
 
-        # total value of sell orders
-        sell_value = self.stocktransactions \
-        .annotate(value= ExpressionWrapper(F('price') * F('quantity'), output_field=DecimalField(max_digits= 20, decimal_places= site_settings.monetary_decimal_places))) \
-        .filter(order_type= 'sell') \
-        .aggregate(Sum('value'))
+        :type queryset: django.db.models.QuerySet of Portfolio
+        :rtype: django.db.models.QuerySet
+        """
+        money = DecimalField(max_digits= 20, decimal_places= site_settings.monetary_decimal_places)
+        value = F('stocktransactions__price') * F('stocktransactions__quantity')
+        completed = Q(stocktransactions__order_status= StockTransactRecord.STATUS.completed.name)
+        stock_cost = Sum(Case(
+            When(completed & Q(stocktransactions__order_type= 'buy'), then= value),
+            When(completed & Q(stocktransactions__order_type= 'sell'), then= -value),
+            default= 0,
+            output_field= money,
+        ))
+        return queryset.annotate(
+            book_value= ExpressionWrapper(F('cash') + Coalesce(stock_cost, 0), output_field= money)
+        )
+
+    #---returns---#
 
-        # total value of buy orders
-        buy_value = self.stocktransactions \
-        .annotate(value= ExpressionWrapper(F('price') * F('quantity'), output_field= DecimalField(max_digits= 20, decimal_places= site_settings.monetary_decimal_places))) \
-        .filter(order_type= 'buy') \
-        .aggregate(Sum('value'))
+    @classmethod
+    def with_returns(cls, queryset):
+        """
+        Annotates portfolios with what their return properties need, so that the returns of 
+        many portfolios are read with the portfolios in one query instead of two per portfolio.
 
-        buy_value = buy_value['value__sum'] if buy_value['value__sum'] else 0
-        sell_value = sell_value['value__sum'] if sell_value['value__sum'] else 0
-        total_value = buy_value - sell_value + self.cash
+        :type queryset: django.db.models.QuerySet of Portfolio
+        :rtype: django.db.models.QuerySet
+        """
+        starts = cls.return_start_dates()
+        latest_snapshots = PortfolioSnapshot.objects.filter(portfolio= OuterRef('pk')).order_by('-date')
+        return queryset.annotate(
+            latest_snapshot_value= PortfolioSnapshot.value_as_of(),
+            latest_snapshot_date= Subquery(latest_snapshots.values('date')[:1]),
+            first_snapshot_value= PortfolioSnapshot.value_as_of(first= True),
+            **{
+                name + '_start_value': PortfolioSnapshot.value_as_of(date)
+                for name, date in starts.items()
+            }
+        )
+
+    @staticmethod
+    def return_start_dates():
+        """The day before each return period, whose snapshot the return is measured from."""
+        today = timezone.now().date()
+        return {
+            'ytd': datetime.date(today.year - 1, 12, 31),
+            'one_month': (pd.Timestamp(today) - pd.DateOffset(months= 1)).date(),
+        }
+
+    def get_return(self, name):
+        """
+        Get the percent change in total value over a period, from the PortfolioSnapshot rows
+        written by the snapshot_portfolios command: from the last snapshot on or before the
+        start of the period (the first snapshot for 'inception') to the latest one.
 
-        return total_value  
+        :param name: 'ytd', 'one_month' or 'inception'
+        :type name: str
+
+        :return: the percent change, or None if there are no snapshots to measure it with, 
+            e.g. none taken in the period
+        :rtype: float
+        """
+        if hasattr(self, 'latest_snapshot_value'):
+            latest = self.latest_snapshot_value
+            latest_date = self.latest_snapshot_date
+            start = self.first_snapshot_value if name == 'inception' else getattr(self, name + '_start_value')
+        else:
+            snapshots = self.snapshots.order_by('-date')
+            latest_date, latest = snapshots.values_list('date', 'total_value').first() or (None, None)
+            if name == 'inception':
+                start = snapshots.values_list('total_value', flat= True).last()
+            else:
+                start = snapshots.filter(date__lte= self.return_start_dates()[name]).values_list('total_value', flat= True).first()
+        if latest is None or not start:
+            return None
+        if name != 'inception' and latest_date <= self.return_start_dates()[name]:
+            # the latest snapshot is the start one; there is no change to measure yet
+            return None
+        return round(float((latest / start - 1) * 100), 2)
+
+    @property
+    def ytd_perc_change(self):
+        return self.get_return('ytd')
+
+    @property
+    def one_month_perc_change(self):
+        return self.get_return('one_month')
+
+    @property
+    def inception_perc_change(self):
+        return self.get_return('inception')
 
     def __str__(self):
         return self.name
 
-class Stock(Model):
+def transaction_rows(fields, rows, start_total= 0.0):
+    """
+    Turns stock transaction rows into the dicts of Portfolio.get_transaction_rows, adding the 
+    value of each order and the running total of the stock value from start_total.
+
+    :param fields: the names of the columns of rows, including price, quantity and order_type
+    :type fields: list
+
+    :param rows: the transactions in order
+    :type rows: list of tuple
+
+    :rtype: list of dict
+    """
+    if not rows:
+        return []
+
+    columns = dict(zip(fields, zip(*rows)))
+    prices = np.array(columns['price'], dtype= float)
+    quantities = np.array(columns['quantity'], dtype= float)
+    types = np.array(columns['order_type'])
+    values = prices * quantities
+    signs = np.select([types == 'buy', types == 'sell'], [1.0, -1.0], 0.0)
+    total_values = start_total + np.cumsum(values * signs)
+
+    return [
+        dict(zip(fields, row), price= price, value= value, total_value= total_value)
+        for row, price, value, total_value in zip(rows, prices.tolist(), values.tolist(), total_values.tolist())
+    ]
+
+class PortfolioSnapshot(Model):
+    """
+    The value of a portfolio at the end of a business day, written by the nightly 
+    snapshot_portfolios command (see table.valuation.snapshot_portfolios) so that historical
+    performance is read from one row instead of replaying transactions against prices.
+
+    :param portfolio: the portfolio
+    :type portfolio: Portfolio
+
+    :param date: the day, in UTC
+    :type date: datetime.date
+
+    :param cash: the cash at the end of the day in USD
+    :type cash: Decimal
+
+    :param market_value: the stocks at the day's closing prices in USD
+    :type market_value: Decimal
+
+    :param total_value: cash plus market value in USD
+    :type total_value: Decimal
+    """
+    portfolio = ForeignKey(Portfolio, on_delete= CASCADE, related_name= 'snapshots')
+    date = DateField()
+    cash = DecimalField(max_digits= 20, decimal_places= site_settings.monetary_decimal_places, default= 0)
+    market_value = DecimalField(max_digits= 20, decimal_places= site_settings.monetary_decimal_places, default= 0)
+    total_value = DecimalField(max_digits= 20, decimal_places= site_settings.monetary_decimal_places, default= 0)
+
+    class Meta:
+        # also the index of the lookups of one portfolio's snapshot at a date
+        unique_together = [['portfolio', 'date']]
+
+    def __str__(self):
+        return str(self.portfolio) + ' ' + str(self.date) + ' ' + str(self.total_value)
+
+    @classmethod
+    def value_as_of(cls, date= None, first= False):
+        """
+        A subquery for annotating portfolios with the total value of their last snapshot on
+        or before date, their latest snapshot if date is None, or their first if first is True.
+        """
+        snapshots = cls.objects.filter(portfolio= OuterRef('pk'))
+        if date is not None:
+            snapshots = snapshots.filter(date__lte= date)
+        snapshots = snapshots.order_by('date' if first else '-date').values('total_value')[:1]
+        return Subquery(snapshots, output_field= DecimalField(max_digits= 20, decimal_places= site_settings.monetary_decimal_places))
+
+class Security(Model):
     """
-    Table storing stock information for a given date and time of a given stock.
+    Table storing the information of a stock that does not change from price to price; each
+    of its prices in the Stock table refers to it.
     """
+    ticker = CharField(max_length= 100, unique= True)
     exchange_abbr = CharField(max_length= 100, default= '')
     exchange_long = CharField(max_length= 100, default= '')
-    ticker = CharField(max_length= 100, default= '')
     name = CharField(max_length= 200, default= '')
     summary = CharField(max_length= 1000, default= '')
+    logo = CharField(max_length= 1000, default= '')
+
+    # each process keeps a TickerIndex of the securities built under the current securities
+    # version, which changes whenever a security is created, changed or deleted in a process
+    # sharing the cache, and under the count and newest id of the securities, which change 
+    # whenever any process adds or removes one. Securities renamed by a process with another
+    # cache are read again after TICKER_INDEX_MAX_AGE seconds
+    SECURITIES_VERSION_KEY = 'securities_version'
+    TICKER_INDEX_MAX_AGE = 60
+    ticker_index = (None, None, None)
+
+    def __str__(self):
+        return self.ticker
+
+    @classmethod
+    def get_securities_version(cls):
+        version = cache.get(cls.SECURITIES_VERSION_KEY)
+        if version is None:
+            cache.add(cls.SECURITIES_VERSION_KEY, uuid.uuid4().hex, timeout= None)
+            version = cache.get(cls.SECURITIES_VERSION_KEY)
+        return version
+
+    @classmethod
+    def bump_securities_version(cls):
+        '''Makes every process rebuild its ticker index; called after securities are written.'''
+        cache.set(cls.SECURITIES_VERSION_KEY, uuid.uuid4().hex, timeout= None)
+
+    @classmethod
+    def get_ticker_index(cls):
+        """
+        Get the index of the tickers and names of all securities, see utils.ticker_index. It
+        is read from the table once per change to the securities; otherwise the lookups are
+        of the securities version in the cache and of one aggregate of the Security table.
+
+        :rtype: utils.ticker_index.TickerIndex
+        """
+        marker = cls.objects.aggregate(latest= Max('pk'), count= Count('pk'))
+        version = (cls.get_securities_version(), marker['latest'], marker['count'])
+        index_version, built_at, index = cls.ticker_index
+        if index is None or index_version != version or time.monotonic() - built_at >= cls.TICKER_INDEX_MAX_AGE:
+            index = TickerIndex(cls.objects.values_list('ticker', 'name'))
+            cls.ticker_index = (version, time.monotonic(), index)
+        return index
+
+    @classmethod
+    def get_available_tickers(cls):
+        """Get the sorted tickers of every security that has prices, without scanning the Stock table."""
+        return list(cls.get_ticker_index().tickers)
+
+    @classmethod
+    def get_ids(cls, tickers):
+        """
+        Get the id of the Security of each of tickers, creating the ones that do not exist yet.
+
+        :param tickers: the tickers to look up
+        :type tickers: list
+
+        :rtype: dict of str: int
+        """
+        tickers = list(set(tickers))
+        ids = dict(cls.objects.filter(ticker__in= tickers).values_list('ticker', 'id'))
+        missing = [ticker for ticker in tickers if ticker not in ids]
+        if missing:
+            # another process may create some of them at the same time
+            cls.objects.bulk_create([cls(ticker= ticker) for ticker in missing], ignore_conflicts= True)
+            ids.update(cls.objects.filter(ticker__in= missing).values_list('ticker', 'id'))
+            # bulk_create sends no post_save
+            transaction.on_commit(cls.bump_securities_version)
+        return ids
+
+@receiver(post_save, sender= Security, dispatch_uid= 'security_post_save')
+def security_post_save(sender, instance, **kwargs):
+    transaction.on_commit(Security.bump_securities_version)
+
+@receiver(post_delete, sender= Security, dispatch_uid= 'security_post_delete')
+def security_post_delete(sender, instance, **kwargs):
+    transaction.on_commit(Security.bump_securities_version)
+
+class Stock(Model):
+    """
+    Table storing the price of a given stock at a given date and time. The rows are kept 
+    narrow for scans and inserts; the rest of the stock's information is in its Security.
+    """
+    security = ForeignKey(Security, on_delete= CASCADE, related_name= 'prices')
+    exchange_abbr = CharField(max_length= 100, default= '')
+    ticker = CharField(max_length= 100, default= '')
     price = DecimalField(
         max_digits= 50, 
         decimal_places= site_settings.monetary_decimal_places, 
         default= 0
     )
-    logo = CharField(max_length= 1000, default= '')
     date = DateTimeField(default= site_settings.db_default_date)
 
     class Meta:
         unique_together = [['ticker', 'date']]
 
+    # get_cached_stocks_data results are cached under the current prices version, which 
+    # changes whenever prices are written in a process sharing the cache, and under the
+    # newest Stock id, which changes whenever prices are inserted by any process. Prices
+    # changed or deleted by a process with another cache are read again within the timeout
+    PRICES_VERSION_KEY = 'stock_prices_version'
+    STOCKS_DATA_TIMEOUT = 10 * 60
+
+    @classmethod
+    def get_prices_version(cls):
+        version = cache.get(cls.PRICES_VERSION_KEY)
+        if version is None:
+            cache.add(cls.PRICES_VERSION_KEY, uuid.uuid4().hex, timeout= None)
+            version = cache.get(cls.PRICES_VERSION_KEY)
+        return version
+
+    @classmethod
+    def bump_prices_version(cls):
+        '''Invalidates every cached get_stocks_data result; called after prices are written.'''
+        cache.set(cls.PRICES_VERSION_KEY, uuid.uuid4().hex, timeout= None)
+
+    @classmethod
+    def get_cached_stocks_data(cls, tickers=['^DJI', '^GSPC', '^IXIC'], dates= ['2000-01-01', '2020-01-01'], points= None, resolution= 'daily'):
+        """
+        get_stocks_data through the cache, keyed on the arguments, the prices version (see 
+        bump_prices_version) and the newest Stock id, so that a result is computed once per 
+        change to the Stock table. A cached result costs one primary key lookup.
+        """
+        latest_id = cls.objects.aggregate(latest= Max('pk'))['latest']
+        arguments = repr((cls.get_prices_version(), latest_id, list(tickers), list(dates), points, resolution))
+        key = 'stocks_data:' + hashlib.md5(arguments.encode()).hexdigest()
+        stocks_data = cache.get(key)
+        if stocks_data is None:
+            stocks_data = cls.get_stocks_data(tickers= tickers, dates= dates, points= points, resolution= resolution)
+            cache.set(key, stocks_data, cls.STOCKS_DATA_TIMEOUT)
+        return stocks_data
+
+    @classmethod
+    def get_price_frame(cls, tickers, start_date= None, end_date= None, dates= None):
+        """
+        Reads the prices of tickers with one query. Dates and prices are cast in SQL and parsed
+        by pandas in one go instead of by Django's converters row by row.
+
+        :param tickers: the tickers to read
+        :type tickers: list
+
+        :param start_date: the first date to read, optional
+        :type start_date: datetime.datetime
+
+        :param end_date: the last date to read, optional
+        :type end_date: datetime.datetime
+
+        :param dates: if given, only the prices at exactly these dates are read
+        :type dates: list of datetime.datetime
+
+        :return: a frame with columns ticker, date (UTC) and price (float), ordered by ticker and date
+        :rtype: pandas.DataFrame
+        """
+        rows = cls.objects.filter(ticker__in= list(tickers))
+        if start_date is not None:
+            rows = rows.filter(date__gte= start_date)
+        if end_date is not None:
+            rows = rows.filter(date__lte= end_date)
+        if dates is not None:
+            rows = rows.filter(date__in= list(dates))
+        rows = rows.order_by('ticker', 'date') \
+            .values_list('ticker', Cast('date', CharField()), Cast('price', FloatField()))
+        prices = pd.DataFrame(list(rows), columns= ['ticker', 'date', 'price'])
+        prices['date'] = pd.to_datetime(prices['date'], utc= True)
+        # as DecimalField would when reading the column
+        prices['price'] = prices['price'].astype(float).round(site_settings.monetary_decimal_places)
+        return prices
+
     @classmethod
     def get_quote(cls, exchange_abbr='', ticker='^DJI', date_and_time='2000-01-03 00:00:00'):
         """
@@ -148,13 +551,174 @@ class Stock(Model):
         
         date = pytz.utc.localize(datetime.datetime.strptime(date_and_time, site_settings.db_date_format))
         print(date, ticker, exchange_abbr)
+        # the price store is keyed by ticker only; prices are ingested without an exchange
+        store = get_price_store()
+        if store is not None and exchange_abbr == '' and store.has([ticker]):
+            price = store.get_quote(ticker, date)
+            return Decimal(str(price)) if price is not None else -1
         try:
             return cls.objects.get(ticker= ticker, date= date, exchange_abbr= exchange_abbr).price
         except Stock.DoesNotExist:
             return -1
 
     @classmethod
-    def get_stocks_data(cls, tickers=['^DJI', '^GSPC', '^IXIC'], dates= ['2000-01-01', '2020-01-01']):
+    def get_latest_quotes(cls, tickers):
+        """
+        Get the last stored price of each of tickers in one round trip, from the price store
+        when it holds every ticker and from the LatestQuote table otherwise.
+
+        :param tickers: the tickers to look up
+        :type tickers: list
+
+        :return: the date and price of the last price of each ticker that has any
+        :rtype: dict of str: (datetime.datetime, Decimal)
+        """
+        store = get_price_store()
+        if store is not None and store.has(tickers):
+            return store.get_quotes_as_of(tickers)
+        latest = LatestQuote.objects.filter(ticker__in= list(tickers)).values_list('ticker', 'date', 'price')
+        return {ticker: (date, price) for ticker, date, price in latest}
+
+    @classmethod
+    def get_quotes_as_of(cls, tickers, date):
+        """
+        Get the most recent price at or before date of each of tickers with two queries, see 
+        get_latest_rows.
+
+        :param tickers: the tickers to look up
+        :type tickers: list
+
+        :param date: the time at which to find the prices
+        :type date: datetime.datetime, with tzinfo= datetime.timezone.utc
+
+        :return: the date and price of the price in effect at date of each ticker that has one
+        :rtype: dict of str: (datetime.datetime, Decimal)
+        """
+        store = get_price_store()
+        if store is not None and store.has(tickers):
+            return store.get_quotes_as_of(tickers, date)
+        return {
+            ticker: (price_date, price) 
+            for ticker, price_date, price in cls.get_latest_rows(tickers, ['ticker', 'date', 'price'], date= date)
+        }
+
+    @classmethod
+    def get_latest_rows(cls, tickers, fields, date= None):
+        """
+        Get the newest row at or before date of each of tickers with two queries: the latest 
+        date of each ticker is found with one grouped query over the (ticker, date) index, then 
+        the rows at those dates are read and the ones of other tickers' dates dropped.
+
+        :param tickers: the tickers to look up
+        :type tickers: list
+
+        :param fields: the fields to return, starting with 'ticker' and 'date'
+        :type fields: list of str
+
+        :param date: the time at or before which to find the rows, defaults to any time
+        :type date: datetime.datetime, with tzinfo= datetime.timezone.utc
+
+        :return: the values of fields of each ticker's row
+        :rtype: list of tuples
+        """
+        rows = cls.objects.filter(ticker__in= list(tickers))
+        if date is not None:
+            rows = rows.filter(date__lte= date)
+        latest = dict(rows.order_by().values_list('ticker').annotate(latest= Max('date')))
+        if not latest:
+            return []
+        return [
+            row for row in rows.filter(ticker__in= list(latest), date__in= set(latest.values())).values_list(*fields)
+            if latest[row[0]] == row[1]
+        ]
+
+    @classmethod
+    def get_quotes_matrix(cls, tickers, dates, as_of= False):
+        """
+        Get the prices of every ticker at every date at once: with one query for exact dates,
+        three for as-of prices, or none when the price store holds every ticker.
+
+        :param tickers: the tickers to look up
+        :type tickers: list
+
+        :param dates: the times at which to find the prices
+        :type dates: list of datetime.datetime, with tzinfo= datetime.timezone.utc
+
+        :param as_of: if True, the most recent price at or before each date is found instead
+            of the price at exactly the date
+        :type as_of: bool
+
+        :return: the prices, a len(dates) x len(tickers) array with NaN where a price is 
+            missing, and the boolean mask of the missing prices
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        tickers = list(tickers)
+        dates = list(dates)
+        matrix = np.full((len(dates), len(tickers)), np.nan)
+        if not dates or not tickers:
+            return matrix, np.isnan(matrix)
+
+        requested = np.array([to_datetime64(date) for date in dates], dtype= 'datetime64[s]')
+        first_date, last_date = min(dates), max(dates)
+        store = get_price_store()
+        if store is not None and store.has(tickers):
+            for column, ticker in enumerate(tickers):
+                series = store.series(ticker) if as_of else store.get_slice(ticker, first_date, last_date)
+                matrix[:, column] = lookup_prices(series, requested, as_of)
+            return matrix, np.isnan(matrix)
+
+        if as_of:
+            # the prices in effect at the first date and every price after it
+            prices = cls.get_price_frame(tickers, first_date, last_date)
+            earlier = cls.get_quotes_as_of(tickers, first_date)
+            prices = pd.concat([
+                pd.DataFrame({
+                    'ticker': list(earlier.keys()),
+                    'date': pd.to_datetime([date for date, price in earlier.values()], utc= True),
+                    'price': [float(price) for date, price in earlier.values()],
+                }),
+                prices,
+            ], ignore_index= True).sort_values(['ticker', 'date'], kind= 'stable')
+        else:
+            prices = cls.get_price_frame(tickers, dates= dates)
+
+        columns = {ticker: column for column, ticker in enumerate(tickers)}
+        for ticker, ticker_prices in prices.groupby('ticker', sort= False):
+            series = to_records(ticker_prices['date'], ticker_prices['price'])
+            matrix[:, columns[ticker]] = lookup_prices(series, requested, as_of)
+        return matrix, np.isnan(matrix)
+
+    @classmethod
+    def get_quotes(cls, pairs, as_of= False):
+        """
+        Get the prices of many (ticker, date) pairs at once, see get_quotes_matrix.
+
+        :param pairs: the tickers and the times at which to find their prices
+        :type pairs: list of (str, datetime.datetime)
+
+        :param as_of: if True, the most recent price at or before each date is found instead
+            of the price at exactly the date
+        :type as_of: bool
+
+        :return: the prices in the order of pairs with NaN where a price is missing, and the
+            boolean mask of the missing prices
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        pairs = list(pairs)
+        tickers = list(dict.fromkeys(ticker for ticker, date in pairs))
+        dates = list(dict.fromkeys(date for ticker, date in pairs))
+        matrix, missing = cls.get_quotes_matrix(tickers, dates, as_of= as_of)
+
+        rows = {date: row for row, date in enumerate(dates)}
+        columns = {ticker: column for column, ticker in enumerate(tickers)}
+        prices = matrix[
+            [rows[date] for ticker, date in pairs], 
+            [columns[ticker] for ticker, date in pairs]
+        ]
+        return prices, np.isnan(prices)
+
+    @classmethod
+    def get_stocks_data(cls, tickers=['^DJI', '^GSPC', '^IXIC'], dates= ['2000-01-01', '2020-01-01'], points= None, resolution= 'daily'):
         """
             Retrieves stock data from internally stored Stock table.
 
@@ -164,57 +728,137 @@ class Stock(Model):
             :param dates: range of dates in the format 'YYYY-DD-MM', defaults to ['2000-01-01', '2020-01-01']
             :type dates: list
 
+            :param points: if given, the most dates to return; the prices are downsampled keeping the shape of each series, see utils.downsample.downsample_frame
+            :type points: int
+
+            :param resolution: 'daily', 'weekly' or 'monthly'; weekly and monthly give the last price of each period, dated the period's last day in the range
+            :type resolution: str
+
             :return: a list containin 1.) a list of prices for each ticker that begins with the ticker symbot, 2.) a list of dates
             :rtype: list
         """
         start_date = pytz.utc.localize(datetime.datetime.strptime(dates[0], '%Y-%m-%d'))
         end_date = pytz.utc.localize(datetime.datetime.strptime(dates[1], '%Y-%m-%d'))
 
+        # every day in the range, whether or not there are prices for it
+        days = pd.date_range(start= dates[0], end= dates[1], tz= 'UTC')
+
+        # all tickers at once, pivoted into a day x ticker matrix; days without a price are NaN
+        store = get_price_store()
+        if store is not None and store.has(tickers):
+            prices = store.get_price_frame(tickers, start_date, end_date)
+        else:
+            prices = cls.get_price_frame(tickers, start_date, end_date)
+        if prices.empty:
+            matrix = pd.DataFrame(index= days, columns= list(tickers), dtype= float)
+        else:
+            # in the dtype of days so that reindexing does not convert
+            prices['day'] = prices['date'].dt.normalize().astype(days.dtype)
+            # the earliest price of a day stands for the day
+            prices = prices.sort_values('date').drop_duplicates(subset= ['ticker', 'day'], keep= 'first')
+            matrix = prices.pivot(index= 'day', columns= 'ticker', values= 'price')
+            matrix = matrix.reindex(index= days, columns= list(tickers))
+
+        matrix = resample_last(matrix, resolution)
+        if points is not None:
+            matrix = downsample_frame(matrix, points)
 
         prices_list = []
-        # find all stock prices in the given range
-        for ticker in tickers:
-            dates = pd.date_range(start= start_date, end= end_date).to_pydatetime().tolist()
-            dates = [x.strftime('%Y-%m-%d') for x in dates]
-            
-
-            date_prices = Stock.objects.filter(Q(ticker= ticker))
-            d = date_prices[0].date
-            date_prices = date_prices.filter(date__range=(start_date, end_date))
-            date_prices = date_prices.order_by('-date')
-            date_prices = date_prices.values_list('date', 'price')
-            date_prices = list(date_prices)
-            
-            
-            stock_prices = [float(x[1]) for x in date_prices]
-            stock_dates = [x[0].strftime('%Y-%m-%d') for x in date_prices]
-            date_prices = {stock_dates[i]: stock_prices[i] for i in range(len(stock_prices))}
-            all_prices = []
-            # if the date in stock_dates also exists in the date range 
-            # append the price for this stock on this date 
-            # otherwise append a null value
-            for date in dates:
-                if date in stock_dates:
-                    all_prices.append(date_prices[date])
-                else:
-                    all_prices.append(None)
-            
-
-            start_price = next(num for num in all_prices if num is not None)
-            prices_percent_change = []
-            for price in all_prices:
-                if price is not None:
-                    prices_percent_change.append((price / start_price)-1)
-                else:
-                    prices_percent_change.append(price)
-            
+        for index in range(len(tickers)):
+            column = matrix.iloc[:, index].to_numpy(dtype= float)
+            all_prices = column.astype(object)
+            all_prices[np.isnan(column)] = None
             # prepend the ticker symbol to each price list
-            #prices_percent_change.insert(0, ticker)
-            all_prices.insert(0, ticker)
-            prices_list.append(all_prices)
+            prices_list.append([tickers[index]] + all_prices.tolist())
 
+        dates = np.datetime_as_string(matrix.index.tz_convert(None).to_numpy(), unit= 'D').tolist()
         return [prices_list, dates]
 
+@receiver(pre_save, sender= Stock, dispatch_uid= 'stock_pre_save')
+def stock_pre_save(sender, instance, **kwargs):
+    if instance.security_id is None:
+        instance.security_id = Security.get_ids([instance.ticker])[instance.ticker]
+
+@receiver(post_save, sender= Stock, dispatch_uid= 'stock_post_save')
+def stock_post_save(sender, instance, created, **kwargs):
+    # a new price only has to be compared with the latest one; a changed price may have been
+    # the latest or moved in time, so its ticker is read again
+    store = get_price_store()
+    if created:
+        LatestQuote.update_from(instance)
+        if store is not None:
+            price = pd.DataFrame({
+                'ticker': [instance.ticker],
+                'date': pd.to_datetime([instance.date], utc= True),
+                'price': [round(float(instance.price), site_settings.monetary_decimal_places)],
+            })
+            transaction.on_commit(lambda: store.append(price))
+    else:
+        LatestQuote.refresh([instance.ticker])
+        if store is not None:
+            transaction.on_commit(lambda: store.rebuild([instance.ticker]))
+    transaction.on_commit(Stock.bump_prices_version)
+
+@receiver(post_delete, sender= Stock, dispatch_uid= 'stock_post_delete')
+def stock_post_delete(sender, instance, **kwargs):
+    LatestQuote.refresh([instance.ticker])
+    store = get_price_store()
+    if store is not None:
+        transaction.on_commit(lambda: store.rebuild([instance.ticker]))
+    transaction.on_commit(Stock.bump_prices_version)
+
+class LatestQuote(Model):
+    """
+    The last stored price of each ticker, a denormalized copy of the newest Stock row per 
+    ticker kept in step by the Stock receivers and by price ingestion, so that current prices
+    are read by primary key instead of by scanning the Stock table.
+    """
+    ticker = CharField(max_length= 100, primary_key= True)
+    exchange_abbr = CharField(max_length= 100, default= '')
+    price = DecimalField(
+        max_digits= 50, 
+        decimal_places= site_settings.monetary_decimal_places, 
+        default= 0
+    )
+    date = DateTimeField(default= site_settings.db_default_date)
+
+    def __str__(self):
+        return self.ticker + ' ' + str(self.price) + ' at ' + str(self.date)
+
+    @classmethod
+    def update_from(cls, stock):
+        """
+        Makes a newly stored Stock row the latest quote of its ticker unless a newer one is 
+        stored. Takes two queries at most.
+
+        :param stock: the new price
+        :type stock: table.models.Stock
+        """
+        fields = {'exchange_abbr': stock.exchange_abbr, 'price': stock.price, 'date': stock.date}
+        if not cls.objects.filter(ticker= stock.ticker, date__lte= stock.date).update(**fields):
+            cls.objects.get_or_create(ticker= stock.ticker, defaults= fields)
+
+    @classmethod
+    def refresh(cls, tickers):
+        """
+        Copies the newest Stock row of each of tickers (see Stock.get_latest_rows), or removes 
+        the ticker if it has none. Takes four queries however many tickers are refreshed.
+
+        :param tickers: the tickers to refresh
+        :type tickers: list
+        """
+        tickers = list(set(tickers))
+        if not tickers:
+            return
+        latest = Stock.get_latest_rows(tickers, ['ticker', 'date', 'exchange_abbr', 'price'])
+        quotes = [
+            cls(ticker= ticker, exchange_abbr= exchange_abbr, date= date, price= price) 
+            for ticker, date, exchange_abbr, price in latest
+        ]
+        with transaction.atomic():
+            cls.objects.filter(ticker__in= tickers).delete()
+            cls.objects.bulk_create(quotes)
+
 class StockTransactRecord(Model):
     """Records the buy and/or sell order for a given stock for a given portfolio.
     
@@ -326,6 +970,12 @@ class StockTransactRecord(Model):
         null= True
     )
     transaction_id = UUIDField(default=uuid.uuid4, editable=False)
+
+    class Meta:
+        indexes = [
+            # the transaction history of a portfolio, see Portfolio.get_transaction_page
+            Index(fields= ['portfolio', 'timestamp', 'id'], name= 'stock_transaction_history'),
+        ]
         
     def __str__(self):
         return str(self.timestamp)
@@ -343,6 +993,11 @@ class StockTransactRecord(Model):
     def get_value(self):
         return self.price * self.quantity
 
+    def save(self, *args, **kwargs):
+        # the decision table runs in pre_save; keep its writes and this row in one transaction
+        with transaction.atomic():
+            super(StockTransactRecord, self).save(*args, **kwargs)
+
 @receiver(pre_save, sender= StockTransactRecord, dispatch_uid= 'stocktransaction_pre_save')
 def stock_transaction_pre_save(sender, instance, **kwargs):
     '''
@@ -387,6 +1042,25 @@ class StockInventory(Model):
     def __str__(self):
         return self.exchange_abbr + ' ' + self.ticker + ' ' + str(self.quantity)
 
+#---StockInventory Signals---#
+@receiver(post_save, sender= StockInventory, dispatch_uid= 'stock_inventory_post_save')
+def stock_inventory_post_save(sender, instance, **kwargs):
+    """
+    Keeps the order decision table's cached company inventory in step with saved rows.
+    """
+    if StockTransactRecord.decision_table is not None:
+        cache = StockTransactRecord.decision_table.company_inventory
+        transaction.on_commit(lambda: cache.set(instance.portfolio_id, instance.ticker, instance.quantity))
+
+@receiver(post_delete, sender= StockInventory, dispatch_uid= 'stock_inventory_post_delete')
+def stock_inventory_post_delete(sender, instance, **kwargs):
+    """
+    Keeps the order decision table's cached company inventory in step with deleted rows.
+    """
+    if StockTransactRecord.decision_table is not None:
+        cache = StockTransactRecord.decision_table.company_inventory
+        transaction.on_commit(lambda: cache.discard(instance.portfolio_id, instance.ticker))
+
 class CashTransactionRecord(Model):
     """
     A Record of monetary transactions associtated with a give portfolio.
@@ -482,6 +1156,11 @@ class CashTransactionRecord(Model):
         help_text= "A json text file giving the conditions at time of failure. 0 if no failure.")
     transaction_datetime = DateTimeField(default= site_settings.db_default_date, blank=True)
 
+    def save(self, *args, **kwargs):
+        # the decision table runs in pre_save; keep its writes and this row in one transaction
+        with transaction.atomic():
+            super(CashTransactionRecord, self).save(*args, **kwargs)
+
 #---CashTransactionRecord Signals---#
 @receiver(pre_save, sender= CashTransactionRecord, dispatch_uid= 'portfolio_cash_transaction')
 def portfolio_cash_transaction(sender, instance, **kwargs):
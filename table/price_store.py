@@ -0,0 +1,259 @@
+import contextlib
+import os
+import threading
+from decimal import Decimal
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks outside POSIX; writers are then only serialized within a process
+    fcntl = None
+
+
+# one record per stored price, ordered by date; dates are UTC
+PRICE_DTYPE = np.dtype([('date', 'datetime64[s]'), ('price', 'float64')])
+
+
+class PriceStore:
+    """
+    A read-optimized copy of the Stock table: one .npy file per ticker holding its dates and
+    prices as one contiguous array ordered by date. Files are opened memory-mapped, so reads
+    are zero-copy slices and every process on the host shares the same pages of the OS page
+    cache instead of holding its own copy.
+
+    Files are replaced atomically (written aside, then renamed), so a reader sees either the
+    old or the new version of a ticker, and writers of a ticker hold its lock file so that
+    concurrent appends and rebuilds do not lose each other's prices. Each process keeps its
+    open maps and reopens a file when its modification time changes. Price ingestion and the Stock post_save/post_delete
+    receivers keep the files in step with the table after each commit; build_price_store
+    rebuilds them all.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        # ticker: (modification time, memory-mapped array)
+        self.maps = {}
+
+    def path(self, ticker):
+        return os.path.join(self.directory, quote(ticker, safe= '') + '.npy')
+
+    @contextlib.contextmanager
+    def locked(self, ticker):
+        """Holds the write lock of ticker, shared by every process using the directory."""
+        os.makedirs(self.directory, exist_ok= True)
+        if fcntl is None:
+            with self.write_lock:
+                yield
+            return
+        with open(os.path.join(self.directory, quote(ticker, safe= '') + '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    #---reading---#
+
+    def series(self, ticker):
+        """
+        Returns the stored prices of ticker as a read-only memory-mapped array of PRICE_DTYPE,
+        or None if the ticker is not stored.
+        """
+        path = self.path(ticker)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self.lock:
+            opened = self.maps.get(ticker)
+            if opened is not None and opened[0] == mtime:
+                return opened[1]
+            series = np.load(path, mmap_mode= 'r')
+            self.maps[ticker] = (mtime, series)
+            return series
+
+    def has(self, tickers):
+        return all(os.path.exists(self.path(ticker)) for ticker in tickers)
+
+    def get_slice(self, ticker, start_date= None, end_date= None):
+        """
+        Returns a zero-copy view of the stored prices of ticker between two dates, inclusive.
+
+        :param ticker: the ticker
+        :type ticker: str
+
+        :param start_date: the first date, optional
+        :type start_date: datetime.datetime
+
+        :param end_date: the last date, optional
+        :type end_date: datetime.datetime
+
+        :rtype: numpy.ndarray of PRICE_DTYPE
+        """
+        series = self.series(ticker)
+        if series is None:
+            return np.empty(0, dtype= PRICE_DTYPE)
+        dates = series['date']
+        start = 0 if start_date is None else np.searchsorted(dates, to_datetime64(start_date), 'left')
+        end = len(series) if end_date is None else np.searchsorted(dates, to_datetime64(end_date), 'right')
+        return series[start:end]
+
+    def get_quote(self, ticker, date):
+        """Returns the price of ticker at exactly date, or None."""
+        series = self.get_slice(ticker, date, date)
+        return float(series['price'][0]) if len(series) else None
+
+    def get_quotes_as_of(self, tickers, date= None):
+        """
+        The last stored price at or before date, or the last stored price if date is None, of
+        each of tickers, in the form of Stock.get_quotes_as_of.
+        """
+        quotes = {}
+        for ticker in tickers:
+            series = self.series(ticker)
+            if series is None:
+                continue
+            end = len(series) if date is None else np.searchsorted(series['date'], to_datetime64(date), 'right')
+            if end:
+                last = series[end - 1]
+                quotes[ticker] = (
+                    pd.Timestamp(last['date']).tz_localize('UTC').to_pydatetime(), 
+                    Decimal(str(float(last['price'])))
+                )
+        return quotes
+
+    def get_price_frame(self, tickers, start_date= None, end_date= None):
+        """The stored prices of tickers in the form of Stock.get_price_frame."""
+        frames = []
+        for ticker in tickers:
+            series = self.get_slice(ticker, start_date, end_date)
+            frames.append(pd.DataFrame({
+                'ticker': ticker,
+                'date': pd.to_datetime(series['date']).tz_localize('UTC'),
+                'price': series['price'],
+            }))
+        if not frames:
+            return pd.DataFrame(columns= ['ticker', 'date', 'price'])
+        return pd.concat(frames, ignore_index= True)
+
+    #---writing---#
+
+    def write(self, ticker, series):
+        """Replaces the stored prices of ticker with series, or removes them if it is empty."""
+        os.makedirs(self.directory, exist_ok= True)
+        path = self.path(ticker)
+        if not len(series):
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        temp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(series, dtype= PRICE_DTYPE))
+        os.replace(temp_path, path)
+
+    def rebuild(self, tickers= None):
+        """
+        Rewrites the files of tickers, or of every ticker in the Stock table, from the table;
+        one query per ticker.
+
+        :return: the number of tickers written
+        :rtype: int
+        """
+        from .models import Stock
+
+        if tickers is None:
+            tickers = Stock.objects.order_by('ticker').values_list('ticker', flat= True).distinct()
+        count = 0
+        for ticker in tickers:
+            with self.locked(ticker):
+                self.write_from_table(ticker)
+            count += 1
+        return count
+
+    def write_from_table(self, ticker):
+        """Rewrites the file of ticker from the Stock table; the caller holds its lock."""
+        from .models import Stock
+
+        prices = Stock.get_price_frame([ticker])
+        self.write(ticker, to_records(prices['date'], prices['price']))
+
+    def append(self, prices):
+        """
+        Adds newly inserted prices (a frame with ticker, date and price columns) to the store.
+        A ticker whose new prices all come after its stored ones is extended from the frame;
+        any other stored ticker is rebuilt from the Stock table. Tickers that are not stored
+        yet are created from the table.
+        """
+        for ticker, new_prices in prices.groupby('ticker'):
+            new_prices = new_prices.sort_values('date')
+            new_series = to_records(new_prices['date'], new_prices['price'])
+            with self.locked(ticker):
+                series = self.series(ticker)
+                if series is not None and len(series) and new_series['date'][0] > series['date'][-1]:
+                    self.write(ticker, np.concatenate([series, new_series]))
+                else:
+                    self.write_from_table(ticker)
+
+
+def to_datetime64(date):
+    """Converts an aware datetime to a UTC numpy.datetime64 with the store's resolution."""
+    return np.datetime64(pd.Timestamp(date).tz_convert('UTC').tz_localize(None), 's')
+
+def to_records(dates, prices):
+    """Builds an array of PRICE_DTYPE from a Series of UTC dates and a Series of prices."""
+    series = np.empty(len(dates), dtype= PRICE_DTYPE)
+    series['date'] = dates.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy().astype('datetime64[s]')
+    series['price'] = prices.to_numpy(dtype= float)
+    return series
+
+def lookup_prices(series, dates, as_of= False):
+    """
+    Finds the prices of an array of PRICE_DTYPE at dates, either exactly or as of each date.
+
+    :param series: the prices, ordered by date
+    :type series: numpy.ndarray of PRICE_DTYPE
+
+    :param dates: the dates to look up
+    :type dates: numpy.ndarray of datetime64[s]
+
+    :param as_of: if True, the last price at or before each date is found
+    :type as_of: bool
+
+    :return: the price at each date, NaN where there is none
+    :rtype: numpy.ndarray of float
+    """
+    prices = np.full(len(dates), np.nan)
+    if not len(series):
+        return prices
+    positions = np.searchsorted(series['date'], dates, 'right') - 1
+    found = positions >= 0
+    if not as_of:
+        found &= series['date'][np.maximum(positions, 0)] == dates
+    prices[found] = series['price'][positions[found]]
+    return prices
+
+
+stores = {}
+stores_lock = threading.Lock()
+
+def get_price_store():
+    """
+    Returns the PriceStore in settings.PRICE_STORE_DIR, one per directory and process, or
+    None if the store is disabled.
+    """
+    directory = getattr(settings, 'PRICE_STORE_DIR', None)
+    if not directory:
+        return None
+    with stores_lock:
+        if directory not in stores:
+            stores[directory] = PriceStore(directory)
+        return stores[directory]
@@ -0,0 +1,151 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+
+# This module must not import Django models: parse_price_file runs in the worker processes of
+# ingest_files (see pullstockdata), which only parse and never touch the database.
+
+
+def melt_prices(df):
+    '''
+    Turns a wide price frame (a Date column and one column of prices per ticker, see 
+    pull_from_csv) into one row per ticker and date with columns ticker, date and price. Missing 
+    prices are dropped and dates are localized to UTC.
+
+    :param df: the wide price frame
+    :type df: pandas.DataFrame
+
+    :rtype: pandas.DataFrame
+    '''
+    prices = df.melt(id_vars= 'Date', var_name= 'ticker', value_name= 'price')
+    prices = prices.dropna(subset= ['price'])
+    prices['date'] = pd.to_datetime(prices['Date']).dt.tz_localize('UTC')
+    prices = prices.drop_duplicates(subset= ['ticker', 'date'], keep= 'last')
+    return prices[['ticker', 'date', 'price']].reset_index(drop= True)
+
+def drop_rows_before_cutoffs(df, cutoffs):
+    '''
+    Drops the rows of a wide price frame that are not newer than the cutoff of any of its 
+    tickers, before the frame is melted. 
+
+    :return: the remaining frame and the number of prices dropped
+    :rtype: tuple
+    '''
+    tickers = df.columns[1:]
+    if not len(tickers) or any(ticker not in cutoffs for ticker in tickers):
+        return df, 0
+
+    earliest = pd.Timestamp(min(cutoffs[ticker] for ticker in tickers))
+    is_old = (pd.to_datetime(df['Date']).dt.tz_localize('UTC') <= earliest).to_numpy()
+    if not is_old.any():
+        return df, 0
+    dropped = int(df.loc[is_old, tickers].notna().to_numpy().sum())
+    return df.loc[~is_old], dropped
+
+def count_rows_before(csv_path, cutoff):
+    '''
+    Counts the leading data rows of a wide price file in date order whose date is not newer 
+    than cutoff. Only the date at the start of each of those rows is read and nothing after 
+    the first newer row, so the rows can be skipped without parsing their prices. If the 
+    dates go backwards within those rows the file is not in date order and 0 is returned, so 
+    that the whole file is parsed.
+
+    :param csv_path: the price file, with the Date column first
+    :type csv_path: str
+
+    :param cutoff: the date up to which rows are counted
+    :type cutoff: datetime.datetime
+
+    :rtype: int
+    '''
+    cutoff = pd.Timestamp(cutoff)
+    if cutoff.tzinfo is not None:
+        cutoff = cutoff.tz_convert('UTC').tz_localize(None)
+    cutoff = cutoff.to_pydatetime()
+
+    rows = 0
+    previous = None
+    with open(csv_path, newline= '') as f:
+        f.readline() # the header
+        for line in f:
+            try:
+                date = datetime.fromisoformat(line.split(',', 1)[0].strip().strip('"'))
+            except ValueError:
+                break
+            if previous is not None and date < previous:
+                return 0
+            if date > cutoff:
+                break
+            previous = date
+            rows += 1
+    return rows
+
+def drop_prices_before_cutoffs(prices, cutoffs):
+    '''Keeps the rows of a melted price frame (see melt_prices) that are newer than their ticker's cutoff.'''
+    if prices.empty or not cutoffs:
+        return prices
+    cutoff = pd.to_datetime(prices['ticker'].map(cutoffs), utc= True)
+    return prices[(cutoff.isna() | (prices['date'] > cutoff)).to_numpy()]
+
+def prepare_prices(df, cutoffs= None):
+    '''
+    Melts a wide price frame (see melt_prices), first dropping the prices that are not newer 
+    than their ticker's cutoff if cutoffs are given.
+
+    :return: the melted prices, the number of price cells in df, the number of them that 
+        were older than the cutoffs and the number of rows of df with at least one price
+    :rtype: tuple
+    '''
+    cells = len(df) * (len(df.columns) - 1)
+    price_rows = len(df[df.columns[1:]].dropna(how= 'all'))
+    old = 0
+    if cutoffs is not None:
+        df, old = drop_rows_before_cutoffs(df, cutoffs)
+    prices = melt_prices(df)
+    if cutoffs is not None:
+        newer_prices = drop_prices_before_cutoffs(prices, cutoffs)
+        old += len(prices) - len(newer_prices)
+        prices = newer_prices
+    return prices, cells, old, price_rows
+
+def normalize_price_frame(df, csv_path):
+    '''
+    Brings a price file into the wide form used by pull_from_csv: a Date column and one column 
+    of prices per ticker. Besides that form, per-ticker files with Date, Open, High, Low, Close
+    (and optionally Adj Close and Volume) columns are accepted; the ticker is taken from the 
+    file name and the adjusted close is used when present.
+
+    :param df: the file as read by pandas
+    :type df: pandas.DataFrame
+
+    :param csv_path: the path of the file
+    :type csv_path: str
+
+    :rtype: pandas.DataFrame
+    '''
+    if 'Date' not in df.columns:
+        raise ValueError(csv_path + ' has no Date column')
+
+    if 'Close' in df.columns:
+        ticker = os.path.splitext(os.path.basename(csv_path))[0]
+        price = 'Adj Close' if 'Adj Close' in df.columns else 'Close'
+        return pd.DataFrame({'Date': df['Date'], ticker: df[price]})
+
+    return df
+
+def parse_price_file(csv_path, cutoffs= None):
+    '''
+    Reads, normalizes (see normalize_price_frame) and melts (see melt_prices) one price file.
+    
+    :param csv_path: the path of the file
+    :type csv_path: str
+
+    :param cutoffs: for an incremental ingest, the date per ticker up to which prices are 
+        dropped (see pullstockdata.incremental_cutoffs), optional
+    :type cutoffs: dict
+
+    :return: see prepare_prices
+    :rtype: tuple
+    '''
+    return prepare_prices(normalize_price_frame(pd.read_csv(csv_path), csv_path), cutoffs)
@@ -1,14 +1,141 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import csv
+import json
+import os
 import pandas as pd
 from decimal import Decimal
 import pytz
 import random
+import time
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-from table.models import Stock, StockTransactRecord, Portfolio
+from django.db import transaction
+from django.db.models import Max
 
+from table.models import Security, Stock, LatestQuote, StockTransactRecord, Portfolio, site_settings
+from table.price_store import get_price_store
+from table.stock_test_data.parseprices import (
+    melt_prices, prepare_prices, normalize_price_frame, parse_price_file, count_rows_before
+)
 
-def pull_from_csv(csv_path):
+
+def drop_existing_prices(prices):
+    '''
+    Removes the rows of a melted price frame (see melt_prices) whose ticker and date are already 
+    stored in the Stock table. The stored keys are read with one query over the frame's tickers 
+    and date range.
+
+    :rtype: pandas.DataFrame
+    '''
+    if prices.empty:
+        return prices
+
+    existing = Stock.objects.filter(
+        ticker__in= prices['ticker'].unique().tolist(), 
+        date__range= (prices['date'].min().to_pydatetime(), prices['date'].max().to_pydatetime())
+    ).values_list('ticker', 'date')
+    existing = set(existing)
+    if not existing:
+        return prices
+
+    keys = zip(prices['ticker'].tolist(), list(prices['date'].dt.to_pydatetime()))
+    is_new = [key not in existing for key in keys]
+    return prices[is_new]
+
+def high_water_marks(tickers):
+    '''
+    Returns the latest date stored in the Stock table for each of tickers that has any prices, 
+    read with one grouped query over the (ticker, date) index.
+
+    :param tickers: the tickers to look up
+    :type tickers: list of str
+
+    :rtype: dict of str: datetime
+    '''
+    latest = Stock.objects.filter(ticker__in= list(tickers)).values('ticker').annotate(latest= Max('date'))
+    return {row['ticker']: row['latest'] for row in latest}
+
+def incremental_cutoffs(tickers, backfill_days= 0):
+    '''
+    Returns the date after which prices of each of tickers are ingested incrementally: the 
+    ticker's high-water mark, moved back by backfill_days to re-check a recent window. Tickers 
+    without stored prices have no cutoff.
+
+    :rtype: dict of str: datetime
+    '''
+    return {
+        ticker: latest - timedelta(days= backfill_days) 
+        for ticker, latest in high_water_marks(tickers).items()
+    }
+
+def insert_prices(prices, batch_size= 5000):
+    '''
+    Inserts a melted price frame (see melt_prices) into the Stock table with bulk_create in 
+    batches of batch_size rows, inside one transaction.
+
+    :return: the number of rows inserted
+    :rtype: int
+    '''
+    security_ids = Security.get_ids(prices['ticker'].unique().tolist()) if len(prices) else {}
+    stocks = [
+        Stock(security_id= security_ids[ticker], ticker= ticker, date= date, price= price)
+        for ticker, date, price in zip(
+            prices['ticker'].tolist(), 
+            list(prices['date'].dt.to_pydatetime()), 
+            prices['price'].tolist()
+        )
+    ]
+    with transaction.atomic():
+        Stock.objects.bulk_create(stocks, batch_size= batch_size)
+        if stocks:
+            # bulk_create sends no post_save
+            LatestQuote.refresh(prices['ticker'].unique().tolist())
+            store = get_price_store()
+            if store is not None:
+                stored = prices[['ticker', 'date', 'price']].assign(
+                    price= prices['price'].astype(float).round(site_settings.monetary_decimal_places)
+                )
+                transaction.on_commit(lambda: store.append(stored))
+            transaction.on_commit(Stock.bump_prices_version)
+    return len(stocks)
+
+def ingest_frame(df, batch_size= 5000, cutoffs= None):
+    '''
+    Writes the prices in a wide price frame (see pull_from_csv) that are not stored yet to the 
+    Stock table.
+
+    :param df: the wide price frame
+    :type df: pandas.DataFrame
+
+    :param batch_size: the number of rows per INSERT
+    :type batch_size: int
+
+    :param cutoffs: for an incremental ingest, the date per ticker up to which prices are 
+        skipped without checking the Stock table (see incremental_cutoffs), optional
+    :type cutoffs: dict
+
+    :return: the number of price cells read, the number of prices that were missing, older 
+        than the cutoffs, already stored and inserted, the number of rows with at least one 
+        price and the seconds taken
+    :rtype: dict
+    '''
+    start = time.perf_counter()
+    prices, cells, old, price_rows = prepare_prices(df, cutoffs)
+    missing = cells - old - len(prices)
+    new_prices = drop_existing_prices(prices)
+    inserted = insert_prices(new_prices, batch_size= batch_size)
+    return {
+        'cells': cells,
+        'missing': missing,
+        'old': old,
+        'existing': len(prices) - len(new_prices),
+        'inserted': inserted,
+        'price_rows': price_rows,
+        'seconds': time.perf_counter() - start,
+    }
+
+def pull_from_csv(csv_path, batch_size= 5000, incremental= False, backfill_days= 0):
     '''Pulls from the csv given by :csv_path: and writes to the database. For now only works with csv with a schema like this:
        Date    | Ticker1 | Ticker2 | ...
     -------------------------------------
@@ -17,27 +144,229 @@ def pull_from_csv(csv_path):
     YYYY-MM-DD |  $$$$$  |  $$$$$  | ...
     YYYY-MM-DD |  $$$$$  |  $$$$$  | ...
 
+    Prices already stored for a ticker and date are left alone; the rest are inserted in bulk,
+    see ingest_frame. With incremental only prices newer than each ticker's latest stored date,
+    less backfill_days, are considered (see incremental_cutoffs).
+
     returns a DataFram with the same schema as the csv
     '''
     
     df = pd.read_csv(csv_path)
-    # convert from Timstampl to datetime
-    df['Date'] = pd.to_datetime(df['Date'])
-    dates = df['Date'].dt.to_pydatetime()
-    # the tickers
-    tickers = df.columns[1:]
-    for i, row in df.iterrows():
-        # localize date to utc
-        date = pytz.utc.localize(dates[i])
-        for ticker in tickers:
-            # if no unique ticker-date pair exists, then insert a new stock record
-            if not Stock.objects.filter(ticker= ticker, date= date).exists():
-                price = df.loc[i][ticker]
-                if pd.notna(price):
-                    stock = Stock(ticker= ticker, date= date, price= price)
-                    stock.save()
+    cutoffs = incremental_cutoffs(df.columns[1:], backfill_days) if incremental else None
+    ingest_frame(df, batch_size= batch_size, cutoffs= cutoffs)
     return df
 
+def read_checkpoint(checkpoint_path, csv_path):
+    '''
+    Returns the number of data rows of csv_path already ingested according to the checkpoint 
+    file, or 0 if there is no checkpoint or it was written for a different version of the file.
+    '''
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    stat = os.stat(csv_path)
+    if (
+        checkpoint.get('csv_path') != os.path.abspath(csv_path) or
+        checkpoint.get('size') != stat.st_size or
+        checkpoint.get('mtime') != stat.st_mtime
+    ):
+        return 0
+    return checkpoint['rows']
+
+def write_checkpoint(checkpoint_path, csv_path, rows):
+    '''Records that the first rows data rows of csv_path are ingested; the file is replaced atomically.'''
+    stat = os.stat(csv_path)
+    checkpoint = {
+        'csv_path': os.path.abspath(csv_path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'rows': rows,
+    }
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, checkpoint_path)
+
+def ingest_csv(csv_path, chunksize= 50000, checkpoint_path= None, batch_size= 5000, progress= None, incremental= False, backfill_days= 0):
+    '''
+    Streams a wide price CSV (see pull_from_csv) into the Stock table chunksize rows at a time, 
+    so memory use depends on the chunk size and not on the size of the file. Each chunk is 
+    written in its own transaction (see ingest_frame).
+
+    If checkpoint_path is given the number of rows committed is saved there after every chunk
+    and a later call for the same, unchanged file resumes after those rows; the checkpoint is 
+    removed once the whole file is ingested. A chunk that was committed just before a crash 
+    and is read again is harmless since stored prices are skipped.
+
+    With incremental, when every ticker in the file has a cutoff, the leading rows that are 
+    not newer than the earliest cutoff are skipped without being parsed, relying on the rows 
+    being in date order (see count_rows_before); finding them still reads the date of each.
+
+    :param csv_path: the price CSV
+    :type csv_path: str
+
+    :param chunksize: the number of CSV rows read at a time
+    :type chunksize: int
+
+    :param checkpoint_path: file in which to keep the ingest position, optional
+    :type checkpoint_path: str
+
+    :param batch_size: the number of rows per INSERT
+    :type batch_size: int
+
+    :param progress: called with the totals so far after every chunk, optional
+    :type progress: callable
+
+    :param incremental: only ingest prices newer than each ticker's latest stored date, see 
+        incremental_cutoffs
+    :type incremental: bool
+
+    :param backfill_days: with incremental, also re-check this many days before each ticker's
+        latest stored date
+    :type backfill_days: int
+
+    :return: the totals of ingest_frame over all chunks, plus the number of chunks, the row 
+        the ingest resumed from and the number of older leading rows skipped unparsed
+    :rtype: dict
+    '''
+    start = time.perf_counter()
+    resumed_from = read_checkpoint(checkpoint_path, csv_path)
+    totals = {
+        'cells': 0, 'missing': 0, 'old': 0, 'existing': 0, 'inserted': 0, 'price_rows': 0, 'chunks': 0, 
+        'resumed_from': resumed_from, 'skipped': 0
+    }
+
+    cutoffs = None
+    skip = resumed_from
+    if incremental:
+        # the marks are read once; rows this ingest inserts are newer than them anyway
+        tickers = pd.read_csv(csv_path, nrows= 0).columns[1:]
+        cutoffs = incremental_cutoffs(tickers, backfill_days)
+        if len(tickers) and all(ticker in cutoffs for ticker in tickers):
+            old_rows = count_rows_before(csv_path, min(cutoffs[ticker] for ticker in tickers))
+            totals['skipped'] = max(0, old_rows - resumed_from)
+            skip = max(skip, old_rows)
+
+    rows = skip
+    # keep the header row, skip the data rows already ingested; a callable rather than a
+    # range, which pandas would turn into a set as large as the rows skipped
+    reader = pd.read_csv(csv_path, chunksize= chunksize, skiprows= lambda i: 0 < i <= skip)
+    for chunk in reader:
+        stats = ingest_frame(chunk, batch_size= batch_size, cutoffs= cutoffs)
+        for key in ('cells', 'missing', 'old', 'existing', 'inserted', 'price_rows'):
+            totals[key] += stats[key]
+        totals['chunks'] += 1
+        rows += len(chunk)
+        if checkpoint_path is not None:
+            write_checkpoint(checkpoint_path, csv_path, rows)
+        if progress is not None:
+            progress(dict(totals, rows= rows, seconds= time.perf_counter() - start))
+
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    totals['seconds'] = time.perf_counter() - start
+    return totals
+
+def ingest_files(csv_paths, workers= None, batch_rows= 100000, batch_size= 5000, incremental= False, backfill_days= 0, progress= None):
+    '''
+    Ingests many price files, e.g. one per exchange or per ticker. The files are read, normalized 
+    and melted in a pool of worker processes (see parseprices.parse_price_file) while this 
+    process is the only one writing to the database: it collects the parsed prices and, once 
+    batch_rows of them are pending, drops the stored ones and inserts the rest in one 
+    transaction. A single writer keeps SQLite from failing on lock contention and lets every
+    core parse. At most two files per worker are parsed ahead of the writer.
+
+    :param csv_paths: the price files, in wide form (see pull_from_csv) or per ticker (see 
+        parseprices.normalize_price_frame)
+    :type csv_paths: list of str
+
+    :param workers: the number of parsing processes, defaults to the number of CPUs; 0 parses 
+        in this process
+    :type workers: int
+
+    :param batch_rows: the number of parsed prices to collect before writing
+    :type batch_rows: int
+
+    :param batch_size: the number of rows per INSERT
+    :type batch_size: int
+
+    :param incremental: only ingest prices newer than each ticker's latest stored date, see 
+        incremental_cutoffs
+    :type incremental: bool
+
+    :param backfill_days: with incremental, also re-check this many days before each ticker's
+        latest stored date
+    :type backfill_days: int
+
+    :param progress: called with the totals so far after every file, optional
+    :type progress: callable
+
+    :return: the number of files and the totals of ingest_frame over all files; prices found in
+        more than one file count as already stored
+    :rtype: dict
+    '''
+    start = time.perf_counter()
+    csv_paths = list(csv_paths)
+    totals = {'files': 0, 'cells': 0, 'missing': 0, 'old': 0, 'existing': 0, 'inserted': 0, 'price_rows': 0}
+
+    cutoffs = None
+    if incremental:
+        tickers = set()
+        for csv_path in csv_paths:
+            tickers.update(normalize_price_frame(pd.read_csv(csv_path, nrows= 0), csv_path).columns[1:])
+        cutoffs = incremental_cutoffs(sorted(tickers), backfill_days)
+
+    pending = []
+
+    def write_pending():
+        prices = pd.concat(pending, ignore_index= True)
+        prices = prices.drop_duplicates(subset= ['ticker', 'date'], keep= 'last')
+        new_prices = drop_existing_prices(prices)
+        totals['existing'] += sum(len(frame) for frame in pending) - len(new_prices)
+        totals['inserted'] += insert_prices(new_prices, batch_size= batch_size)
+        pending.clear()
+
+    def collect(result):
+        prices, cells, old, price_rows = result
+        totals['files'] += 1
+        totals['price_rows'] += price_rows
+        totals['cells'] += cells
+        totals['old'] += old
+        totals['missing'] += cells - old - len(prices)
+        if len(prices):
+            pending.append(prices)
+        if sum(len(frame) for frame in pending) >= batch_rows:
+            write_pending()
+        if progress is not None:
+            progress(dict(totals, seconds= time.perf_counter() - start))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers == 0:
+        for csv_path in csv_paths:
+            collect(parse_price_file(csv_path, cutoffs))
+    else:
+        with ProcessPoolExecutor(max_workers= workers) as pool:
+            queued = iter(csv_paths)
+            ahead = 2 * workers
+            running = {pool.submit(parse_price_file, csv_path, cutoffs) for csv_path in islice(queued, ahead)}
+            while running:
+                done, running = wait(running, return_when= FIRST_COMPLETED)
+                for future in done:
+                    collect(future.result())
+                    for csv_path in queued:
+                        running.add(pool.submit(parse_price_file, csv_path, cutoffs))
+                        break
+
+    if pending:
+        write_pending()
+
+    totals['seconds'] = time.perf_counter() - start
+    return totals
+
 def generate_random_transactions(portfolio, k=10):
     '''
     Inserts into the StockTransactRecord of the given Portfolio k number of random Stock transactions based on the historical data in the Stock table.
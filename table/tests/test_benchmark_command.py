@@ -0,0 +1,55 @@
+import json
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command, CommandError
+from django.test import TransactionTestCase
+
+from table.models import StockTransactRecord, Portfolio, StockInventory
+from table.management.commands.benchmark_decision_tables import QueryCounter
+from home.models import User
+from settings import context_processors
+
+class BenchmarkCommandTest(TransactionTestCase):
+
+    def setUp(self):
+        context_processors.site_settings(None)
+        context_processors.stock_management_settings(None)
+        context_processors.cash_management_settings(None)
+        company_user = User.objects.create(is_company= True, username= 'TheCompany', email= 'thecompany@thecompany.com', password= '123123123')
+        self.company_master_portfolio = Portfolio.objects.create(owner= company_user, name= 'company_master_portfolio', cash= 100000)
+        StockTransactRecord.decision_table.company_master_portfolio = self.company_master_portfolio
+        StockTransactRecord.decision_table.company_inventory.invalidate()
+
+    def test_reports_every_kind_with_real_commits(self):
+        # the test database is already a throwaway one
+        out = StringIO()
+        with mock.patch('table.management.commands.benchmark_decision_tables.setup_databases') as setup, \
+                mock.patch('table.management.commands.benchmark_decision_tables.teardown_databases') as teardown:
+            call_command('benchmark_decision_tables', records= 40, clients= 2, portfolios= 3, yes= True, stdout= out)
+        teardown.assert_called_once_with(setup.return_value, verbosity= 0)
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(report['results']['total']['records'], 40)
+        for kind in ('internal_buy', 'external_buy', 'deposit', 'withdrawal'):
+            self.assertIn(kind, report['results'])
+            self.assertEqual(list(report['results'][kind]['outcomes']), ['completed'])
+        benchmark_company = Portfolio.objects.get(owner__username= 'benchmark-client-company')
+        sold = StockInventory.objects.filter(portfolio= benchmark_company, quantity__lt= 10000000)
+        self.assertTrue(sold.exists())
+        self.assertEqual(StockTransactRecord.decision_table.company_master_portfolio, self.company_master_portfolio)
+        self.assertEqual(Portfolio.objects.get(pk= self.company_master_portfolio.pk).cash, 100000)
+
+    def test_savepoints_are_not_counted(self):
+        counter = QueryCounter()
+        execute = mock.Mock()
+        for sql in ('SAVEPOINT "s1"', 'UPDATE "table_portfolio" SET "cash" = 1', 'RELEASE SAVEPOINT "s1"', 'ROLLBACK TO SAVEPOINT "s2"'):
+            counter(execute, sql, None, False, {})
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(execute.call_count, 4)
+
+    def test_refuses_to_run_with_debug_off(self):
+        with mock.patch('table.management.commands.benchmark_decision_tables.setup_databases') as setup:
+            with self.assertRaises(CommandError):
+                call_command('benchmark_decision_tables', records= 1, stdout= StringIO())
+        setup.assert_not_called()
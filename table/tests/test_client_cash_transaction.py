@@ -85,4 +85,35 @@ class ClientCashTransactionTest(TestCase):
         print(ctr.status)
         #print(ctr.transaction_conditions)
         self.assertEqual(client_portfolio.cash, self.CLIENT_START_CASH - 1000)
-        print("(successfully withdrew 1000 USD from client's portfolio.)")
\ No newline at end of file
+        print("(successfully withdrew 1000 USD from client's portfolio.)")
+
+    def test_bulk_client_external_cash_deposits(self):
+        user = User(is_client= True, password= '12345', username= 'client1', email= 'client1@gmail.com')
+        user.save()
+        client = Client.objects.create(user= user)
+        client_portfolio = Portfolio.objects.create(owner= client.user, cash= 0, name= 'first')
+
+        transactions = [
+            CashTransactionRecord(
+                portfolio= client_portfolio,
+                status= 'processing',
+                currency_type= 'USD',
+                amount= amount,
+                amount_in_USD= amount,
+                transaction_type= 'external_deposit',
+                transaction_to= 'self',
+                transaction_from= 'somewhere',
+                transaction_conditions= '0'
+            )
+            for amount in [self.CLIENT_START_CASH, 1000, 10]
+        ]
+        CashTransactionRecord.decision_table.process_transactions(transactions)
+
+        # the 10 USD deposit is under the one-time deposit minimum
+        self.assertEqual([t.status for t in transactions], ['completed', 'completed', 'rejected'])
+        client_portfolio.refresh_from_db()
+        self.assertEqual(client_portfolio.cash, self.CLIENT_START_CASH + 1000)
+        self.assertEqual(CashTransactionRecord.objects.filter(portfolio= client_portfolio).count(), 3)
+        # the completed ones are stamped with when their cash moved
+        stamped = CashTransactionRecord.objects.filter(portfolio= client_portfolio, transaction_datetime__year= 1)
+        self.assertEqual(list(stamped.values_list('status', flat= True)), ['rejected'])
@@ -1,4 +1,6 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from table.models import StockTransactRecord, Portfolio, StockInventory
 from home.models import Company, User, Client
@@ -30,6 +32,10 @@ class ClientStockTransactionTest(TestCase):
         StockTransactRecord.decision_table.company_master_portfolio= cls.company_master_portfolio
         #StockTransactRecord.decision_table.stock_management_settings = cls.stock_management_settings
 
+    def setUp(self):
+        # rows written by earlier tests were rolled back
+        StockTransactRecord.decision_table.company_inventory.invalidate()
+
     def test_internal_stock_transaction(self):
         user = User(is_client= True, password= '12345', username= 'client1', email= 'client1@gmail.com')
         user.save()
@@ -49,4 +55,45 @@ class ClientStockTransactionTest(TestCase):
         print('(last stock transaction for client portfolio is for IBM)')
         self.assertEqual(self.__class__.company_master_portfolio.stockinventory.get(ticker= 'IBM').quantity, 9900)
         print('(100 shares of IBM subtracted from company_master_portfolio)')
-        
+
+    def test_internal_stock_transaction_writes_each_row_once(self):
+        user = User(is_client= True, password= '12345', username= 'client2', email= 'client2@gmail.com')
+        user.save()
+        client = Client.objects.create(user= user)
+        client_portfolio = Portfolio.objects.create(owner= client.user, cash= self.__class__.CLIENT_CASH, name= 'second')
+        StockInventory.objects.create(portfolio= client_portfolio, ticker= 'IBM', exchange_abbr= 'NYSE', quantity= 1)
+
+        stock_transaction = StockTransactRecord(portfolio= client_portfolio, ticker= 'IBM', exchange_abbr= 'NYSE', order_type= 'buy', order_class= 'undetermined', price= 100, quantity= 10)
+        with CaptureQueriesContext(connection) as queries:
+            stock_transaction.save()
+
+        writes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        # the order, the client's cash, the client's inventory and the company's inventory
+        self.assertEqual(len(writes), 4)
+        self.assertEqual(StockTransactRecord.objects.get(pk= stock_transaction.pk).order_status, 'completed')
+        self.assertEqual(Portfolio.objects.get(pk= client_portfolio.pk).cash, self.__class__.CLIENT_CASH - 1000)
+        self.assertEqual(client_portfolio.stockinventory.get(ticker= 'IBM').quantity, 11)
+
+    def test_batch_orders_share_the_company_inventory(self):
+        StockInventory.objects.filter(portfolio= self.__class__.company_master_portfolio, ticker= 'IBM').update(quantity= 100)
+        settings = StockTransactRecord.decision_table.stock_management_settings
+        threshold = settings.internal_share_proportion_threshold
+        # let the inventory alone decide how the orders are routed
+        settings.internal_share_proportion_threshold = 1
+        self.addCleanup(setattr, settings, 'internal_share_proportion_threshold', threshold)
+
+        user = User.objects.create(is_client= True, password= '12345', username= 'client3', email= 'client3@gmail.com')
+        client = Client.objects.create(user= user)
+        orders = [
+            StockTransactRecord(
+                portfolio= Portfolio.objects.create(owner= client.user, cash= self.__class__.CLIENT_CASH, name= 'batch' + str(i)),
+                ticker= 'IBM', exchange_abbr= 'NYSE', order_type= 'buy', order_class= 'undetermined', price= 100, quantity= 9
+            )
+            for i in range(12)
+        ]
+        # 12 orders of 9 shares against 100 held: the first 11 fit, the last has 1 share left
+        StockTransactRecord.decision_table.process_orders(orders)
+
+        self.assertEqual([order.order_status for order in orders], 12 * ['completed'])
+        self.assertEqual([order.order_class for order in orders], 11 * ['internal'] + ['external'])
+        self.assertEqual(self.__class__.company_master_portfolio.stockinventory.get(ticker= 'IBM').quantity, 1)
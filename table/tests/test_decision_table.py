@@ -0,0 +1,216 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from utils.decision_table import decision_table
+from table.decision_tables.profiling import dump_profiles, read_profiles, is_management_command
+
+
+class DecisionTableTest(SimpleTestCase):
+
+    def setUp(self):
+        self.calls = {'a': 0, 'b': 0, 'c': 0}
+        self.dt = decision_table('test_table')
+        self.dt.add_condition(self.a)
+        self.dt.add_condition(self.b)
+        self.dt.add_condition(self.c)
+        self.dt.add_action(self.first)
+        self.dt.add_action(self.second)
+        self.dt.add_case(result= {self.a: 1, self.b: 1}, actions= [self.first])
+        self.dt.add_case(result= {self.a: 1, self.b: -1}, actions= [self.second])
+        self.dt.add_case(result= {self.a: -1}, actions= [self.first, self.second])
+
+    def a(self, record):
+        self.calls['a'] += 1
+        return record['a']
+
+    def b(self, record):
+        self.calls['b'] += 1
+        return record['b']
+
+    def c(self, record):
+        self.calls['c'] += 1
+        return record['c']
+
+    def first(self, record):
+        pass
+
+    def second(self, record):
+        pass
+
+    def test_each_condition_runs_at_most_once(self):
+        actions = self.dt.evaluate({'a': True, 'b': True, 'c': True})
+        self.assertEqual(actions, (self.first,))
+        self.assertEqual(self.calls['a'], 1)
+        self.assertEqual(self.calls['b'], 1)
+        # no case cares about c
+        self.assertEqual(self.calls['c'], 0)
+
+    def test_matches_cases(self):
+        self.assertEqual(self.dt.evaluate({'a': True, 'b': False, 'c': False}), (self.second,))
+        self.assertEqual(self.dt.evaluate({'a': False, 'b': True, 'c': False}), (self.first, self.second))
+
+    def test_get_actions_by_function_and_code(self):
+        record = {'a': True, 'b': False, 'c': False}
+        by_function = self.dt.get_actions({self.a: (record,), self.b: (record,), self.c: (record,)})
+        by_code = self.dt.get_actions({0: (record,), 1: (record,), 2: (record,)})
+        self.assertEqual(by_function, [self.second])
+        self.assertEqual(by_code, [self.second])
+
+    def test_adding_a_case_recompiles(self):
+        self.dt.evaluate({'a': True, 'b': True, 'c': True})
+        self.dt.add_case(result= {self.a: 1, self.b: 1, self.c: 1}, actions= [self.second])
+        self.assertEqual(self.dt.evaluate({'a': True, 'b': True, 'c': True}), (self.first, self.second))
+
+    def test_evaluate_batch_agrees_with_evaluate(self):
+        records = [{'a': bool(v & 1), 'b': bool(v & 2), 'c': bool(v & 4)} for v in range(8)]
+        self.assertEqual(self.dt.evaluate_batch(records), [self.dt.evaluate(record) for record in records])
+
+    def test_evaluate_batch_uses_batch_function(self):
+        batches = []
+        def batch_c(records):
+            batches.append(len(records))
+            return [record['c'] for record in records]
+        dt = decision_table('batch_table')
+        dt.add_condition(self.c, batch_function= batch_c)
+        dt.add_action(self.first)
+        dt.add_case(result= {self.c: 1}, actions= [self.first])
+        plan = dt.evaluate_batch([{'c': True}, {'c': False}, {'c': True}])
+        self.assertEqual(plan, [(self.first,), (), (self.first,)])
+        self.assertEqual(batches, [3])
+        self.assertEqual(self.calls['c'], 0)
+
+    def test_tree_agrees_with_case_masks(self):
+        for vector in range(8):
+            record = {'a': bool(vector & 1), 'b': bool(vector & 2), 'c': bool(vector & 4)}
+            actions = self.dt.evaluate(record)
+            expected = ()
+            for care, want, case_actions in self.dt.case_masks:
+                if vector & care == want:
+                    expected += case_actions
+            self.assertEqual(actions, expected)
+
+    def test_profiling_is_off_by_default(self):
+        self.dt.evaluate({'a': True, 'b': True, 'c': True})
+        self.assertIsNone(self.dt.profile_snapshot())
+
+    def test_profile_counts_calls_and_matches(self):
+        self.dt.enable_profiling()
+        record = {'a': True, 'b': False, 'c': False}
+        context = self.dt.new_context(record)
+        self.dt.evaluate(record, context= context)
+        self.dt.evaluate(record, context= context)
+        self.dt.evaluate_batch([{'a': False, 'b': True, 'c': True}, {'a': True, 'b': True, 'c': True}])
+
+        snapshot = self.dt.profile_snapshot()
+        self.assertEqual(snapshot['records'], 3)
+        self.assertEqual(snapshot['evaluations'], 4)
+        self.assertEqual(snapshot['evaluations_per_record'], 4 / 3)
+        calls = {row['name']: row['calls'] for row in snapshot['conditions']}
+        self.assertEqual(calls, {'a': 4, 'b': 3, 'c': 0})
+        self.assertEqual([row['matches'] for row in snapshot['cases']], [1, 2, 1])
+
+        self.dt.reset_profiling()
+        self.assertEqual(self.dt.profile_snapshot()['evaluations'], 0)
+
+
+class DecisionTreeCostTest(SimpleTestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.dt = decision_table('cost_table')
+        self.dt.add_condition(self.expensive, cost= 10)
+        self.dt.add_condition(self.cheap)
+        self.dt.add_action(self.action)
+        self.dt.add_case(result= {self.cheap: 1, self.expensive: 1}, actions= [self.action])
+
+    def expensive(self, record):
+        self.calls.append('expensive')
+        return record['expensive']
+
+    def cheap(self, record):
+        self.calls.append('cheap')
+        return record['cheap']
+
+    def action(self, record):
+        pass
+
+    def test_cheap_condition_runs_first(self):
+        self.dt.evaluate({'expensive': True, 'cheap': True})
+        self.assertEqual(self.calls, ['cheap', 'expensive'])
+
+    def test_expensive_condition_skipped_once_cases_ruled_out(self):
+        self.assertEqual(self.dt.evaluate({'expensive': True, 'cheap': False}), ())
+        self.assertEqual(self.calls, ['cheap'])
+
+
+class ProfileDumpTest(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def a(self, record):
+        return record['a']
+
+    def action(self, record):
+        pass
+
+    def test_dump_is_read_back(self):
+        dt = decision_table('dumped_table')
+        dt.add_condition(self.a)
+        dt.add_action(self.action)
+        dt.add_case(result= {self.a: 1}, actions= [self.action])
+        dt.enable_profiling()
+        dt.evaluate({'a': True})
+
+        dump_profiles(self.directory, [dt])
+        dumps = read_profiles(self.directory)
+        self.assertEqual([dump['pid'] for dump in dumps], [os.getpid()])
+        self.assertEqual(dumps[0]['tables'][0]['evaluations'], 1)
+
+    def test_command_adds_up_the_processes(self):
+        for pid, calls in [(1, 3), (2, 5)]:
+            snapshot = {
+                'name': 'CashTransactionRecordDecisionTable', 'seconds': float(pid), 'records': calls,
+                'evaluations': calls, 'evaluations_per_record': 1.0, 'unmatched': 0,
+                'conditions': [{'code': 0, 'name': 'is_client', 'calls': calls, 'total_seconds': 0.5, 'mean_seconds': 0.5 / calls}],
+                'cases': [{'code': 0, 'name': 'deposit', 'matches': calls}],
+            }
+            with open(os.path.join(self.directory, 'profile-' + str(pid) + '.json'), 'w') as f:
+                json.dump({'pid': pid, 'written_at': time.time(), 'tables': [snapshot]}, f)
+
+        out = io.StringIO()
+        call_command('decision_table_profile', directory= self.directory, stdout= out)
+        [report] = json.loads(out.getvalue())
+        self.assertEqual(report['processes'], 2)
+        self.assertEqual(report['records'], 8)
+        self.assertEqual(report['conditions'][0]['calls'], 8)
+        self.assertEqual(report['conditions'][0]['mean_seconds'], 1 / 8)
+        self.assertEqual(report['cases'][0]['matches'], 8)
+
+    def test_stale_dumps_are_skipped(self):
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        for pid in [os.getpid(), exited.pid]:
+            with open(os.path.join(self.directory, 'profile-' + str(pid) + '.json'), 'w') as f:
+                json.dump({'pid': pid, 'written_at': time.time() - 600, 'tables': []}, f)
+
+        self.assertEqual(read_profiles(self.directory, max_age= 180), [])
+        # only the dump of the exited process is gone for good
+        self.assertEqual(os.listdir(self.directory), ['profile-' + str(os.getpid()) + '.json'])
+        self.assertEqual(len(read_profiles(self.directory)), 1)
+
+    def test_management_commands_do_not_dump(self):
+        self.assertTrue(is_management_command(['manage.py', 'migrate']))
+        self.assertTrue(is_management_command(['/srv/invested/manage.py', 'test']))
+        self.assertFalse(is_management_command(['manage.py', 'runserver']))
+        self.assertFalse(is_management_command(['/usr/bin/gunicorn', 'invested.wsgi']))
@@ -0,0 +1,114 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from table.models import CashTransactionRecord, StockTransactRecord, Portfolio, StockInventory
+from home.models import Company, User, Client
+from settings import context_processors
+
+
+def data_queries(captured):
+    '''Queries other than the savepoints opened by transaction.atomic.'''
+    return [q['sql'] for q in captured if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+
+
+class DecisionTableQueryCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        context_processors.site_settings(None)
+        context_processors.stock_management_settings(None)
+        context_processors.cash_management_settings(None)
+        company_user = User.objects.create(is_company= True, username= 'TheCompany', email= 'thecompany@thecompany.com', password= '123123123')
+        Company.objects.create(user= company_user)
+        cls.company_master_portfolio = Portfolio.objects.create(owner= company_user, name= 'company_master_portfolio', cash= 100000000)
+        StockInventory.objects.create(portfolio= cls.company_master_portfolio, ticker= 'IBM', exchange_abbr= 'NYSE', quantity= 10000)
+        StockTransactRecord.decision_table.company_master_portfolio = cls.company_master_portfolio
+
+        user = User.objects.create(is_client= True, password= '12345', username= 'client1', email= 'client1@gmail.com')
+        Client.objects.create(user= user)
+        cls.client_user = user
+
+    def setUp(self):
+        # rows written by earlier tests were rolled back
+        StockTransactRecord.decision_table.company_inventory.invalidate()
+
+    def new_portfolio(self, name, cash):
+        # fetched fresh so nothing related is cached on the instance
+        Portfolio.objects.create(owner= self.client_user, cash= cash, name= name)
+        return Portfolio.objects.get(name= name)
+
+    def new_deposit(self, portfolio, amount):
+        return CashTransactionRecord(
+            portfolio= portfolio,
+            status= 'processing',
+            currency_type= 'USD',
+            amount= amount,
+            amount_in_USD= amount,
+            transaction_type= 'external_deposit',
+            transaction_to= 'self',
+            transaction_from= 'somewhere',
+            transaction_conditions= '0'
+        )
+
+    def test_cash_deposit_queries(self):
+        portfolio = self.new_portfolio('cash', 0)
+        with CaptureQueriesContext(connection) as queries:
+            self.new_deposit(portfolio, 1000).save()
+        # load the owner once, insert the transaction, update the portfolio cash
+        self.assertEqual(len(data_queries(queries.captured_queries)), 3)
+
+    def test_internal_buy_order_queries(self):
+        portfolio = self.new_portfolio('stock', 100000)
+        order = StockTransactRecord(portfolio= portfolio, ticker= 'IBM', exchange_abbr= 'NYSE', order_type= 'buy', price= 100, quantity= 10)
+        StockTransactRecord.decision_table.company_inventory.get(self.company_master_portfolio, 'IBM')
+        with CaptureQueriesContext(connection) as queries:
+            order.save()
+        # insert the order, update the client's cash, update then create the client's
+        # inventory row, update the company's inventory row; routing reads the cache
+        queries = data_queries(queries.captured_queries)
+        self.assertEqual(len(queries), 5)
+        self.assertFalse([sql for sql in queries if sql.startswith('SELECT')])
+        self.assertEqual(order.order_status, 'completed')
+        self.assertEqual(order.order_class, 'internal')
+
+    def test_stale_company_inventory_cache_routes_order_external(self):
+        cache = StockTransactRecord.decision_table.company_inventory
+        cache.get(self.company_master_portfolio, 'IBM')
+        # another process sells most of the shares behind this process's back
+        StockInventory.objects.filter(portfolio= self.company_master_portfolio, ticker= 'IBM').update(quantity= 5)
+
+        portfolio = self.new_portfolio('stale', 100000)
+        order = StockTransactRecord(portfolio= portfolio, ticker= 'IBM', exchange_abbr= 'NYSE', order_type= 'buy', price= 100, quantity= 10)
+        order.save()
+        self.assertEqual(order.order_status, 'completed')
+        self.assertEqual(order.order_class, 'external')
+        self.assertEqual(Portfolio.objects.get(pk= portfolio.pk).cash, 99000)
+        self.assertEqual(portfolio.stockinventory.get(ticker= 'IBM').quantity, 10)
+        self.assertEqual(StockInventory.objects.get(portfolio= self.company_master_portfolio, ticker= 'IBM').quantity, 5)
+        self.assertEqual(cache.get(self.company_master_portfolio, 'IBM'), 5)
+
+    def test_stale_company_inventory_cache_in_a_batch(self):
+        cache = StockTransactRecord.decision_table.company_inventory
+        cache.get(self.company_master_portfolio, 'IBM')
+        StockInventory.objects.filter(portfolio= self.company_master_portfolio, ticker= 'IBM').update(quantity= 5)
+
+        portfolio = self.new_portfolio('stale_batch', 100000)
+        order = StockTransactRecord(portfolio= portfolio, ticker= 'IBM', exchange_abbr= 'NYSE', order_type= 'buy', price= 100, quantity= 10)
+        StockTransactRecord.decision_table.process_orders([order])
+        self.assertEqual((order.order_status, order.order_class), ('completed', 'external'))
+        self.assertEqual(Portfolio.objects.get(pk= portfolio.pk).cash, 99000)
+        self.assertEqual(StockInventory.objects.get(portfolio= self.company_master_portfolio, ticker= 'IBM').quantity, 5)
+
+    def test_batch_cash_deposit_queries_do_not_grow_with_records(self):
+        portfolios = [self.new_portfolio('batch' + str(i), 0) for i in range(5)]
+        transactions = [self.new_deposit(portfolio, 1000) for portfolio in portfolios]
+        # drop the cached portfolios so the batch has to load them
+        for transaction in transactions:
+            CashTransactionRecord.portfolio.field.delete_cached_value(transaction)
+
+        with CaptureQueriesContext(connection) as queries:
+            CashTransactionRecord.decision_table.process_transactions(transactions)
+        # load portfolios and owners, insert the transactions, one cash update per portfolio
+        self.assertEqual(len(data_queries(queries.captured_queries)), 3 + len(portfolios))
+        self.assertEqual([t.status for t in transactions], 5 * ['completed'])
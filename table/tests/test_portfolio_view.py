@@ -0,0 +1,84 @@
+from django.core import signing
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from table.models import Portfolio, StockTransactRecord
+from home.models import Company, User, Client
+from settings import context_processors
+
+class PortfolioViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        context_processors.site_settings(None)
+        context_processors.stock_management_settings(None)
+        context_processors.cash_management_settings(None)
+        company_user = User.objects.create(is_company= True, username= 'TheCompany', email= 'thecompany@thecompany.com', password= '123123123')
+        Company.objects.create(user= company_user)
+
+        cls.user = User.objects.create(is_client= True, password= '12345', username= 'client1', email= 'client1@gmail.com')
+        Client.objects.create(user= cls.user)
+        cls.portfolio = Portfolio.objects.create(owner= cls.user, cash= 1000, name= 'first')
+        # bulk_create skips the decision tables, which are not under test here
+        StockTransactRecord.objects.bulk_create([
+            StockTransactRecord(portfolio= cls.portfolio, ticker= 'IBM', order_type= 'buy', price= 10.5, quantity= 10),
+            StockTransactRecord(portfolio= cls.portfolio, ticker= 'CAT', order_type= 'buy', price= 2, quantity= 3),
+            StockTransactRecord(portfolio= cls.portfolio, ticker= 'IBM', order_type= 'sell', price= 12, quantity= 4),
+        ])
+
+    def test_rows_with_running_total_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = self.portfolio.get_transaction_rows()
+        self.assertEqual([row['ticker'] for row in rows], ['IBM', 'CAT', 'IBM'])
+        self.assertEqual([row['value'] for row in rows], [105.0, 6.0, 48.0])
+        self.assertEqual([row['total_value'] for row in rows], [105.0, 111.0, 63.0])
+        self.assertEqual(self.portfolio.get_stocks_info(), [[10.5, 2.0, 12.0], [10, 3, 4], [105.0, 6.0, 48.0], ['buy', 'buy', 'sell']])
+
+    def test_page_queries_do_not_grow_with_transactions(self):
+        self.client.force_login(self.user)
+        url = reverse('table:client:client_portfolio_view', args= ['first'])
+        # the first requests also create and cache the settings the page reads
+        self.client.get(url)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, '$63.00')
+
+        StockTransactRecord.objects.bulk_create([
+            StockTransactRecord(portfolio= self.portfolio, ticker= 'IBM', order_type= 'buy', price= 1, quantity= 1)
+            for number in range(20)
+        ])
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
+    def test_pages_carry_the_running_total(self):
+        StockTransactRecord.objects.bulk_create([
+            StockTransactRecord(portfolio= self.portfolio, ticker= 'IBM', order_type= 'buy', price= 1, quantity= number)
+            for number in range(1, 8)
+        ])
+        all_rows = self.portfolio.get_transaction_rows()
+
+        rows, cursor, pages = [], None, 0
+        while True:
+            with self.assertNumQueries(1):
+                page, cursor = self.portfolio.get_transaction_page(cursor= cursor, page_size= 4)
+            rows += page
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(rows, all_rows)
+
+        other = Portfolio.objects.create(owner= self.user, cash= 0, name= 'second')
+        with self.assertRaises(signing.BadSignature):
+            other.get_transaction_page(cursor= self.portfolio.get_transaction_page(page_size= 1)[1])
+
+    def test_transaction_page_endpoint(self):
+        self.client.force_login(self.user)
+        url = reverse('table:client:client_transaction_page', args= ['first'])
+        first_page = self.client.get(url).json()
+        self.assertEqual(first_page['next'], None)
+        self.assertEqual([row['total_value'] for row in first_page['rows']], [105.0, 111.0, 63.0])
+        self.assertEqual(self.client.get(url, {'cursor': 'forged'}).status_code, 400)
@@ -0,0 +1,149 @@
+import os
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from table.models import Security, Stock, LatestQuote
+from table.stock_test_data.parseprices import count_rows_before
+from table.stock_test_data.pullstockdata import ingest_frame, ingest_csv, write_checkpoint, incremental_cutoffs, ingest_files
+
+class PriceIngestTest(TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'Date': ['2000-01-03', '2000-01-04', '2000-01-05'],
+            'IBM': [72.6, 70.1, np.nan],
+            'CAT': [11.6, 11.5, 11.4],
+        })
+
+    def test_inserts_prices_in_bulk(self):
+        with CaptureQueriesContext(connection) as queries:
+            stats = ingest_frame(self.df)
+
+        self.assertEqual(stats['inserted'], 5)
+        self.assertEqual(stats['missing'], 1)
+        self.assertEqual(Stock.objects.count(), 5)
+        self.assertEqual(float(Stock.objects.get(ticker= 'IBM', date__date= '2000-01-04').price), 70.1)
+        # one SELECT for the stored keys and one INSERT, however many prices, two SELECTs and 
+        # an INSERT to refresh the latest quotes and three to create the new securities
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith(('SELECT', 'INSERT'))]), 8)
+        self.assertEqual(LatestQuote.objects.get(ticker= 'CAT').price, Decimal('11.4'))
+        self.assertEqual(Security.objects.get(ticker= 'CAT').prices.count(), 3)
+
+    def test_counts_only_rows_with_prices(self):
+        df = pd.concat([self.df, pd.DataFrame({'Date': ['2000-01-06'], 'IBM': [np.nan], 'CAT': [np.nan]})])
+        stats = ingest_frame(df)
+        self.assertEqual(stats['cells'], 8)
+        self.assertEqual(stats['price_rows'], 3)
+
+    def test_skips_stored_prices(self):
+        ingest_frame(self.df.iloc[:2])
+        stats = ingest_frame(self.df)
+        self.assertEqual(stats['existing'], 4)
+        self.assertEqual(stats['inserted'], 1)
+        self.assertEqual(Stock.objects.count(), 5)
+
+    def test_streams_in_chunks_and_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'prices.csv')
+            checkpoint_path = os.path.join(directory, 'prices.checkpoint')
+            self.df.to_csv(csv_path, index= False)
+
+            # pretend an earlier run committed the first two rows and then died
+            ingest_frame(self.df.iloc[:2])
+            write_checkpoint(checkpoint_path, csv_path, 2)
+
+            stats = ingest_csv(csv_path, chunksize= 1, checkpoint_path= checkpoint_path)
+            self.assertEqual(stats['resumed_from'], 2)
+            self.assertEqual(stats['chunks'], 1)
+            self.assertEqual(stats['inserted'], 1)
+            self.assertEqual(Stock.objects.count(), 5)
+            self.assertFalse(os.path.exists(checkpoint_path))
+
+    def test_ignores_checkpoint_of_changed_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'prices.csv')
+            checkpoint_path = os.path.join(directory, 'prices.checkpoint')
+            self.df.iloc[:2].to_csv(csv_path, index= False)
+            write_checkpoint(checkpoint_path, csv_path, 2)
+            self.df.to_csv(csv_path, index= False)
+
+            stats = ingest_csv(csv_path, chunksize= 2, checkpoint_path= checkpoint_path)
+            self.assertEqual(stats['resumed_from'], 0)
+            self.assertEqual(stats['chunks'], 2)
+            self.assertEqual(Stock.objects.count(), 5)
+
+    def test_incremental_ingest_skips_prices_up_to_high_water_mark(self):
+        ingest_frame(self.df.iloc[:2])
+        Stock.objects.filter(ticker= 'CAT', date__date= '2000-01-03').delete()
+
+        stats = ingest_frame(self.df, cutoffs= incremental_cutoffs(['IBM', 'CAT']))
+        self.assertEqual(stats['old'], 4)
+        self.assertEqual(stats['inserted'], 1)
+        self.assertEqual(stats['missing'], 1)
+        # the deleted price is older than CAT's mark and is not looked at
+        self.assertFalse(Stock.objects.filter(ticker= 'CAT', date__date= '2000-01-03').exists())
+        self.assertTrue(Stock.objects.filter(ticker= 'CAT', date__date= '2000-01-05').exists())
+
+        stats = ingest_frame(self.df, cutoffs= incremental_cutoffs(['IBM', 'CAT'], backfill_days= 3))
+        self.assertEqual(stats['old'], 0)
+        self.assertEqual(stats['existing'], 4)
+        self.assertEqual(stats['inserted'], 1)
+        self.assertEqual(Stock.objects.count(), 5)
+
+    def test_incremental_csv_ingest_skips_older_leading_rows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'prices.csv')
+            self.df.to_csv(csv_path, index= False)
+            ingest_frame(self.df.iloc[:2])
+
+            # both tickers are stored up to 2000-01-04, so the first two rows are not parsed
+            stats = ingest_csv(csv_path, chunksize= 1, incremental= True)
+            self.assertEqual(stats['skipped'], 2)
+            self.assertEqual(stats['chunks'], 1)
+            self.assertEqual(stats['cells'], 2)
+            self.assertEqual(stats['inserted'], 1)
+            self.assertEqual(Stock.objects.count(), 5)
+
+            stats = ingest_csv(csv_path, incremental= True, backfill_days= 1)
+            self.assertEqual(stats['skipped'], 1)
+            self.assertEqual(stats['existing'], 2)
+            self.assertEqual(stats['inserted'], 0)
+
+    def test_incremental_csv_ingest_parses_out_of_order_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'prices.csv')
+            self.df.iloc[[1, 0, 2]].to_csv(csv_path, index= False)
+            self.assertEqual(count_rows_before(csv_path, datetime(2000, 1, 4)), 0)
+            ingest_frame(self.df.iloc[:2])
+
+            stats = ingest_csv(csv_path, incremental= True)
+            self.assertEqual(stats['skipped'], 0)
+            self.assertEqual(stats['old'], 4)
+            self.assertEqual(stats['inserted'], 1)
+            self.assertEqual(Stock.objects.count(), 5)
+
+    def test_ingests_many_files_with_one_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wide_path = os.path.join(directory, 'nyse.csv')
+            self.df.to_csv(wide_path, index= False)
+            ticker_path = os.path.join(directory, 'TSLA.csv')
+            pd.DataFrame({
+                'Date': ['2000-01-03', '2000-01-04'],
+                'Open': [1, 2], 'High': [1, 2], 'Low': [1, 2], 'Close': [1.5, 2.5], 'Adj Close': [1.4, 2.4], 'Volume': [10, 20],
+            }).to_csv(ticker_path, index= False)
+
+            # more files than the pool parses ahead of the writer
+            stats = ingest_files([wide_path, ticker_path, wide_path], workers= 1, batch_rows= 3)
+
+        self.assertEqual(stats['files'], 3)
+        self.assertEqual(stats['inserted'], 7)
+        self.assertEqual(stats['existing'], 5)
+        self.assertEqual(Stock.objects.count(), 7)
+        self.assertEqual(float(Stock.objects.get(ticker= 'TSLA', date__date= '2000-01-04').price), 2.4)
@@ -0,0 +1,106 @@
+import datetime
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytz
+from django.test import TransactionTestCase, override_settings
+
+from table.models import Stock, LatestQuote
+from table.price_store import get_price_store
+from table.stock_test_data.pullstockdata import ingest_frame
+
+class PriceStoreTest(TransactionTestCase):
+    # a TransactionTestCase so that the on_commit updates of the store run
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(
+            PRICE_STORE_DIR= self.directory,
+            CACHES= {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        )
+        self.settings.enable()
+        self.df = pd.DataFrame({
+            'Date': ['2000-01-03', '2000-01-04', '2000-01-05'],
+            'IBM': [72.6, 70.1, 70.5],
+            '^DJI': [11357.509766, 10997.929688, None],
+        })
+        ingest_frame(self.df.iloc[:2])
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_ingest_keeps_the_store_in_step(self):
+        store = get_price_store()
+        self.assertTrue(store.has(['IBM', '^DJI']))
+        self.assertEqual(list(store.series('IBM')['price']), [72.6, 70.1])
+
+        ingest_frame(self.df)
+        self.assertEqual(list(store.series('IBM')['price']), [72.6, 70.1, 70.5])
+        self.assertEqual(len(store.series('^DJI')), 2)
+
+        Stock.objects.get(ticker= 'IBM', date__date= '2000-01-04').delete()
+        self.assertEqual(list(store.series('IBM')['price']), [72.6, 70.5])
+
+    def test_saved_prices_are_added_to_the_store(self):
+        store = get_price_store()
+        later = pytz.utc.localize(datetime.datetime(2000, 1, 5))
+        with self.assertNumQueries(3):
+            # the security's id, the INSERT and the latest quote's UPDATE; the store is
+            # extended from the row without reading the table
+            Stock.objects.create(ticker= 'IBM', date= later, price= 70.5)
+        self.assertEqual(list(store.series('IBM')['price']), [72.6, 70.1, 70.5])
+        self.assertEqual(LatestQuote.objects.get(ticker= 'IBM').date, later)
+
+        # an older price is put in its place from the table and is not the latest quote
+        Stock.objects.create(ticker= 'IBM', date= pytz.utc.localize(datetime.datetime(1999, 12, 31)), price= 71)
+        self.assertEqual(list(store.series('IBM')['price']), [71, 72.6, 70.1, 70.5])
+        self.assertEqual(LatestQuote.objects.get(ticker= 'IBM').date, later)
+
+    def test_writers_of_a_ticker_wait_for_each_other(self):
+        store = get_price_store()
+        prices = pd.DataFrame({'ticker': ['IBM'], 'date': pd.to_datetime(['2000-01-05'], utc= True), 'price': [70.5]})
+        with store.locked('IBM'):
+            writer = threading.Thread(target= store.append, args= (prices,))
+            writer.start()
+            time.sleep(0.1)
+            self.assertTrue(writer.is_alive())
+            self.assertEqual(len(store.series('IBM')), 2)
+        writer.join()
+        self.assertEqual(list(store.series('IBM')['price']), [72.6, 70.1, 70.5])
+
+    def test_reads_match_the_stock_table(self):
+        ingest_frame(self.df)
+        arguments = {'tickers': ['IBM', '^DJI'], 'dates': ['2000-01-02', '2000-01-06']}
+        with self.assertNumQueries(0):
+            from_store = Stock.get_stocks_data(**arguments)
+            quote = Stock.get_quote(ticker= 'IBM', date_and_time= '2000-01-04 00:00:00')
+            as_of = Stock.get_quotes_as_of(['IBM', '^DJI'], pytz.utc.localize(datetime.datetime(2000, 1, 5, 12)))
+            latest = Stock.get_latest_quotes(['IBM', '^DJI'])
+            dates = [pytz.utc.localize(datetime.datetime(2000, 1, day)) for day in (2, 4, 5, 6)]
+            matrix, missing = Stock.get_quotes_matrix(['IBM', '^DJI'], dates)
+            as_of_matrix, as_of_missing = Stock.get_quotes_matrix(['IBM', '^DJI'], dates, as_of= True)
+
+        self.settings.disable()
+        try:
+            self.assertEqual(from_store, Stock.get_stocks_data(**arguments))
+            self.assertEqual(quote, Stock.get_quote(ticker= 'IBM', date_and_time= '2000-01-04 00:00:00'))
+            self.assertEqual(as_of, Stock.get_quotes_as_of(['IBM', '^DJI'], pytz.utc.localize(datetime.datetime(2000, 1, 5, 12))))
+            self.assertEqual(latest, Stock.get_latest_quotes(['IBM', '^DJI']))
+            np.testing.assert_array_equal(matrix, Stock.get_quotes_matrix(['IBM', '^DJI'], dates)[0])
+            np.testing.assert_array_equal(as_of_matrix, Stock.get_quotes_matrix(['IBM', '^DJI'], dates, as_of= True)[0])
+            self.assertEqual(as_of_missing.tolist(), [[True, True], [False, False], [False, False], [False, False]])
+        finally:
+            self.settings.enable()
+
+    def test_slices_are_views_of_the_map(self):
+        store = get_price_store()
+        series = store.series('IBM')
+        start = pytz.utc.localize(datetime.datetime(2000, 1, 4))
+        view = store.get_slice('IBM', start, start)
+        self.assertEqual(len(view), 1)
+        self.assertTrue(np.shares_memory(view, series))
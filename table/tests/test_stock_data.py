@@ -0,0 +1,167 @@
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytz
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from table.models import Security, Stock, LatestQuote
+from table.stock_test_data.pullstockdata import ingest_frame
+from utils.downsample import lttb_indices, downsample_frame
+
+class StockDataTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        def day(text, hour= 0):
+            return pytz.utc.localize(datetime.datetime.strptime(text, '%Y-%m-%d') + datetime.timedelta(hours= hour))
+
+        Stock.objects.create(ticker= 'IBM', date= day('2000-01-03'), price= 72.6036)
+        Stock.objects.create(ticker= 'IBM', date= day('2000-01-05'), price= 70.5)
+        Stock.objects.create(ticker= 'CAT', date= day('2000-01-04', hour= 16), price= 11.5)
+        Stock.objects.create(ticker= 'CAT', date= day('2000-01-04'), price= 11.4)
+        # outside the requested range
+        Stock.objects.create(ticker= 'IBM', date= day('2000-01-07'), price= 1)
+
+    def test_aligns_prices_to_every_day_in_one_query(self):
+        with self.assertNumQueries(1):
+            prices_list, dates = Stock.get_stocks_data(tickers= ['IBM', 'CAT', 'NONE'], dates= ['2000-01-02', '2000-01-06'])
+
+        self.assertEqual(dates, ['2000-01-02', '2000-01-03', '2000-01-04', '2000-01-05', '2000-01-06'])
+        self.assertEqual(prices_list, [
+            ['IBM', None, 72.6036, None, 70.5, None],
+            # the earliest price of a day is used
+            ['CAT', None, None, 11.4, None, None],
+            ['NONE', None, None, None, None, None],
+        ])
+
+    def test_resamples_to_the_last_price_of_each_period(self):
+        prices_list, dates = Stock.get_stocks_data(tickers= ['IBM'], dates= ['2000-01-01', '2000-01-09'], resolution= 'weekly')
+        # 2000-01-01 was a Saturday
+        self.assertEqual(dates, ['2000-01-02', '2000-01-09'])
+        self.assertEqual(prices_list, [['IBM', None, 1.0]])
+
+        prices_list, dates = Stock.get_stocks_data(tickers= ['IBM'], dates= ['1999-12-30', '2000-01-06'], resolution= 'monthly')
+        self.assertEqual(dates, ['1999-12-31', '2000-01-06'])
+        self.assertEqual(prices_list, [['IBM', None, 70.5]])
+
+    def test_prices_refer_to_one_security_per_ticker(self):
+        self.assertEqual(Security.objects.count(), 2)
+        self.assertEqual(Security.objects.get(ticker= 'IBM').prices.count(), 3)
+
+    def test_latest_and_as_of_quotes_in_fixed_queries(self):
+        with self.assertNumQueries(1):
+            latest = Stock.get_latest_quotes(['IBM', 'CAT', 'NONE'])
+        self.assertEqual(sorted(latest), ['CAT', 'IBM'])
+        self.assertEqual(latest['IBM'][1], 1)
+        self.assertEqual(latest['CAT'][1], Decimal('11.5'))
+
+        # the latest date of each ticker, then the rows at those dates
+        with self.assertNumQueries(2):
+            as_of = Stock.get_quotes_as_of(['IBM', 'CAT', 'NONE'], pytz.utc.localize(datetime.datetime(2000, 1, 4, 12)))
+        self.assertEqual(as_of, {
+            'IBM': (pytz.utc.localize(datetime.datetime(2000, 1, 3)), Decimal('72.6036')),
+            'CAT': (pytz.utc.localize(datetime.datetime(2000, 1, 4)), Decimal('11.4')),
+        })
+
+    def test_latest_quotes_follow_the_stock_table(self):
+        Stock.objects.get(ticker= 'IBM', price= 1).delete()
+        self.assertEqual(Stock.get_latest_quotes(['IBM'])['IBM'][1], Decimal('70.5'))
+
+        ingest_frame(pd.DataFrame({'Date': ['2000-01-10'], 'IBM': [80.25]}))
+        self.assertEqual(LatestQuote.objects.get(ticker= 'IBM').price, Decimal('80.25'))
+
+    def test_quotes_matrix_marks_missing_prices(self):
+        dates = [
+            pytz.utc.localize(datetime.datetime(2000, 1, 3)),
+            pytz.utc.localize(datetime.datetime(2000, 1, 4)),
+            pytz.utc.localize(datetime.datetime(2000, 1, 4, 18)),
+        ]
+        with self.assertNumQueries(1):
+            prices, missing = Stock.get_quotes_matrix(['IBM', 'CAT', 'NONE'], dates)
+        np.testing.assert_array_equal(prices, [
+            [72.6036, np.nan, np.nan],
+            [np.nan, 11.4, np.nan],
+            [np.nan, np.nan, np.nan],
+        ])
+        np.testing.assert_array_equal(missing, np.isnan(prices))
+
+        with self.assertNumQueries(3):
+            prices, missing = Stock.get_quotes_matrix(['IBM', 'CAT', 'NONE'], dates, as_of= True)
+        np.testing.assert_array_equal(prices, [
+            [72.6036, np.nan, np.nan],
+            [72.6036, 11.4, np.nan],
+            [72.6036, 11.5, np.nan],
+        ])
+
+    def test_quotes_for_pairs(self):
+        pairs = [
+            ('CAT', pytz.utc.localize(datetime.datetime(2000, 1, 4, 16))),
+            ('IBM', pytz.utc.localize(datetime.datetime(2000, 1, 5))),
+            ('IBM', pytz.utc.localize(datetime.datetime(2000, 1, 4))),
+        ]
+        with self.assertNumQueries(1):
+            prices, missing = Stock.get_quotes(pairs)
+        np.testing.assert_array_equal(prices, [11.5, 70.5, np.nan])
+        np.testing.assert_array_equal(missing, [False, False, True])
+
+        prices, missing = Stock.get_quotes(pairs, as_of= True)
+        np.testing.assert_array_equal(prices, [11.5, 70.5, 72.6036])
+        self.assertFalse(missing.any())
+
+
+class DownsampleTest(SimpleTestCase):
+
+    def test_lttb_keeps_ends_and_peaks(self):
+        x = np.arange(1000)
+        y = np.sin(x / 50.0)
+        y[500] = 10
+        kept = lttb_indices(x, y, 50)
+        self.assertEqual(len(kept), 50)
+        self.assertEqual(kept[0], 0)
+        self.assertEqual(kept[-1], 999)
+        self.assertIn(500, kept)
+        self.assertTrue(np.all(np.diff(kept) > 0))
+
+    def test_downsampled_series_share_one_axis(self):
+        days = pd.date_range('2000-01-01', periods= 2000)
+        frame = pd.DataFrame({'a': np.arange(2000.0), 'b': np.cos(np.arange(2000) / 30.0)}, index= days)
+        frame.iloc[:100, 1] = np.nan
+        downsampled = downsample_frame(frame, 200)
+        self.assertLessEqual(len(downsampled), 200)
+        self.assertEqual(downsampled.index[0], days[0])
+        self.assertEqual(downsampled.index[-1], days[-1])
+        # the first value of b is kept so charts zeroed on it start at the same point
+        self.assertEqual(downsampled['b'].first_valid_index(), days[100])
+
+
+@override_settings(CACHES= {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedStockDataTest(TransactionTestCase):
+    # a TransactionTestCase so that the on_commit invalidation runs
+
+    def setUp(self):
+        Stock.objects.create(ticker= 'IBM', date= pytz.utc.localize(datetime.datetime(2000, 1, 3)), price= 72.6)
+
+    def test_result_is_cached_until_prices_change(self):
+        arguments = {'tickers': ['IBM'], 'dates': ['2000-01-03', '2000-01-05']}
+        first = Stock.get_cached_stocks_data(**arguments)
+        # only the newest Stock id is read
+        with self.assertNumQueries(1):
+            self.assertEqual(Stock.get_cached_stocks_data(**arguments), first)
+        self.assertNotEqual(Stock.get_cached_stocks_data(resolution= 'weekly', **arguments), first)
+
+        ingest_frame(pd.DataFrame({'Date': ['2000-01-04'], 'IBM': [70.1]}))
+        self.assertEqual(Stock.get_cached_stocks_data(**arguments), [[['IBM', 72.6, 70.1, None]], ['2000-01-03', '2000-01-04', '2000-01-05']])
+
+        Stock.objects.filter(ticker= 'IBM', date__date= '2000-01-04').get().delete()
+        self.assertEqual(Stock.get_cached_stocks_data(**arguments), first)
+
+    def test_prices_inserted_by_another_process_are_read(self):
+        arguments = {'tickers': ['IBM'], 'dates': ['2000-01-03', '2000-01-05']}
+        Stock.get_cached_stocks_data(**arguments)
+        # another process with its own cache does not bump this one's prices version
+        with mock.patch.object(Stock, 'bump_prices_version'):
+            Stock.objects.create(ticker= 'IBM', date= pytz.utc.localize(datetime.datetime(2000, 1, 4)), price= 70.1)
+        self.assertEqual(Stock.get_cached_stocks_data(**arguments), [[['IBM', 72.6, 70.1, None]], ['2000-01-03', '2000-01-04', '2000-01-05']])
@@ -0,0 +1,79 @@
+from unittest import mock
+
+import pandas as pd
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from home.models import User
+from table.models import Security
+from table.stock_test_data.pullstockdata import ingest_frame
+from utils.ticker_index import TickerIndex
+
+class TickerIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.index = TickerIndex([
+            ('IBM', 'International Business Machines'),
+            ('IBKR', 'Interactive Brokers'),
+            ('INTC', 'Intel'),
+            ('I', ''),
+            ('^DJI', 'Dow Jones Industrial Average'),
+        ])
+
+    def test_tickers_before_names(self):
+        self.assertEqual([ticker for ticker, name in self.index.search('ib')], ['IBKR', 'IBM'])
+        self.assertEqual(
+            [ticker for ticker, name in self.index.search('in')], 
+            ['INTC', 'IBKR', 'IBM']
+        )
+        self.assertEqual(self.index.search('dow'), [('^DJI', 'Dow Jones Industrial Average')])
+
+    def test_limit_and_empty_prefix(self):
+        self.assertEqual(len(self.index.search('i', limit= 2)), 2)
+        self.assertEqual(self.index.search('  '), [])
+        self.assertEqual(self.index.search('x'), [])
+
+
+@override_settings(CACHES= {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TickerSearchTest(TransactionTestCase):
+    # a TransactionTestCase so that the on_commit invalidation runs
+
+    def test_index_follows_ingest(self):
+        ingest_frame(pd.DataFrame({'Date': ['2000-01-03'], 'IBM': [72.6], 'CAT': [11.6]}))
+        self.assertEqual(Security.get_available_tickers(), ['CAT', 'IBM'])
+        # only the count and newest id of the securities are read
+        with self.assertNumQueries(1):
+            Security.get_available_tickers()
+
+        ingest_frame(pd.DataFrame({'Date': ['2000-01-04'], 'IBKR': [10.0]}))
+        Security.objects.filter(ticker= 'IBM').update(name= 'International Business Machines')
+        Security.objects.get(ticker= 'IBKR').save()
+        self.assertEqual(Security.get_available_tickers(), ['CAT', 'IBKR', 'IBM'])
+        self.assertEqual(Security.get_ticker_index().search('inter'), [('IBM', 'International Business Machines')])
+
+    def test_index_follows_other_processes(self):
+        ingest_frame(pd.DataFrame({'Date': ['2000-01-03'], 'IBM': [72.6]}))
+        self.assertEqual(Security.get_available_tickers(), ['IBM'])
+
+        # another process with its own cache does not bump this one's securities version
+        with mock.patch.object(Security, 'bump_securities_version'):
+            Security.objects.create(ticker= 'CAT')
+            self.assertEqual(Security.get_available_tickers(), ['CAT', 'IBM'])
+            Security.objects.filter(ticker= 'CAT').update(name= 'Caterpillar')
+            with mock.patch.object(Security, 'TICKER_INDEX_MAX_AGE', 0):
+                self.assertEqual(Security.get_ticker_index().search('cater'), [('CAT', 'Caterpillar')])
+
+    def test_search_endpoint(self):
+        ingest_frame(pd.DataFrame({'Date': ['2000-01-03'], 'IBM': [72.6], 'IBKR': [10.0], 'CAT': [11.6]}))
+        url = reverse('table:client:ticker_search')
+        self.assertEqual(self.client.get(url, {'q': 'ib'}).status_code, 302)
+
+        user = User.objects.create(is_client= True, username= 'client1', email= 'client1@example.com')
+        self.client.force_login(user)
+        response = self.client.get(url, {'q': 'ib', 'limit': 1})
+        self.assertEqual(response.json(), {'results': [{'ticker': 'IBKR', 'name': ''}]})
+        # limits out of range are clamped
+        response = self.client.get(url, {'q': 'ib', 'limit': -5})
+        self.assertEqual(len(response.json()['results']), 1)
+        response = self.client.get(url, {'q': 'ib', 'limit': 1000})
+        self.assertEqual(len(response.json()['results']), 2)
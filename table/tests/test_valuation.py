@@ -0,0 +1,194 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+import pytz
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from table.models import Portfolio, PortfolioSnapshot, Stock, StockInventory, StockTransactRecord, CashTransactionRecord
+from table.valuation import value_portfolios, nav_history, snapshot_portfolios
+from home.models import Company, User, Client
+from settings import context_processors
+
+def day(number):
+    return pytz.utc.localize(datetime.datetime(2000, 1, number))
+
+class ValuationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        context_processors.site_settings(None)
+        context_processors.stock_management_settings(None)
+        context_processors.cash_management_settings(None)
+        company_user = User.objects.create(is_company= True, username= 'TheCompany', email= 'thecompany@thecompany.com', password= '123123123')
+        Company.objects.create(user= company_user)
+
+        cls.user = User.objects.create(is_client= True, password= '12345', username= 'client1', email= 'client1@gmail.com')
+        cls.client_record = Client.objects.create(user= cls.user)
+        cls.first = Portfolio.objects.create(owner= cls.user, cash= 1000, name= 'first')
+        cls.second = Portfolio.objects.create(owner= cls.user, cash= 50, name= 'second')
+
+        # bulk_create skips the decision tables; the orders are recorded as already completed
+        orders = [
+            (cls.first, 'IBM', 'buy', 10, 10, day(3)),
+            (cls.first, 'IBM', 'buy', 20, 10, day(5)),
+            (cls.first, 'CAT', 'buy', 5, 4, day(3)),
+            (cls.second, 'IBM', 'buy', 12, 1, day(4)),
+        ]
+        StockTransactRecord.objects.bulk_create([
+            StockTransactRecord(
+                portfolio= portfolio, ticker= ticker, order_type= order_type, price= price, quantity= quantity,
+                order_status= 'completed', order_class= 'internal'
+            )
+            for portfolio, ticker, order_type, price, quantity, timestamp in orders
+        ])
+        # timestamp is set on creation
+        for order, timestamp in zip(StockTransactRecord.objects.order_by('pk'), [order[-1] for order in orders]):
+            StockTransactRecord.objects.filter(pk= order.pk).update(timestamp= timestamp)
+        StockInventory.objects.create(portfolio= cls.first, ticker= 'IBM', quantity= 20)
+        StockInventory.objects.create(portfolio= cls.first, ticker= 'CAT', quantity= 4)
+        StockInventory.objects.create(portfolio= cls.second, ticker= 'IBM', quantity= 1)
+
+        Stock.objects.create(ticker= 'IBM', date= day(3), price= 10)
+        Stock.objects.create(ticker= 'IBM', date= day(4), price= 11)
+        Stock.objects.create(ticker= 'IBM', date= day(6), price= 25)
+
+    def test_values_many_portfolios_at_latest_prices(self):
+        with self.assertNumQueries(3):
+            valuations = value_portfolios([self.first, self.second])
+
+        self.assertEqual(valuations[self.first.pk], {
+            'cash': 1000.0,
+            'market_value': 500.0,
+            'cost_basis': 300.0,
+            'unrealized_pnl': 200.0,
+            'total_value': 1500.0,
+            # CAT has no prices
+            'missing_prices': ['CAT'],
+        })
+        self.assertEqual(valuations[self.second.pk]['total_value'], 75.0)
+        self.assertEqual(self.first.get_value_at_datetime(), 1500)
+
+    def test_values_positions_as_of_a_date(self):
+        valuation = self.first.get_valuation(pytz.utc.localize(datetime.datetime(2000, 1, 4, 12)))
+        # the second IBM buy came later, so its cost is back in the cash
+        self.assertEqual(valuation['cash'], 1200.0)
+        self.assertEqual(valuation['market_value'], 110.0)
+        self.assertEqual(valuation['unrealized_pnl'], 10.0)
+        self.assertEqual(valuation['missing_prices'], ['CAT'])
+
+    def deposit(self, portfolio, amount, when):
+        """Runs a deposit through the cash decision table as if it was made at when."""
+        deposit = CashTransactionRecord(
+            portfolio= portfolio, status= 'processing', currency_type= 'USD', amount= amount, amount_in_USD= amount,
+            transaction_type= 'external_deposit', transaction_to= 'self', transaction_from= 'somewhere',
+            transaction_conditions= '0'
+        )
+        with mock.patch('django.utils.timezone.now', return_value= when):
+            deposit.save()
+        self.assertEqual(deposit.status, 'completed')
+
+    def test_values_cash_before_a_later_deposit(self):
+        # a copy, as the class's portfolios are shared by the tests
+        portfolio = Portfolio.objects.get(pk= self.first.pk)
+        self.deposit(portfolio, 10000, day(5))
+        self.assertEqual(CashTransactionRecord.objects.get().transaction_datetime, day(5))
+
+        portfolio.refresh_from_db()
+        valuation = portfolio.get_valuation(pytz.utc.localize(datetime.datetime(2000, 1, 4, 12)))
+        self.assertEqual(valuation['cash'], 1200.0)
+        self.assertEqual(portfolio.get_valuation(day(6))['cash'], 11000.0)
+
+    def test_client_portfolio_values(self):
+        with self.assertNumQueries(4):
+            portfolios = self.client_record.get_portfolios_values()
+            self.assertEqual([portfolio.current_value for portfolio in portfolios], [1500, 75])
+            self.assertEqual([portfolio.book_value for portfolio in portfolios], [1320, 62])
+            self.assertEqual([portfolio.ytd_perc_change for portfolio in portfolios], [None, None])
+
+    @override_settings(CACHES= {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_overview_queries_do_not_grow_with_portfolios(self):
+        self.client.force_login(self.user)
+        url = reverse('table:client:client_home_view')
+        # the first requests also create and cache the settings and market data the page reads
+        self.client.get(url)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, '$1500.00')
+
+        for number in range(5):
+            portfolio = Portfolio.objects.create(owner= self.user, cash= 10, name= 'more ' + str(number))
+            StockInventory.objects.create(portfolio= portfolio, ticker= 'IBM', quantity= 1)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertContains(response, '$35.00', count= 5)
+
+    def test_nav_history_in_one_pass(self):
+        days = [datetime.date(2000, 1, number) for number in range(3, 8)]
+        with self.assertNumQueries(5):
+            cash, market_values = nav_history([self.first, self.second], days)
+        self.assertEqual(cash.tolist(), [[1200, 62], [1200, 50], [1000, 50], [1000, 50], [1000, 50]])
+        self.assertEqual(market_values.tolist(), [[100, 0], [110, 11], [220, 11], [500, 25], [500, 25]])
+
+    def test_snapshots_catch_up_and_give_returns(self):
+        Portfolio.objects.update(open_date= day(3))
+        self.assertEqual(snapshot_portfolios(end_date= datetime.date(2000, 1, 7)), 10)
+        self.assertEqual(
+            list(self.first.snapshots.order_by('date').values_list('total_value', flat= True)), 
+            [1300, 1310, 1220, 1500, 1500]
+        )
+
+        # the weekend is skipped
+        out = StringIO()
+        call_command('snapshot_portfolios', end= '2000-01-10', stdout= out)
+        self.assertTrue(out.getvalue().startswith('wrote 2 snapshots'))
+        self.assertEqual(snapshot_portfolios(end_date= datetime.date(2000, 1, 10)), 0)
+
+        self.assertEqual(self.first.inception_perc_change, 15.38)
+        # no snapshot was taken this year
+        self.assertIsNone(self.first.ytd_perc_change)
+        with self.assertNumQueries(1):
+            portfolios = list(Portfolio.with_returns(Portfolio.objects.order_by('pk')))
+            self.assertEqual(
+                [(portfolio.inception_perc_change, portfolio.ytd_perc_change) for portfolio in portfolios], 
+                [(15.38, None), (20.97, None)]
+            )
+
+        PortfolioSnapshot.objects.all().delete()
+        self.assertIsNone(Portfolio.objects.get(pk= self.first.pk).ytd_perc_change)
+
+    def test_snapshots_place_a_deposit_on_its_day(self):
+        Portfolio.objects.update(open_date= day(3))
+        self.deposit(Portfolio.objects.get(pk= self.first.pk), 10000, pytz.utc.localize(datetime.datetime(2000, 1, 5, 12)))
+        snapshot_portfolios(end_date= datetime.date(2000, 1, 7))
+        self.assertEqual(
+            list(self.first.snapshots.order_by('date').values_list('cash', 'total_value')), 
+            [(1200, 1300), (1200, 1310), (11000, 11220), (11000, 11500), (11000, 11500)]
+        )
+
+    def test_ytd_return_from_the_end_of_last_year(self):
+        start = Portfolio.return_start_dates()['ytd']
+        PortfolioSnapshot.objects.create(portfolio= self.first, date= start, total_value= 1000)
+        self.assertIsNone(Portfolio.objects.get(pk= self.first.pk).ytd_perc_change)
+
+        PortfolioSnapshot.objects.create(portfolio= self.first, date= start + datetime.timedelta(days= 1), total_value= 1100)
+        self.assertEqual(Portfolio.objects.get(pk= self.first.pk).ytd_perc_change, 10.0)
+        [portfolio] = Portfolio.with_returns(Portfolio.objects.filter(pk= self.first.pk))
+        self.assertEqual(portfolio.ytd_perc_change, 10.0)
+
+    def test_failed_rebuild_keeps_the_snapshots(self):
+        Portfolio.objects.update(open_date= day(3))
+        snapshot_portfolios(end_date= datetime.date(2000, 1, 7))
+
+        with mock.patch('table.valuation.nav_history', side_effect= RuntimeError('prices unavailable')):
+            with self.assertRaises(RuntimeError):
+                call_command('snapshot_portfolios', end= '2000-01-07', rebuild= True, stdout= StringIO())
+        self.assertEqual(PortfolioSnapshot.objects.count(), 10)
+
+        call_command('snapshot_portfolios', end= '2000-01-07', rebuild= True, stdout= StringIO())
+        self.assertEqual(PortfolioSnapshot.objects.count(), 10)
@@ -8,7 +8,9 @@ urlpatterns = [
     
     path('client/', include(([
         path('overview/', client.ClientOverview.as_view(), name= 'client_home_view'),
-        path('portfolios/<portfolio_name>', client.ClientPortfolioView.as_view(), name='client_portfolio_view')
+        path('portfolios/<portfolio_name>', client.ClientPortfolioView.as_view(), name='client_portfolio_view'),
+        path('portfolios/<portfolio_name>/transactions/', client.ClientTransactionPageView.as_view(), name= 'client_transaction_page'),
+        path('tickers/search/', client.TickerSearchView.as_view(), name= 'ticker_search'),
     ], 'table'), namespace= 'client')),
 
     path('broker/', include(([
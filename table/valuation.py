@@ -0,0 +1,311 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytz
+from django.db import transaction
+from django.db.models import Case, When, F, Max, Sum, FloatField, IntegerField
+from django.utils import timezone
+
+from .models import (
+    Portfolio, PortfolioSnapshot, Stock, StockInventory, StockTransactRecord, CashTransactionRecord, site_settings
+)
+
+
+COMPLETED = StockTransactRecord.STATUS.completed.name
+
+# the cash transaction types that add to and take from a portfolio's cash; stock orders change
+# cash directly and are accounted for from StockTransactRecord
+CASH_IN_TYPES = [CashTransactionRecord.TRANSACTION_TYPE.get_value('external_deposit')]
+CASH_OUT_TYPES = [CashTransactionRecord.TRANSACTION_TYPE.get_value('external_withdrawal')]
+
+
+def signed(field, positive, negative, output_field):
+    """Sum() argument adding field for orders of type positive and subtracting it for negative."""
+    return Sum(Case(
+        When(order_type= positive, then= field),
+        When(order_type= negative, then= -field),
+        default= 0,
+        output_field= output_field,
+    ))
+
+def value_portfolios(portfolios, date= None):
+    """
+    Values portfolios at market prices: each position is priced at the most recent price at
+    or before date (see Stock.get_quotes_as_of) and all positions of all portfolios are valued
+    in one numpy pass. Takes a constant number of queries however many portfolios and
+    positions there are.
+
+    Current positions are read from StockInventory. Positions at a past date are rebuilt from
+    the completed orders placed up to then, and the cash from the current cash less the
+    completed orders placed and cash transactions made after it. The cost basis of a position
+    is its quantity at the average price of the shares bought.
+
+    :param portfolios: the portfolios to value
+    :type portfolios: iterable of table.models.Portfolio
+
+    :param date: the time at which to value them, defaults to now using the latest prices
+    :type date: datetime.datetime, with tzinfo= datetime.timezone.utc
+
+    :return: for each portfolio's pk its cash, market_value, cost_basis, unrealized_pnl and
+        total_value in USD, and the missing_prices, the tickers held without a price by date,
+        which are left out of the market value
+    :rtype: dict of int: dict
+    """
+    portfolios = list(portfolios)
+    ids = [portfolio.pk for portfolio in portfolios]
+    rows = {portfolio_id: row for row, portfolio_id in enumerate(ids)}
+    cash = np.array([float(portfolio.cash) for portfolio in portfolios])
+
+    orders = StockTransactRecord.objects.filter(portfolio_id__in= ids, order_status= COMPLETED)
+    orders_to_date = orders if date is None else orders.filter(timestamp__lte= date)
+    positions = list(
+        orders_to_date.order_by().values_list('portfolio_id', 'ticker').annotate(
+            held= signed(F('quantity'), 'buy', 'sell', IntegerField()),
+            bought= Sum(Case(When(order_type= 'buy', then= F('quantity')), default= 0, output_field= IntegerField())),
+            bought_value= Sum(Case(
+                When(order_type= 'buy', then= F('price') * F('quantity')), default= 0, output_field= FloatField()
+            )),
+        )
+    )
+    if date is None:
+        # the inventory holds the current positions, including ones not bought through orders
+        average_costs = {
+            (portfolio_id, ticker): bought_value / bought if bought else 0.0
+            for portfolio_id, ticker, quantity, bought, bought_value in positions
+        }
+        positions = [
+            (portfolio_id, ticker, quantity, average_costs.get((portfolio_id, ticker), 0.0))
+            for portfolio_id, ticker, quantity in StockInventory.objects
+                .filter(portfolio_id__in= ids, quantity__gt= 0)
+                .values_list('portfolio_id', 'ticker', 'quantity')
+        ]
+    else:
+        positions = [
+            (portfolio_id, ticker, quantity, bought_value / bought if bought else 0.0)
+            for portfolio_id, ticker, quantity, bought, bought_value in positions
+            if quantity
+        ]
+        cash += later_cash_flows(ids, rows, orders, date)
+
+    tickers = sorted({ticker for portfolio_id, ticker, quantity, cost in positions})
+    quotes = Stock.get_latest_quotes(tickers) if date is None else Stock.get_quotes_as_of(tickers, date)
+
+    if positions:
+        position_rows = np.array([rows[portfolio_id] for portfolio_id, ticker, quantity, cost in positions])
+        quantities = np.array([quantity for portfolio_id, ticker, quantity, cost in positions], dtype= float)
+        costs = np.array([cost for portfolio_id, ticker, quantity, cost in positions], dtype= float)
+        prices = np.array([
+            float(quotes[ticker][1]) if ticker in quotes else np.nan
+            for portfolio_id, ticker, quantity, cost in positions
+        ])
+        priced = ~np.isnan(prices)
+        market_values = np.bincount(
+            position_rows[priced], weights= quantities[priced] * prices[priced], minlength= len(ids)
+        )
+        cost_bases = np.bincount(
+            position_rows[priced], weights= quantities[priced] * costs[priced], minlength= len(ids)
+        )
+    else:
+        priced = np.zeros(0, dtype= bool)
+        market_values = np.zeros(len(ids))
+        cost_bases = np.zeros(len(ids))
+
+    missing = {portfolio_id: [] for portfolio_id in ids}
+    for position, is_priced in zip(positions, priced):
+        if not is_priced:
+            missing[position[0]].append(position[1])
+
+    places = site_settings.monetary_decimal_places
+    return {
+        portfolio_id: {
+            'cash': round(float(cash[row]), places),
+            'market_value': round(float(market_values[row]), places),
+            'cost_basis': round(float(cost_bases[row]), places),
+            'unrealized_pnl': round(float(market_values[row] - cost_bases[row]), places),
+            'total_value': round(float(cash[row] + market_values[row]), places),
+            'missing_prices': missing[portfolio_id],
+        }
+        for portfolio_id, row in rows.items()
+    }
+
+def later_cash_flows(ids, rows, orders, date):
+    """
+    The change in cash that undoes the completed orders placed and the cash transactions
+    made after date, per portfolio in the order of rows.
+
+    :rtype: numpy.ndarray
+    """
+    flows = np.zeros(len(ids))
+    # buys took cash and sells brought it
+    later_orders = orders.filter(timestamp__gt= date).order_by().values_list('portfolio_id').annotate(
+        value= signed(F('price') * F('quantity'), 'buy', 'sell', FloatField())
+    )
+    for portfolio_id, value in later_orders:
+        flows[rows[portfolio_id]] += value or 0
+
+    later_transactions = CashTransactionRecord.objects \
+        .filter(portfolio_id__in= ids, status= COMPLETED, transaction_datetime__gt= date) \
+        .order_by().values_list('portfolio_id') \
+        .annotate(amount= Sum(Case(
+            When(transaction_type__in= CASH_IN_TYPES, then= -F('amount_in_USD')),
+            When(transaction_type__in= CASH_OUT_TYPES, then= F('amount_in_USD')),
+            default= 0,
+            output_field= FloatField(),
+        )))
+    for portfolio_id, amount in later_transactions:
+        flows[rows[portfolio_id]] += amount or 0
+    return flows
+
+#---daily snapshots---#
+
+def to_datetime64(dates):
+    """Converts aware datetimes to UTC numpy.datetime64 values."""
+    return pd.DatetimeIndex(pd.to_datetime(list(dates), utc= True)).tz_convert(None).to_numpy()
+
+def nav_history(portfolios, days):
+    """
+    Computes the cash and market value of each of portfolios at the end of each of days in
+    one pass: the completed orders and cash transactions are read once, their quantities and
+    cash flows are placed on the day they fall on and summed cumulatively over the days, and
+    the resulting positions matrix is multiplied with the matrix of the prices in effect at the
+    end of each day (see Stock.get_quotes_matrix). Takes five queries or fewer.
+
+    Positions are rebuilt from the completed orders; shares held without an order (such as the
+    company master portfolio's) are not valued. The cash of a day is the current cash less the
+    flows that came after it.
+
+    :param portfolios: the portfolios
+    :type portfolios: list of Portfolio
+
+    :param days: the days, increasing
+    :type days: list of datetime.date
+
+    :return: the cash and the market value, each a len(days) x len(portfolios) array
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    ids = [portfolio.pk for portfolio in portfolios]
+    columns = {portfolio_id: column for column, portfolio_id in enumerate(ids)}
+    # things at or after the end of the last day land on the extra row len(days)
+    ends = [
+        pytz.utc.localize(datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(days= 1))
+        for day in days
+    ]
+    ends64 = to_datetime64(ends)
+
+    orders = list(
+        StockTransactRecord.objects
+            .filter(portfolio_id__in= ids, order_status= COMPLETED)
+            .values_list('portfolio_id', 'ticker', 'order_type', 'price', 'quantity', 'timestamp')
+    )
+    cash_transactions = list(
+        CashTransactionRecord.objects
+            .filter(portfolio_id__in= ids, status= COMPLETED, transaction_type__in= CASH_IN_TYPES + CASH_OUT_TYPES)
+            .values_list('portfolio_id', 'transaction_type', 'amount_in_USD', 'transaction_datetime')
+    )
+
+    flows = np.zeros((len(days) + 1, len(ids)))
+    quantities = np.zeros((len(days) + 1, 0))
+    pairs = []
+    if orders:
+        order_days = np.searchsorted(ends64, to_datetime64(order[5] for order in orders), 'right')
+        order_columns = np.array([columns[order[0]] for order in orders])
+        signs = np.array([1.0 if order[2] == 'buy' else -1.0 if order[2] == 'sell' else 0.0 for order in orders])
+        order_quantities = np.array([order[4] for order in orders], dtype= float)
+        order_values = np.array([float(order[3]) for order in orders]) * order_quantities
+        # buys take cash and sells bring it
+        np.add.at(flows, (order_days, order_columns), -signs * order_values)
+
+        pairs = list(dict.fromkeys((order[0], order[1]) for order in orders))
+        pair_indices = {pair: index for index, pair in enumerate(pairs)}
+        quantities = np.zeros((len(days) + 1, len(pairs)))
+        np.add.at(
+            quantities, 
+            (order_days, [pair_indices[(order[0], order[1])] for order in orders]), 
+            signs * order_quantities
+        )
+    if cash_transactions:
+        transaction_days = np.searchsorted(ends64, to_datetime64(row[3] for row in cash_transactions), 'right')
+        amounts = np.array([
+            float(amount) if transaction_type in CASH_IN_TYPES else -float(amount)
+            for portfolio_id, transaction_type, amount, date in cash_transactions
+        ])
+        np.add.at(flows, (transaction_days, [columns[row[0]] for row in cash_transactions]), amounts)
+
+    flows = np.cumsum(flows, axis= 0)
+    current_cash = np.array([float(portfolio.cash) for portfolio in portfolios])
+    cash = current_cash - (flows[-1] - flows[:-1])
+
+    market_values = np.zeros((len(days), len(ids)))
+    if pairs:
+        quantities = np.cumsum(quantities, axis= 0)[:-1]
+        tickers = list(dict.fromkeys(ticker for portfolio_id, ticker in pairs))
+        # the prices in effect just before the end of each day
+        prices, missing = Stock.get_quotes_matrix(
+            tickers, [end - datetime.timedelta(seconds= 1) for end in ends], as_of= True
+        )
+        ticker_columns = {ticker: column for column, ticker in enumerate(tickers)}
+        pair_prices = np.nan_to_num(prices[:, [ticker_columns[ticker] for portfolio_id, ticker in pairs]])
+        owners = np.zeros((len(pairs), len(ids)))
+        owners[np.arange(len(pairs)), [columns[portfolio_id] for portfolio_id, ticker in pairs]] = 1
+        market_values = (quantities * pair_prices) @ owners
+
+    return cash, market_values
+
+def snapshot_portfolios(portfolios= None, end_date= None, batch_size= 500):
+    """
+    Writes the missing PortfolioSnapshot rows up to end_date: each portfolio gets one for every
+    business day after its latest snapshot, or from the day it was opened, so a run after
+    missed nights catches up. Portfolios are valued batch_size at a time with nav_history.
+
+    :param portfolios: the portfolios to snapshot, defaults to all
+    :type portfolios: django.db.models.QuerySet of Portfolio
+
+    :param end_date: the last day to snapshot, defaults to yesterday in UTC
+    :type end_date: datetime.date
+
+    :param batch_size: the number of portfolios valued at once
+    :type batch_size: int
+
+    :return: the number of snapshots written
+    :rtype: int
+    """
+    if portfolios is None:
+        portfolios = Portfolio.objects.all()
+    if end_date is None:
+        end_date = timezone.now().date() - datetime.timedelta(days= 1)
+    portfolios = list(portfolios.annotate(last_snapshot= Max('snapshots__date')).order_by('pk'))
+
+    written = 0
+    places = site_settings.monetary_decimal_places
+    for start_index in range(0, len(portfolios), batch_size):
+        batch = portfolios[start_index:start_index + batch_size]
+        starts = [
+            portfolio.last_snapshot + datetime.timedelta(days= 1) if portfolio.last_snapshot 
+            else portfolio.open_date.astimezone(pytz.utc).date()
+            for portfolio in batch
+        ]
+        first_day = min(starts)
+        if first_day > end_date:
+            continue
+        days = [day.date() for day in pd.bdate_range(first_day, end_date)]
+        if not days:
+            continue
+
+        cash, market_values = nav_history(batch, days)
+        snapshots = [
+            PortfolioSnapshot(
+                portfolio= portfolio,
+                date= day,
+                cash= round(float(cash[row, column]), places),
+                market_value= round(float(market_values[row, column]), places),
+                total_value= round(float(cash[row, column] + market_values[row, column]), places),
+            )
+            for column, (portfolio, start) in enumerate(zip(batch, starts))
+            for row, day in enumerate(days)
+            if day >= start
+        ]
+        with transaction.atomic():
+            PortfolioSnapshot.objects.bulk_create(snapshots, batch_size= 1000)
+        written += len(snapshots)
+    return written
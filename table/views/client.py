@@ -3,9 +3,11 @@ import pytz
 from decimal import Decimal
 import numpy as np
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
+from django.core import signing
 from django.db import transaction
 from django.db.models import Count, Avg, Value, CharField, ExpressionWrapper, F, Sum, FloatField, DecimalField, Q
 from django.shortcuts import get_object_or_404, redirect, render
@@ -17,7 +19,7 @@ from django.http import JsonResponse, Http404
 from home.decorators import client_required
 from ..forms import PortfolioCreationForm
 from home.models import User, Client
-from ..models import Portfolio, StockTransactRecord, Stock
+from ..models import Portfolio, StockTransactRecord, Stock, Security
 
 @method_decorator([login_required, client_required], name= 'dispatch')
 class ClientOverview(TemplateView):
@@ -29,7 +31,8 @@ class ClientOverview(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(ClientOverview, self).get_context_data(**kwargs)
-        context['market_data'] = Stock.get_stocks_data(dates=['2000-01-01', '2020-01-01'], tickers=['^DJI', '^GSPC', '^IXIC', 'IBM'])
+        context['market_data'] = Stock.get_cached_stocks_data(**settings.MARKET_OVERVIEW_DATA)
+        context['portfolio_values'] = self.get_portfolio_queryset()
         return context
 
 
@@ -39,24 +42,50 @@ class ClientPortfolioView(TemplateView):
     template_name = 'table/clients/client_portfolio_view.html'
 
     def get_portfolio(self, test_name):
-        names = list(self.request.user.portfolios.all().values_list('name'))
-        names_list = [item[0] for item in names]
-        portfolio = None
-        if test_name in names_list:
-            portfolio = self.request.user.portfolios.get(name= test_name)
-        else:
-            raise Http404
+        return get_object_or_404(self.request.user.portfolios.all(), name= test_name)
 
-        return portfolio
-
-    def get_available_tickers_with_prices(self):
-        return list(Stock.objects.all().values_list('ticker', flat= True).distinct())
+    def get_available_tickers(self):
+        return Security.get_available_tickers()
 
     def get_context_data(self, **kwargs):
         context = super(ClientPortfolioView, self).get_context_data(**kwargs)
         context['portfolio'] = self.get_portfolio(context['portfolio_name'])
+        # the first page of the history; the page fetches the rest from ClientTransactionPageView
+        context['transaction_rows'], context['next_cursor'] = context['portfolio'].get_transaction_page(
+            page_size= ClientTransactionPageView.page_size
+        )
         context['available_tickers'] = self.get_available_tickers()
         context['show_new_transaction'] = False
         
         return context
 
+
+@method_decorator([login_required, client_required], name= 'dispatch')
+class ClientTransactionPageView(View):
+    '''A page of a portfolio's transaction history as JSON, after the page whose ?cursor= is given.'''
+    page_size = 50
+
+    def get(self, request, portfolio_name, *args, **kwargs):
+        portfolio = get_object_or_404(request.user.portfolios.all(), name= portfolio_name)
+        try:
+            rows, next_cursor = portfolio.get_transaction_page(
+                cursor= request.GET.get('cursor'), page_size= self.page_size
+            )
+        except (signing.BadSignature, KeyError, ValueError):
+            return JsonResponse({'error': 'invalid cursor'}, status= 400)
+        return JsonResponse({'rows': rows, 'next': next_cursor})
+
+
+
+@method_decorator([login_required, client_required], name= 'dispatch')
+class TickerSearchView(View):
+    '''Autocomplete for the order form: the securities whose ticker or name starts with ?q=, as JSON.'''
+    max_limit = 50
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 10)), self.max_limit))
+        except ValueError:
+            limit = 10
+        matches = Security.get_ticker_index().search(request.GET.get('q', ''), limit= limit)
+        return JsonResponse({'results': [{'ticker': ticker, 'name': name} for ticker, name in matches]})
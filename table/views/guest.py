@@ -3,6 +3,7 @@ import pytz
 from decimal import Decimal
 import numpy as np
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
@@ -26,6 +27,6 @@ class GuestOverview(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(GuestOverview, self).get_context_data(**kwargs)
-        context['market_data'] = Stock.get_stocks_data(dates=['2000-01-01', '2020-01-01'], tickers=['^DJI', '^GSPC', '^IXIC', 'IBM'])
+        context['market_data'] = Stock.get_cached_stocks_data(**settings.MARKET_OVERVIEW_DATA)
         context['marketing_message'] = "Make an Account Today!"
         return context
\ No newline at end of file
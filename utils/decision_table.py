@@ -1,5 +1,90 @@
 from tabulate import tabulate
 import numpy as np
+import threading
+import time
+
+class decision_node:
+    """
+    A node of the decision tree generated by decision_table.compile(). An inner node tests
+    the condition with code number 'key' and continues with 'true' or 'false'; a leaf
+    (key is None) holds the actions and the keys of every case that matched along the path.
+    """
+    __slots__ = ('key', 'true', 'false', 'actions', 'cases')
+
+    def __init__(self, key= None, true= None, false= None, actions= (), cases= ()):
+        self.key = key
+        self.true = true
+        self.false = false
+        self.actions = actions
+        self.cases = cases
+
+class decision_context(dict):
+    """
+    The data declared by a decision table's conditions (see decision_table.add_loader) for 
+    one record. A value is loaded the first time a condition asks for it and is then shared 
+    by every condition evaluated for the same record.
+    """
+    __slots__ = ('loaders', 'args')
+
+    def __init__(self, loaders, args):
+        super(decision_context, self).__init__()
+        self.loaders = loaders
+        self.args = args
+
+    def __missing__(self, name):
+        value = self[name] = self.loaders[name](*self.args)
+        return value
+
+class decision_profile:
+    """
+    Counters collected by a decision_table while profiling is enabled, see 
+    decision_table.enable_profiling(). Evaluations record their counts locally and add them 
+    here once, under a lock, so concurrent requests can share a profile.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.records = 0
+            self.evaluations = 0
+            self.unmatched = 0
+            self.condition_calls = {}
+            self.condition_time = {}
+            self.case_matches = {}
+
+    def add_records(self, count):
+        with self.lock:
+            self.records += count
+
+    def add_condition(self, key, calls, seconds):
+        with self.lock:
+            self.condition_calls[key] = self.condition_calls.get(key, 0) + calls
+            self.condition_time[key] = self.condition_time.get(key, 0.0) + seconds
+
+    def add_evaluations(self, timings, cases, count= 1):
+        """
+        :param timings: (condition code number, seconds) for each condition called
+        :type timings: list of tuples
+
+        :param cases: the keys of the cases matched by each of the evaluations
+        :type cases: tuple
+
+        :param count: the number of evaluations that reached the same leaf
+        :type count: int
+        """
+        with self.lock:
+            self.evaluations += count
+            if not cases:
+                self.unmatched += count
+            for case in cases:
+                self.case_matches[case] = self.case_matches.get(case, 0) + count
+            for key, seconds in timings:
+                self.condition_calls[key] = self.condition_calls.get(key, 0) + 1
+                self.condition_time[key] = self.condition_time.get(key, 0.0) + seconds
 
 class decision_table:
     """
@@ -58,6 +143,16 @@ class decision_table:
         }
     }
     ```
+
+    Before the first evaluation the cases are compiled into bitmasks over the condition
+    codes and a decision tree (see compile()), so each condition runs at most once per
+    evaluation and only the conditions needed to tell the remaining cases apart run at all.
+    Conditions may be given a cost and a selectivity hint so that cheap, discriminating
+    conditions are checked first.
+
+    Conditions that need related data (e.g. a portfolio or an inventory row) declare it by 
+    name with 'requires'; the data is produced by the table's loaders, cached in a 
+    decision_context per record and passed to those conditions as a last argument.
     """
     names_list = [] # decision tables should have unique names
     
@@ -65,20 +160,98 @@ class decision_table:
         if name in self.names_list:
             raise ValueError('name of decision table already exists')
         
+        self.name = name
         self.conditions = {} 
+        self.condition_costs = {}
+        self.condition_selectivities = {}
+        self.batch_conditions = {}
+        self.condition_requires = {}
+        self.loaders = {}
+        self.batch_loaders = {}
         self.actions = {}
         self.cases = {}
+
+        # filled in by compile()
+        self.compiled = False
+        self.condition_codes = {}
+        self.relevant_conditions = []
+        self.case_masks = []
+        self.case_keys = []
+        self.tree = None
+
+        # a decision_profile while profiling is enabled, see enable_profiling()
+        self.profile = None
         
     def to_one_neg_one(self, boolean):
         """converts boolean value to 1, -1 for True, False"""
         return (2 * boolean) - 1
+
+    def add_loader(self, name, loader_function, batch_loader_function= None):
+        """
+        Adds a loader for data that conditions can declare with 'requires'.
+
+        :param name: the name conditions use to refer to the data
+        :type name: str
+
+        :param loader_function: takes the same arguments as the condition functions and 
+            returns the data
+        :type loader_function: callable
+
+        :param batch_loader_function: optional function returning the data for a list of 
+            records at once, in record order (see evaluate_batch())
+        :type batch_loader_function: callable
+        """
+
+        if name in self.loaders:
+            raise ValueError('a loader named ' + name + ' already exists in this decision table')
+
+        if not callable(loader_function):
+            raise TypeError('loader_function is not callable.')
+
+        if batch_loader_function is not None and not callable(batch_loader_function):
+            raise TypeError('batch_loader_function is not callable.')
+
+        self.loaders[name] = loader_function
+        if batch_loader_function is not None:
+            self.batch_loaders[name] = batch_loader_function
+
+    def new_context(self, *args):
+        """
+        Returns an empty decision_context for a record. Pass it to every evaluate() call for 
+        the same record to load the record's data only once.
+
+        :param args: the arguments passed to each condition function
+        :type args: tuple
+
+        :rtype: decision_context
+        """
+        if self.profile is not None:
+            self.profile.add_records(1)
+        return decision_context(self.loaders, args)
     
-    def add_condition(self, condition_function):
+    def add_condition(self, condition_function, cost= 1, selectivity= 0.5, batch_function= None, requires= ()):
         """
         Adds a condition to the decision table.
         
         :param condition_function: a condition function; must return a bool
         :type condition_function: callable
+
+        :param cost: relative cost of calling condition_function, e.g. 1 for a field compare 
+            and 10 for a database query, defaults to 1
+        :type cost: float
+
+        :param selectivity: estimated probability that condition_function returns True, 
+            defaults to 0.5
+        :type selectivity: float
+
+        :param batch_function: optional function computing the condition for a list of records 
+            at once (see evaluate_batch()); must return a sequence of bools of the same length
+        :type batch_function: callable
+
+        :param requires: names of the loaders whose data the condition needs; if given, the 
+            condition is called with the record's decision_context as a last argument, and 
+            batch_function with the list of the records' contexts
+        :type requires: tuple of str
         """
         
         if not callable(condition_function):
@@ -86,12 +259,33 @@ class decision_table:
             
         if condition_function in [x for x in list(self.conditions.values())]:
             raise ValueError('condition_function already in this decision table\'s conditions')
+
+        if batch_function is not None and not callable(batch_function):
+            raise TypeError('batch_function is not callable.')
+
+        for name in requires:
+            if name not in self.loaders:
+                raise KeyError('no loader named ' + name + ' in this decision table')
+
+        if cost <= 0:
+            raise ValueError('cost must be positive')
+
+        if not 0 <= selectivity <= 1:
+            raise ValueError('selectivity must be between 0 and 1')
             
         new_key = len(self.conditions)
         self.conditions[new_key] = condition_function
+        self.condition_costs[new_key] = cost
+        self.condition_selectivities[new_key] = selectivity
+        if batch_function is not None:
+            self.batch_conditions[new_key] = batch_function
+        if requires:
+            self.condition_requires[new_key] = tuple(requires)
         
-        for case in self.cases:
+        for case in self.cases.values():
             case['result'][new_key] = 0
+
+        self.compiled = False
     
     def add_action(self, action_function):
         """
@@ -109,6 +303,7 @@ class decision_table:
             
         new_key = len(self.actions)
         self.actions[new_key] = action_function
+        self.compiled = False
             
     def add_case(self, result, actions, name= "new_case"):
         """
@@ -178,6 +373,306 @@ class decision_table:
             'result': result,
             'actions': actions
         }
+        self.compiled = False
+
+    def compile(self):
+        """
+        Compiles the cases into bitmasks over the condition codes. Bit k of a mask stands for
+        the condition with code number k. For each case 'care' has a bit set for every
+        condition that is not a 'don't care' and 'want' has a bit set for every condition
+        that must be True, so a case matches a condition vector v when v & care == want.
+        Only conditions that at least one case cares about are ever evaluated.
+
+        The masks are then turned into a decision tree (see build_tree()) which evaluate() and
+        get_actions() walk, so only the conditions that actually decide the case are called.
+        """
+        self.condition_codes = {v: k for k, v in self.conditions.items()}
+
+        self.case_masks = []
+        self.case_keys = list(self.cases.keys())
+        relevant = 0
+        for case_key, case_info in self.cases.items():
+            care = 0
+            want = 0
+            for key, value in case_info['result'].items():
+                if value != 0:
+                    care |= 1 << key
+                if value == 1:
+                    want |= 1 << key
+            actions = tuple(self.actions[action_code] for action_code in case_info['actions'])
+            self.case_masks.append((care, want, actions))
+            relevant |= care
+
+        self.relevant_conditions = [key for key in self.conditions.keys() if relevant & (1 << key)]
+        self.tree = self.build_tree(tuple(range(len(self.case_masks))), 0, {})
+        self.compiled = True
+
+    def build_tree(self, candidates, tested, memo):
+        """
+        Recursively builds the decision tree for the cases that are still possible.
+
+        At each node the untested condition with the best ratio of expected cases ruled out
+        to cost is chosen. A case that requires the condition to be True is ruled out with
+        probability 1 - selectivity, one that requires it to be False with probability
+        selectivity. Once none of the remaining cases care about an untested condition
+        the node becomes a leaf holding the actions of all remaining cases.
+
+        :param candidates: indices into self.case_masks of the cases not yet ruled out
+        :type candidates: tuple
+
+        :param tested: bitmask of the conditions already tested on this path
+        :type tested: int
+
+        :param memo: nodes already built, keyed by (candidates, tested)
+        :type memo: dict
+
+        :rtype: decision_node
+        """
+        memo_key = (candidates, tested)
+        if memo_key in memo:
+            return memo[memo_key]
+
+        untested = 0
+        for index in candidates:
+            untested |= self.case_masks[index][0]
+        untested &= ~tested
+
+        if not untested:
+            actions = ()
+            for index in candidates:
+                actions += self.case_masks[index][2]
+            cases = tuple(self.case_keys[index] for index in candidates)
+            node = decision_node(actions= actions, cases= cases)
+            memo[memo_key] = node
+            return node
+
+        best_key = None
+        best_score = None
+        for key in self.relevant_conditions:
+            bit = 1 << key
+            if not untested & bit:
+                continue
+            want_true = 0
+            want_false = 0
+            for index in candidates:
+                care, want, _ = self.case_masks[index]
+                if care & bit:
+                    if want & bit:
+                        want_true += 1
+                    else:
+                        want_false += 1
+            selectivity = self.condition_selectivities[key]
+            cost = self.condition_costs[key]
+            ruled_out = selectivity * want_false + (1 - selectivity) * want_true
+            score = (ruled_out / cost, -cost)
+            if best_score is None or score > best_score:
+                best_key = key
+                best_score = score
+
+        bit = 1 << best_key
+        true_candidates = tuple(
+            index for index in candidates 
+            if not self.case_masks[index][0] & bit or self.case_masks[index][1] & bit
+        )
+        false_candidates = tuple(
+            index for index in candidates 
+            if not self.case_masks[index][0] & bit or not self.case_masks[index][1] & bit
+        )
+        node = decision_node(
+            key= best_key,
+            true= self.build_tree(true_candidates, tested | bit, memo),
+            false= self.build_tree(false_candidates, tested | bit, memo)
+        )
+        memo[memo_key] = node
+        return node
+
+    def evaluate(self, *args, context= None):
+        """
+        Returns the actions to execute when every condition function takes the same
+        arguments, e.g. a single record.
+
+        :param args: the arguments passed to each condition function
+        :type args: tuple
+
+        :param context: the record's decision_context, see new_context(); a new one is 
+            created when needed if not given
+        :type context: decision_context
+
+        :rtype: tuple of callables
+        """
+        if not self.compiled:
+            self.compile()
+
+        if self.profile is not None:
+            return self.evaluate_profiled(args, context)
+
+        conditions = self.conditions
+        condition_requires = self.condition_requires
+        node = self.tree
+        while node.key is not None:
+            if node.key in condition_requires:
+                if context is None:
+                    context = decision_context(self.loaders, args)
+                result = conditions[node.key](*args, context)
+            else:
+                result = conditions[node.key](*args)
+            node = node.true if result else node.false
+        return node.actions
+
+    def evaluate_profiled(self, args, context):
+        """evaluate() while profiling is enabled; times every condition called."""
+        if context is None:
+            self.profile.add_records(1)
+
+        conditions = self.conditions
+        condition_requires = self.condition_requires
+        timings = []
+        node = self.tree
+        while node.key is not None:
+            start = time.perf_counter()
+            if node.key in condition_requires:
+                if context is None:
+                    context = decision_context(self.loaders, args)
+                result = conditions[node.key](*args, context)
+            else:
+                result = conditions[node.key](*args)
+            timings.append((node.key, time.perf_counter() - start))
+            node = node.true if result else node.false
+
+        self.profile.add_evaluations(timings, node.cases)
+        return node.actions
+
+    def condition_values(self, *args):
+        """
+        Evaluates every condition, e.g. to record why a record was rejected.
+
+        :param args: the arguments passed to each condition function
+        :type args: tuple
+
+        :return: the result of each condition keyed by the condition function's name
+        :rtype: dict
+        """
+        context = decision_context(self.loaders, args)
+        values = {}
+        for key, condition in self.conditions.items():
+            if key in self.condition_requires:
+                values[condition.__name__] = bool(condition(*args, context))
+            else:
+                values[condition.__name__] = bool(condition(*args))
+        return values
+
+    def load_contexts(self, key, records, contexts):
+        """
+        Makes sure the contexts hold the data required by the condition with code number key, 
+        loading what is missing with one call to each batch loader.
+        """
+        for name in self.condition_requires.get(key, ()):
+            missing = [index for index, context in enumerate(contexts) if name not in context]
+            if not missing:
+                continue
+            if name in self.batch_loaders:
+                values = self.batch_loaders[name]([records[index] for index in missing])
+                for index, value in zip(missing, values):
+                    contexts[index][name] = value
+            else:
+                for index in missing:
+                    contexts[index][name]
+
+    def condition_column(self, key, records, contexts= None):
+        """
+        Computes the condition with code number key for every record.
+
+        :param key: code number of the condition
+        :type key: int
+
+        :param records: the records to evaluate
+        :type records: list
+
+        :param contexts: the records' decision_contexts, required if the condition declares 
+            'requires'
+        :type contexts: list
+
+        :rtype: numpy.ndarray of bool
+        """
+        requires = key in self.condition_requires
+        if requires:
+            self.load_contexts(key, records, contexts)
+
+        if key in self.batch_conditions:
+            if requires:
+                column = self.batch_conditions[key](records, contexts)
+            else:
+                column = self.batch_conditions[key](records)
+            column = np.asarray(column, dtype= bool)
+            if column.shape != (len(records),):
+                raise ValueError(
+                    'batch function for ' + self.conditions[key].__name__ + ' returned the wrong number of values'
+                )
+            return column
+
+        condition = self.conditions[key]
+        if requires:
+            values = (bool(condition(record, context)) for record, context in zip(records, contexts))
+        else:
+            values = (bool(condition(record)) for record in records)
+        return np.fromiter(values, dtype= bool, count= len(records))
+
+    def evaluate_batch(self, records, contexts= None):
+        """
+        Returns the actions to execute for each of many records. The records are pushed
+        through the decision tree together: at every node the node's condition is computed
+        as one boolean column over the records that reached it (using the condition's
+        batch_function when it has one) and the index array is split on that column. Data 
+        declared with 'requires' is loaded for all the records at a node at once.
+
+        :param records: the records to evaluate; each is passed as the only argument to the 
+            condition functions
+        :type records: iterable
+
+        :param contexts: the records' decision_contexts, in record order; pass the same list 
+            to repeated calls to load each record's data only once
+        :type contexts: list
+
+        :return: an action plan, i.e. the tuple of actions for each record, in record order
+        :rtype: list of tuples of callables
+        """
+        if not self.compiled:
+            self.compile()
+
+        records = list(records)
+        plan = [()] * len(records)
+        profile = self.profile
+        if contexts is None:
+            if profile is not None:
+                profile.add_records(len(records))
+            contexts = [decision_context(self.loaders, (record,)) for record in records]
+
+        stack = [(self.tree, np.arange(len(records)))]
+        while stack:
+            node, indices = stack.pop()
+            if not len(indices):
+                continue
+
+            if node.key is None:
+                for index in indices:
+                    plan[index] = node.actions
+                if profile is not None:
+                    profile.add_evaluations((), node.cases, len(indices))
+                continue
+
+            if profile is not None:
+                start = time.perf_counter()
+            column = self.condition_column(
+                node.key, 
+                [records[index] for index in indices], 
+                [contexts[index] for index in indices]
+            )
+            if profile is not None:
+                profile.add_condition(node.key, len(indices), time.perf_counter() - start)
+            stack.append((node.true, indices[column]))
+            stack.append((node.false, indices[~column]))
+
+        return plan
             
     def get_actions(self, condition_args):
         """
@@ -201,49 +696,115 @@ class decision_table:
             
         if len(condition_args) < len(self.conditions):
             raise ValueError('not all conditions given')
-        
-        all_callable = all(callable(condition) for condition in list(condition_args.keys()))
-        all_non_callable = all(not callable(condition) for condition in list(condition_args.keys()))
-        if not (all_callable or all_non_callable):
+
+        if not self.compiled:
+            self.compile()
+
+        # condition_args is keyed either entirely by code number or entirely by condition function
+        if all(key in self.conditions for key in condition_args):
+            coded_args = condition_args
+        elif all(key in self.condition_codes for key in condition_args):
+            coded_args = {self.condition_codes[key]: value for key, value in condition_args.items()}
+        elif all(callable(key) for key in condition_args):
+            raise KeyError('one or more functions given in condition_args does not exist in self.conditions')
+        else:
             raise TypeError("keys in condition_args are either not all callable or not all non-callable")
-            
-        if all_callable:
-            # check to make sure that all given condition functions exist in decision table already
-            if not set(list(self.conditions.values())) <= set(list(condition_args.keys())):
-                raise KeyError('one or more functions given in condition_args does not exist in self.conditions')
-            
-            coded_conditions = {}
-            # if conditions are given by function,
-            # convert to coded value
 
-            for key in self.conditions.keys():
-                coded_conditions[key] = condition_args[self.conditions[key]]
-            condition_args = coded_conditions
-            
-        requested_actions = []
-        
-        # for each case
-        for case, case_info in self.cases.items():
-            conditions = {}
-            # for each key (code number) in self.conditions
-            for key in list(self.conditions.keys()):
-                # execute each condition function using the arguments given and store results
-                if case_info['result'][key] != 0:
-                    conditions[key] = self.to_one_neg_one(self.conditions[key](*condition_args[key]))
-                else:
-                    conditions[key] = 0
-            
-            #print('case name: ', case_info['name'])
-            #print('case actions: ', [self.actions[x].__name__  for x in case_info['actions']])
-            #print('case conditions: \t', case_info['result'])
-            #print('current conditions: \t', conditions)
-            if conditions == case_info['result']:
-                actions = []
-                for action_code in case_info['actions']:
-                    actions.append(self.actions[action_code])
-                requested_actions += actions
-                
-        return requested_actions
+        conditions = self.conditions
+        profile = self.profile
+        timings = []
+        contexts = {}
+        node = self.tree
+        while node.key is not None:
+            args = coded_args[node.key]
+            if profile is not None:
+                start = time.perf_counter()
+            if node.key in self.condition_requires:
+                # conditions given the same arguments share a context
+                context_key = tuple(id(arg) for arg in args)
+                if context_key not in contexts:
+                    contexts[context_key] = decision_context(self.loaders, args)
+                result = conditions[node.key](*args, contexts[context_key])
+            else:
+                result = conditions[node.key](*args)
+            if profile is not None:
+                timings.append((node.key, time.perf_counter() - start))
+            node = node.true if result else node.false
+
+        if profile is not None:
+            profile.add_records(1)
+            profile.add_evaluations(timings, node.cases)
+        return list(node.actions)
+
+    #---profiling---#
+    def enable_profiling(self):
+        """
+        Starts counting condition calls and time, case matches and evaluations per record.
+        While profiling is off evaluation only pays for one attribute check.
+        """
+        if self.profile is None:
+            self.profile = decision_profile()
+
+    def disable_profiling(self):
+        """Stops profiling and discards the counters."""
+        self.profile = None
+
+    def reset_profiling(self):
+        if self.profile is not None:
+            self.profile.reset()
+
+    def profile_snapshot(self):
+        """
+        Returns the counters collected since profiling was enabled or last reset.
+
+        :return: None if profiling is disabled, otherwise a JSON serializable dictionary with
+            the totals, a row per condition (calls, total and mean seconds) and a row per case
+            (matches); conditions and cases are listed in code number order
+        :rtype: dict
+        """
+        profile = self.profile
+        if profile is None:
+            return None
+
+        with profile.lock:
+            condition_calls = dict(profile.condition_calls)
+            condition_time = dict(profile.condition_time)
+            case_matches = dict(profile.case_matches)
+            records = profile.records
+            evaluations = profile.evaluations
+            unmatched = profile.unmatched
+            started_at = profile.started_at
+
+        conditions = []
+        for key, condition in self.conditions.items():
+            calls = condition_calls.get(key, 0)
+            seconds = condition_time.get(key, 0.0)
+            conditions.append({
+                'code': key,
+                'name': condition.__name__,
+                'calls': calls,
+                'total_seconds': seconds,
+                'mean_seconds': seconds / calls if calls else 0.0,
+            })
+
+        cases = []
+        for key, case_info in self.cases.items():
+            cases.append({
+                'code': key,
+                'name': case_info.get('name', str(key)),
+                'matches': case_matches.get(key, 0),
+            })
+
+        return {
+            'name': self.name,
+            'seconds': time.time() - started_at,
+            'records': records,
+            'evaluations': evaluations,
+            'evaluations_per_record': evaluations / records if records else 0.0,
+            'unmatched': unmatched,
+            'conditions': conditions,
+            'cases': cases,
+        }
     
     def __str__(self):
         cases_row = [[''] + list(self.cases.keys())]
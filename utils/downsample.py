@@ -0,0 +1,115 @@
+import numpy as np
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Selects n_out points of a series with the Largest-Triangle-Three-Buckets algorithm, which
+    keeps the visual shape of a line chart (peaks, troughs, trends) with far fewer points. The
+    first and last points are always kept; every other point is the one in its bucket that
+    forms the largest triangle with the point kept before it and the mean of the next bucket.
+
+    :param x: the x values, increasing
+    :type x: numpy.ndarray
+
+    :param y: the y values, without NaNs
+    :type y: numpy.ndarray
+
+    :param n_out: the number of points to keep, at least 3
+    :type n_out: int
+
+    :return: the indices of the kept points, increasing
+    :rtype: numpy.ndarray of int
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype= float)
+    y = np.asarray(y, dtype= float)
+    # bucket edges over the points between the first and the last
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    selected = np.empty(n_out, dtype= int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        # twice the triangle areas, which is enough to compare them
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous]) -
+            (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return selected
+
+def resample_last(frame, resolution):
+    """
+    Resamples a frame indexed by day to one row per week or month, holding the last value 
+    of each column in the period; each row is labelled with the last day of its period.
+
+    :param frame: the frame, indexed by a daily pandas.DatetimeIndex
+    :type frame: pandas.DataFrame
+
+    :param resolution: 'daily', 'weekly' or 'monthly'
+    :type resolution: str
+
+    :rtype: pandas.DataFrame
+    """
+    days = frame.index
+    if resolution == 'daily':
+        return frame
+    elif resolution == 'weekly':
+        # whole weeks, starting on Mondays
+        keys = ((days - days[0]).days + days[0].weekday()) // 7
+    elif resolution == 'monthly':
+        keys = days.year * 12 + days.month
+    else:
+        raise ValueError("resolution must be 'daily', 'weekly' or 'monthly'")
+
+    keys = np.asarray(keys)
+    last = np.flatnonzero(np.r_[keys[1:] != keys[:-1], True])
+    resampled = frame.groupby(keys).last()
+    resampled.index = days[last]
+    return resampled
+
+def downsample_frame(frame, points):
+    """
+    Reduces a frame of aligned series (one per column, NaN where a series has no value) to 
+    about points rows for charting. Each series keeps its shape-defining points (see 
+    lttb_indices) out of an equal share of the budget and the frame keeps the union of the 
+    rows any series kept, so the series stay aligned on one shared axis of at most points rows.
+
+    :param frame: the series to downsample
+    :type frame: pandas.DataFrame
+
+    :param points: the maximum number of rows to keep
+    :type points: int
+
+    :rtype: pandas.DataFrame
+    """
+    if len(frame) <= points or not len(frame.columns):
+        return frame
+
+    budget = max(3, points // len(frame.columns))
+    values = frame.to_numpy(dtype= float)
+    kept = []
+    for column in range(values.shape[1]):
+        positions = np.flatnonzero(~np.isnan(values[:, column]))
+        if len(positions) > budget:
+            positions = positions[lttb_indices(positions, values[positions, column], budget)]
+        kept.append(positions)
+    kept = np.unique(np.concatenate(kept))
+    if not len(kept):
+        # no series has any value
+        kept = np.array([0, len(frame) - 1])
+    return frame.iloc[kept]
@@ -0,0 +1,61 @@
+import bisect
+
+
+class TickerIndex:
+    """
+    An in-memory index of securities for prefix (autocomplete) search. The tickers and the
+    names are each kept in one sorted list, so the matches of a prefix are a contiguous run
+    found with two binary searches, in O(log n) however many securities there are.
+    """
+
+    def __init__(self, securities):
+        """
+        :param securities: the ticker and name of each security
+        :type securities: iterable of (str, str)
+        """
+        self.names = dict(securities)
+        # ticker keys are upper case and name keys lower case, so searches ignore case
+        by_ticker = sorted((ticker.upper(), ticker) for ticker in self.names)
+        self.ticker_keys = [key for key, ticker in by_ticker]
+        self.tickers = [ticker for key, ticker in by_ticker]
+        by_name = sorted((name.lower(), ticker) for ticker, name in self.names.items() if name)
+        self.name_keys = [key for key, ticker in by_name]
+        self.name_tickers = [ticker for key, ticker in by_name]
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def search(self, prefix, limit= 10):
+        """
+        Finds the securities whose ticker or name starts with prefix, ignoring case. Ticker
+        matches come first, in ticker order, then name matches, in name order.
+
+        :param prefix: the start of a ticker or name
+        :type prefix: str
+
+        :param limit: the most matches to return
+        :type limit: int
+
+        :return: the ticker and name of each match
+        :rtype: list of (str, str)
+        """
+        prefix = prefix.strip()
+        if not prefix or limit < 1:
+            return []
+
+        matches = prefix_range(self.ticker_keys, self.tickers, prefix.upper(), limit)
+        if len(matches) < limit:
+            found = set(matches)
+            for ticker in prefix_range(self.name_keys, self.name_tickers, prefix.lower(), limit):
+                if ticker not in found:
+                    matches.append(ticker)
+                    if len(matches) == limit:
+                        break
+        return [(ticker, self.names[ticker]) for ticker in matches]
+
+
+def prefix_range(keys, values, prefix, limit):
+    """Returns up to limit values whose sorted keys start with prefix."""
+    start = bisect.bisect_left(keys, prefix)
+    end = min(start + limit, bisect.bisect_left(keys, prefix + '\U0010ffff', lo= start))
+    return values[start:end]